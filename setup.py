@@ -79,9 +79,7 @@ setup(
         "safdie>=2.0.0,<3.0",
     ],
     extras_require={
-        # eg:
-        #   'rst': ['docutils>=0.11'],
-        #   ':python_version=="2.6"': ['argparse'],
+        "async": ["aiohttp>=3.7.4,<4.0"],
     },
     entry_points={
         "console_scripts": [
@@ -91,6 +89,10 @@ setup(
             "boox = dejima.sources.boox:BooxSource",
             "lln-json = dejima.sources.lln:LLNJsonSource",
         ],
-        "dejima.commands": ["import = dejima.commands.import:ImportCommand"],
+        "dejima.commands": [
+            "batch-import = dejima.commands.batch_import:BatchImportCommand",
+            "benchmark = dejima.commands.benchmark:BenchmarkCommand",
+            "import = dejima.commands.import:ImportCommand",
+        ],
     },
 )
@@ -1,11 +1,21 @@
+from __future__ import annotations
+
 import dataclasses
+import gzip
 import json
+import time
 from typing import Any
+from typing import Callable
 from typing import Dict
 from typing import List
 from typing import Optional
+from typing import Tuple
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from . import metrics
 
 
 @dataclasses.dataclass
@@ -46,6 +56,26 @@ class AnkiNote:
     tags: List[str]
 
 
+@dataclasses.dataclass
+class AnkiActionResult:
+    action: str
+    result: Any = None
+    error: Optional[str] = None
+
+
+ActionCallback = Callable[[AnkiActionResult], None]
+
+# Seconds to wait for a connection to AnkiConnect and for its response.
+DEFAULT_TIMEOUT: Tuple[float, float] = (10, 300)
+
+# Errors AnkiConnect reports while Anki is temporarily unable to handle
+# requests, e.g. while it is syncing or switching profiles.
+TRANSIENT_ERRORS = ["collection is not available"]
+
+# Responses, e.g. from a proxy, showing that a request was not acted upon.
+RETRY_STATUSES = [502, 503, 504]
+
+
 class AnkiError(Exception):
     pass
 
@@ -68,39 +98,281 @@ def escape(term: str):
     return f'"{term}"'
 
 
+def _is_transient(error: str) -> bool:
+    return any(message in error for message in TRANSIENT_ERRORS)
+
+
+def _get_timer_name(request: Dict[str, Any]) -> str:
+    # Batched actions are timed by what they were batching.
+    name = request["action"]
+    if name == "multi":
+        actions = sorted(
+            {action["action"] for action in request.get("params", {})["actions"]}
+        )
+        name = f"multi:{'+'.join(actions)}"
+
+    return f"anki.{name}"
+
+
+def _encode_request(
+    request: Dict[str, Any], compress_threshold: Optional[int] = None
+) -> Tuple[bytes, Dict[str, str]]:
+    payload = json.dumps(request, ensure_ascii=False, separators=(",", ":")).encode(
+        "utf-8"
+    )
+    headers = {"Content-Type": "application/json"}
+
+    if compress_threshold is not None and len(payload) > compress_threshold:
+        payload = gzip.compress(payload, compresslevel=1)
+        headers["Content-Encoding"] = "gzip"
+
+    return payload, headers
+
+
+def _build_action(action: str, params: Dict[str, Any] = None) -> Dict[str, Any]:
+    return {
+        "action": action,
+        "version": 6,
+        **({"params": params} if params is not None else {}),
+    }
+
+
+def _get_add_note_params(
+    note: AnkiNote, options: AnkiNoteOptions = None
+) -> Dict[str, Any]:
+    note_data = dataclasses.asdict(note)
+    if options is not None:
+        note_data["options"] = dataclasses.asdict(options)
+
+    return {"note": note_data}
+
+
+def _get_update_note_params(id: int, note: AnkiNote) -> Dict[str, Any]:
+    note_data = dataclasses.asdict(note)
+    note_data["id"] = id
+
+    return {"note": note_data}
+
+
+def _parse_note_info(result: Dict[str, Any]) -> AnkiNote:
+    return AnkiNote(
+        modelName=result.get("modelName", ""),
+        deckName=result.get("deckName", ""),
+        fields={k: v["value"] for k, v in result.get("fields", {}).items()},
+        tags=result.get("tags", []),
+    )
+
+
+def _parse_multi_results(
+    actions: List[Dict[str, Any]], results: List[Any]
+) -> List[AnkiActionResult]:
+    processed: List[AnkiActionResult] = []
+    for action, result in zip(actions, results):
+        # Actions sent with a version wrap their own result and error;
+        # older AnkiConnect releases return the bare result instead.
+        if isinstance(result, dict) and set(result.keys()) == {"result", "error"}:
+            processed.append(
+                AnkiActionResult(action["action"], result["result"], result["error"])
+            )
+        else:
+            processed.append(AnkiActionResult(action["action"], result))
+
+    return processed
+
+
+class ActionBatch:
+    _connection: Connection
+    _size: int
+    _queue: List[Tuple[Dict[str, Any], Optional[ActionCallback]]]
+
+    def __init__(self, connection: Connection, size: int = 50):
+        if size < 1:
+            raise ValueError("Batch size must be at least 1.")
+
+        self._connection = connection
+        self._size = size
+        self._queue = []
+
+        super().__init__()
+
+    def __len__(self) -> int:
+        return len(self._queue)
+
+    def __enter__(self) -> ActionBatch:
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        if exc_type is None:
+            self.flush()
+
+    def queue(
+        self,
+        action: str,
+        params: Dict[str, Any] = None,
+        callback: ActionCallback = None,
+    ) -> None:
+        self._queue.append((_build_action(action, params), callback))
+
+        if len(self._queue) >= self._size:
+            self.flush()
+
+    def add_note(
+        self,
+        note: AnkiNote,
+        options: AnkiNoteOptions = None,
+        callback: ActionCallback = None,
+    ) -> None:
+        self.queue("addNote", _get_add_note_params(note, options), callback)
+
+    def update_note(
+        self, id: int, note: AnkiNote, callback: ActionCallback = None
+    ) -> None:
+        self.queue("updateNoteFields", _get_update_note_params(id, note), callback)
+
+    def flush(self) -> List[AnkiActionResult]:
+        if not self._queue:
+            return []
+
+        pending, self._queue = self._queue, []
+        results = self._connection.multi([action for action, _ in pending])
+
+        for result, (_, callback) in zip(results, pending):
+            if callback is not None:
+                callback(result)
+
+        return results
+
+
+class Transport:
+    """Sends actions to AnkiConnect over a pool of persistent connections."""
+
+    _url: str
+    _keep_alive: bool
+    _timeout: Tuple[float, float]
+    _retries: int
+    _backoff: float
+    _compress_threshold: Optional[int]
+
+    def __init__(
+        self,
+        url: str,
+        pool_size: int = 10,
+        keep_alive: bool = True,
+        timeout: Tuple[float, float] = DEFAULT_TIMEOUT,
+        retries: int = 3,
+        backoff: float = 0.5,
+        compress_threshold: int = None,
+    ):
+        self._url = url
+        self._keep_alive = keep_alive
+        self._timeout = timeout
+        self._retries = retries
+        self._backoff = backoff
+        self._compress_threshold = compress_threshold
+
+        self._session = requests.Session()
+        self._session.mount(
+            "http://",
+            HTTPAdapter(
+                pool_connections=1,
+                pool_maxsize=pool_size,
+                # Only failures to connect and responses AnkiConnect could
+                # not have acted upon are retried; a request that timed out
+                # may still have been carried out.
+                max_retries=Retry(
+                    total=None,
+                    connect=retries,
+                    read=0,
+                    status=retries,
+                    other=0,
+                    allowed_methods=None,
+                    status_forcelist=RETRY_STATUSES,
+                    backoff_factor=backoff,
+                ),
+            ),
+        )
+        if not keep_alive:
+            self._session.headers["Connection"] = "close"
+
+        super().__init__()
+
+    def close(self) -> None:
+        self._session.close()
+
+    def encode(self, request: Dict[str, Any]) -> Tuple[bytes, Dict[str, str]]:
+        return _encode_request(request, self._compress_threshold)
+
+    def send(self, request: Dict[str, Any]) -> Any:
+        payload, headers = self.encode(request)
+        timer = metrics.get_timer(_get_timer_name(request))
+
+        for attempt in range(self._retries + 1):
+            with timer.time():
+                response = self._session.post(
+                    self._url, data=payload, headers=headers, timeout=self._timeout
+                )
+            metrics.get_counter("anki.requests").add()
+            metrics.get_counter("anki.bytes_sent").add(len(payload))
+            response.raise_for_status()
+
+            result = response.json()
+            if result["error"] is None:
+                return result["result"]
+            elif attempt < self._retries and _is_transient(result["error"]):
+                metrics.get_counter("anki.retries").add()
+                time.sleep(self._backoff * 2**attempt)
+                continue
+
+            raise AnkiError(result["error"])
+
+
 class Connection:
     _hostname: str
     _port: int
-
-    def __init__(self, hostname="127.0.0.1", port=8765):
+    _transport: Transport
+
+    def __init__(
+        self,
+        hostname="127.0.0.1",
+        port=8765,
+        pool_size=10,
+        keep_alive: bool = True,
+        timeout: Tuple[float, float] = DEFAULT_TIMEOUT,
+        retries: int = 3,
+        compress_threshold: int = None,
+    ):
         self._hostname = hostname
         self._port = port
-        self._connection = requests.Session()
+        self._transport = Transport(
+            f"http://{hostname}:{port}/",
+            pool_size=pool_size,
+            keep_alive=keep_alive,
+            timeout=timeout,
+            retries=retries,
+            compress_threshold=compress_threshold,
+        )
 
         super().__init__()
 
+    def __enter__(self) -> Connection:
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self._transport.close()
+
     def _dispatch(self, action: str, params: Dict[str, Any] = None) -> Any:
-        payload = json.dumps(
-            {
-                "action": action,
-                "version": 6,
-                **({"params": params} if params is not None else {}),
-            },
-            indent=4,
-            sort_keys=True,
-        )
-        request = self._connection.post(
-            f"http://{self._hostname}:{self._port}/",
-            data=payload,
-        )
-        request.raise_for_status()
+        return self._transport.send(_build_action(action, params))
 
-        result = request.json()
+    def multi(self, actions: List[Dict[str, Any]]) -> List[AnkiActionResult]:
+        results = self._dispatch("multi", {"actions": actions})
 
-        if result["error"] is not None:
-            raise AnkiError(result["error"])
+        return _parse_multi_results(actions, results)
 
-        return result["result"]
+    def batch(self, size: int = 50) -> ActionBatch:
+        return ActionBatch(self, size)
 
     def get_deck_names(self) -> List[str]:
         return self._dispatch("deckNames")
@@ -111,32 +383,42 @@ class Connection:
     def create_model(self, model: AnkiModel) -> Dict:
         return self._dispatch("createModel", dataclasses.asdict(model))
 
+    def get_model_field_names(self, model_name: str) -> List[str]:
+        return self._dispatch("modelFieldNames", {"modelName": model_name})
+
+    def get_model_templates(self, model_name: str) -> Dict[str, Dict[str, str]]:
+        return self._dispatch("modelTemplates", {"modelName": model_name})
+
     def add_note(self, note: AnkiNote, options: AnkiNoteOptions = None) -> int:
-        note_data = dataclasses.asdict(note)
-        if options is not None:
-            note_data.get("options", {}).update(dataclasses.asdict(options))
+        return self._dispatch("addNote", _get_add_note_params(note, options))
 
-        return self._dispatch("addNote", {"note": note_data})
+    def add_notes(
+        self, notes: List[AnkiNote], options: AnkiNoteOptions = None
+    ) -> List[Optional[int]]:
+        return self._dispatch(
+            "addNotes",
+            {"notes": [_get_add_note_params(note, options)["note"] for note in notes]},
+        )
 
     def update_note(self, id: int, note: AnkiNote) -> None:
-        note_data = dataclasses.asdict(note)
-        note_data["id"] = id
-
-        return self._dispatch("updateNoteFields", {"note": note_data})
+        return self._dispatch("updateNoteFields", _get_update_note_params(id, note))
 
     def get_note(self, id) -> AnkiNote:
         notes = self._dispatch("notesInfo", {"notes": [id]})
         if len(notes) == 0:
             raise AnkiNoteDoesNotExist(id)
 
-        result = notes[0]
+        return _parse_note_info(notes[0])
 
-        return AnkiNote(
-            modelName=result.get("modelName", ""),
-            deckName=result.get("deckName", ""),
-            fields={k: v["value"] for k, v in result.get("fields", {}).items()},
-            tags=result.get("tags", []),
-        )
+    def get_notes(self, ids: List[int]) -> Dict[int, AnkiNote]:
+        notes = self._dispatch("notesInfo", {"notes": ids})
+
+        # Notes that no longer exist are returned as empty objects.
+        return {
+            result["noteId"]: _parse_note_info(result)
+            for result in notes
+            if result.get("noteId") is not None
+        }
 
     def find_notes(self, query: str) -> List[int]:
         query = query.replace("\n", " ")
@@ -0,0 +1,816 @@
+from __future__ import annotations
+
+import base64
+import hashlib
+import html
+import itertools
+import json
+import os
+import re
+import shutil
+import sqlite3
+import string
+import tempfile
+import threading
+import time
+import zipfile
+from collections import defaultdict
+from typing import Any
+from typing import Dict
+from typing import Iterable
+from typing import List
+from typing import Match
+from typing import Optional
+from typing import Set
+from typing import Tuple
+
+import requests
+
+from . import metrics
+from .api import AnkiActionResult
+from .api import AnkiError
+from .api import AnkiMediaUpload
+from .api import AnkiModel
+from .api import AnkiNote
+from .api import AnkiNoteOptions
+from .backends import Backend
+from .backends import ModelInfo
+
+# The legacy collection schema, version 11, which every release of Anki
+# can import packages in.
+SCHEMA = """
+    CREATE TABLE col (
+        id integer PRIMARY KEY,
+        crt integer NOT NULL,
+        mod integer NOT NULL,
+        scm integer NOT NULL,
+        ver integer NOT NULL,
+        dty integer NOT NULL,
+        usn integer NOT NULL,
+        ls integer NOT NULL,
+        conf text NOT NULL,
+        models text NOT NULL,
+        decks text NOT NULL,
+        dconf text NOT NULL,
+        tags text NOT NULL
+    );
+    CREATE TABLE notes (
+        id integer PRIMARY KEY,
+        guid text NOT NULL,
+        mid integer NOT NULL,
+        mod integer NOT NULL,
+        usn integer NOT NULL,
+        tags text NOT NULL,
+        flds text NOT NULL,
+        sfld integer NOT NULL,
+        csum integer NOT NULL,
+        flags integer NOT NULL,
+        data text NOT NULL
+    );
+    CREATE TABLE cards (
+        id integer PRIMARY KEY,
+        nid integer NOT NULL,
+        did integer NOT NULL,
+        ord integer NOT NULL,
+        mod integer NOT NULL,
+        usn integer NOT NULL,
+        type integer NOT NULL,
+        queue integer NOT NULL,
+        due integer NOT NULL,
+        ivl integer NOT NULL,
+        factor integer NOT NULL,
+        reps integer NOT NULL,
+        lapses integer NOT NULL,
+        left integer NOT NULL,
+        odue integer NOT NULL,
+        odid integer NOT NULL,
+        flags integer NOT NULL,
+        data text NOT NULL
+    );
+    CREATE TABLE revlog (
+        id integer PRIMARY KEY,
+        cid integer NOT NULL,
+        usn integer NOT NULL,
+        ease integer NOT NULL,
+        ivl integer NOT NULL,
+        lastIvl integer NOT NULL,
+        factor integer NOT NULL,
+        time integer NOT NULL,
+        type integer NOT NULL
+    );
+    CREATE TABLE graves (
+        usn integer NOT NULL,
+        oid integer NOT NULL,
+        type integer NOT NULL
+    );
+    CREATE INDEX ix_notes_usn ON notes (usn);
+    CREATE INDEX ix_cards_usn ON cards (usn);
+    CREATE INDEX ix_revlog_usn ON revlog (usn);
+    CREATE INDEX ix_cards_nid ON cards (nid);
+    CREATE INDEX ix_cards_sched ON cards (did, queue, due);
+    CREATE INDEX ix_revlog_cid ON revlog (cid);
+    CREATE INDEX ix_notes_csum ON notes (csum);
+"""
+
+DEFAULT_DECK_ID = 1
+DEFAULT_DECK_CONFIG = {
+    "id": 1,
+    "name": "Default",
+    "mod": 0,
+    "usn": 0,
+    "maxTaken": 60,
+    "autoplay": True,
+    "timer": 0,
+    "replayq": True,
+    "dyn": False,
+    "new": {
+        "delays": [1, 10],
+        "ints": [1, 4, 7],
+        "initialFactor": 2500,
+        "order": 1,
+        "perDay": 20,
+        "bury": False,
+    },
+    "rev": {
+        "perDay": 200,
+        "ease4": 1.3,
+        "ivlFct": 1,
+        "maxIvl": 36500,
+        "bury": False,
+        "hardFactor": 1.2,
+    },
+    "lapse": {
+        "delays": [10],
+        "mult": 0,
+        "minInt": 1,
+        "leechFails": 8,
+        "leechAction": 1,
+    },
+}
+LATEX_PRE = (
+    "\\documentclass[12pt]{article}\n"
+    "\\special{papersize=3in,5in}\n"
+    "\\usepackage[utf8]{inputenc}\n"
+    "\\usepackage{amssymb,amsmath}\n"
+    "\\pagestyle{empty}\n"
+    "\\setlength{\\parindent}{0in}\n"
+    "\\begin{document}\n"
+)
+LATEX_POST = "\\end{document}"
+
+# The characters Anki encodes note GUIDs in.
+GUID_CHARACTERS = string.ascii_letters + string.digits + "!#$%&()*+,-./:;<=>?@[]^_`{|}~"
+
+FIELD_SEPARATOR = "\x1f"
+TEMPLATE_SECTION = re.compile(r"{{([#^])\s*([^}]+?)\s*}}(.*?){{/\s*\2\s*}}", re.S)
+TEMPLATE_FIELD = re.compile(r"{{\s*([^#^/!}][^}]*?)\s*}}")
+CLOZE_NUMBER = re.compile(r"{{c(\d+)::")
+HTML_TAG = re.compile(r"<[^>]*>")
+
+
+def get_guid(parts: Iterable[str]) -> str:
+    # 64 bits, as Anki's own GUIDs have.
+    digest = hashlib.sha256(FIELD_SEPARATOR.join(parts).encode("utf-8")).digest()
+    number = int.from_bytes(digest[:8], "big")
+    characters: List[str] = []
+    while True:
+        number, remainder = divmod(number, len(GUID_CHARACTERS))
+        characters.append(GUID_CHARACTERS[remainder])
+        if not number:
+            break
+
+    return "".join(reversed(characters))
+
+
+def strip_html(text: str) -> str:
+    return html.unescape(HTML_TAG.sub("", text)).strip()
+
+
+def get_checksum(text: str) -> int:
+    # Anki finds duplicates by the checksum of the first field.
+    return int(hashlib.sha1(strip_html(text).encode("utf-8")).hexdigest()[:8], 16)
+
+
+def get_template_field_names(template: str) -> List[str]:
+    return [
+        match.group(1).split(":")[-1].strip()
+        for match in TEMPLATE_FIELD.finditer(template)
+    ]
+
+
+def shows_field(template: str, fields: Dict[str, str]) -> bool:
+    # Anki generates a card for a template if the front it renders shows
+    # at least one field that is not empty.
+    def expand(match: Match) -> str:
+        kind, name, body = match.groups()
+        return body if bool(fields.get(name, "").strip()) == (kind == "#") else ""
+
+    previous = None
+    while previous != template:
+        previous, template = template, TEMPLATE_SECTION.sub(expand, template)
+
+    return any(
+        fields.get(name, "").strip() for name in get_template_field_names(template)
+    )
+
+
+class PackageWriter:
+    """Writes notes, their note types and media into an Anki package.
+
+    Notes and note types are kept in a collection that is written in one
+    transaction and packaged, with the media, into an ``.apkg`` at
+    ``path`` once the writer is closed without error; Anki need not be
+    running.
+    """
+
+    _path: str
+    _directory: str
+    _collection: sqlite3.Connection
+    _archive: zipfile.ZipFile
+    # The archive member holding each media file by its name.
+    _media_members: Dict[str, str]
+    _models: Dict[str, Dict[str, Any]]
+    _models_by_id: Dict[int, Dict[str, Any]]
+    _decks: Dict[str, Dict[str, Any]]
+    _deck_names: Dict[int, str]
+    # Notes by their deck, and by their deck and the value of each of
+    # their fields, casefolded as Anki's searches compare them.
+    _notes_by_deck: Dict[str, Set[int]]
+    _notes_by_value: Dict[Tuple[str, str, str], Set[int]]
+    _guids: Set[str]
+
+    def __init__(self, path: str):
+        self._path = path
+        self._lock = threading.Lock()
+        self._directory = tempfile.mkdtemp(prefix="dejima-apkg-")
+        self._collection = sqlite3.connect(
+            os.path.join(self._directory, "collection.anki2"),
+            isolation_level=None,
+            check_same_thread=False,
+        )
+        self._collection.executescript(SCHEMA)
+        self._collection.execute("BEGIN")
+        self._archive_path = os.path.join(self._directory, "package.apkg")
+        self._archive = zipfile.ZipFile(
+            self._archive_path,
+            "w",
+            compression=zipfile.ZIP_DEFLATED,
+        )
+        self._media_members = {}
+        self._models = {}
+        self._models_by_id = {}
+        self._decks = {}
+        self._deck_names = {}
+        self._add_deck(DEFAULT_DECK_ID, "Default")
+        self._notes_by_deck = defaultdict(set)
+        self._notes_by_value = defaultdict(set)
+        self._guids = set()
+        # Ids are creation times in milliseconds, as they are in Anki.
+        self._next_id = int(time.time() * 1000)
+        self._next_position = 1
+        self._next_member = 0
+        self._closed = False
+
+        super().__init__()
+
+    def __enter__(self) -> PackageWriter:
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+
+    @property
+    def path(self) -> str:
+        return self._path
+
+    def close(self) -> None:
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+
+            with metrics.get_timer("apkg.write").time():
+                self._write_collection()
+                self._collection.execute("COMMIT")
+                self._collection.close()
+
+                self._archive.write(
+                    os.path.join(self._directory, "collection.anki2"),
+                    "collection.anki2",
+                )
+                self._archive.writestr(
+                    "media",
+                    json.dumps(
+                        {
+                            member: filename
+                            for filename, member in self._media_members.items()
+                        }
+                    ),
+                )
+                self._archive.close()
+
+                # The package appears at its path only once complete.
+                os.replace(self._archive_path, self._path)
+            shutil.rmtree(self._directory, ignore_errors=True)
+
+    def discard(self) -> None:
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+
+            self._collection.close()
+            self._archive.close()
+            shutil.rmtree(self._directory, ignore_errors=True)
+
+    def ensure_model(self, model: AnkiModel) -> ModelInfo:
+        with self._lock:
+            self._check_open()
+
+            if model.modelName not in self._models:
+                self._add_model(model)
+            stored = self._models[model.modelName]
+
+            return (
+                [field["name"] for field in stored["flds"]],
+                {
+                    template["name"]: {
+                        "Front": template["qfmt"],
+                        "Back": template["afmt"],
+                    }
+                    for template in stored["tmpls"]
+                },
+            )
+
+    @metrics.timed("apkg.add_note")
+    def add_note(
+        self, note: AnkiNote, allow_duplicate: bool = False, key: Optional[str] = None
+    ) -> int:
+        with self._lock:
+            self._check_open()
+
+            model = self._get_model(note.modelName)
+            fields = {
+                field["name"]: note.fields.get(field["name"], "")
+                for field in model["flds"]
+            }
+            first_field = next(iter(fields.values()), "")
+            if not first_field.strip():
+                raise AnkiError("cannot create note because it is empty")
+            if not allow_duplicate and self._is_duplicate(model, first_field):
+                raise AnkiError("cannot create note because it is a duplicate")
+
+            note_id = self._get_id()
+            self._collection.execute(
+                """
+                INSERT INTO notes (
+                    id, guid, mid, mod, usn, tags, flds, sfld, csum, flags, data
+                )
+                VALUES (?, ?, ?, 0, -1, ?, '', '', 0, 0, '')
+                """,
+                (
+                    note_id,
+                    self._get_guid(model, fields, key),
+                    model["id"],
+                    f" {' '.join(note.tags)} " if note.tags else "",
+                ),
+            )
+            self._write_note(note_id, model, fields)
+            self._index_note(note_id, note.deckName, fields)
+
+            self._add_cards(
+                note_id,
+                self._ensure_deck(note.deckName),
+                self._next_position,
+                self._get_card_ordinals(model, fields),
+            )
+            self._next_position += 1
+
+            return note_id
+
+    @metrics.timed("apkg.update_note")
+    def update_note(self, note_id: int, note: AnkiNote) -> None:
+        with self._lock:
+            self._check_open()
+
+            notes = self._read_notes([note_id])
+            if note_id not in notes:
+                raise AnkiError(f"Note was not found: {note_id}")
+
+            model, fields, _, deck_id, position = notes[note_id]
+            deck_name = self._deck_names[deck_id]
+            self._unindex_note(note_id, deck_name, fields)
+            fields.update(
+                (name, value) for name, value in note.fields.items() if name in fields
+            )
+            self._write_note(note_id, model, fields)
+            self._index_note(note_id, deck_name, fields)
+
+            # Fields that were empty may now call for more cards.
+            existing = {
+                ordinal
+                for ordinal, in self._collection.execute(
+                    "SELECT ord FROM cards WHERE nid = ?", (note_id,)
+                )
+            }
+            self._add_cards(
+                note_id,
+                deck_id,
+                position,
+                [
+                    ordinal
+                    for ordinal in self._get_card_ordinals(model, fields)
+                    if ordinal not in existing
+                ],
+            )
+
+    def get_notes(self, note_ids: List[int]) -> Dict[int, AnkiNote]:
+        with self._lock:
+            self._check_open()
+
+            return {
+                note_id: AnkiNote(
+                    model["name"], self._deck_names[deck_id], fields, tags
+                )
+                for note_id, (model, fields, tags, deck_id, _) in self._read_notes(
+                    note_ids
+                ).items()
+            }
+
+    def find_notes(self, deck_name: str, fields: Dict[str, str] = None) -> List[int]:
+        deck_key = deck_name.casefold()
+        with self._lock:
+            if not fields:
+                return sorted(self._notes_by_deck.get(deck_key, ()))
+
+            found: Set[int] = set()
+            for name, value in fields.items():
+                found.update(
+                    self._notes_by_value.get(
+                        (deck_key, name.casefold(), value.casefold()), ()
+                    )
+                )
+
+            return sorted(found)
+
+    @metrics.timed("apkg.store_media")
+    def store_media(self, filename: str, data: bytes) -> None:
+        with self._lock:
+            self._check_open()
+
+            # Media stored again under the same name replace what was
+            # stored before; the earlier copy is left unreferenced in the
+            # archive.
+            member = str(self._next_member)
+            self._next_member += 1
+            self._archive.writestr(member, data)
+            self._media_members[filename] = member
+
+    def _check_open(self) -> None:
+        if self._closed:
+            raise ValueError(f"{self._path} has already been written")
+
+    def _get_guid(
+        self, model: Dict[str, Any], fields: Dict[str, str], key: Optional[str]
+    ) -> str:
+        # GUIDs are derived from what the note is for, so that a package
+        # built again from the same input updates the notes a previous
+        # one added to Anki rather than adding them a second time.  Notes
+        # that would share one, such as duplicates without keys, are told
+        # apart by the order they were added in.
+        parts = [model["name"], *([key] if key is not None else fields.values())]
+        guid = get_guid(parts)
+        while guid in self._guids:
+            parts.append("")
+            guid = get_guid(parts)
+        self._guids.add(guid)
+
+        return guid
+
+    def _get_id(self) -> int:
+        self._next_id += 1
+        return self._next_id
+
+    def _add_deck(self, deck_id: int, name: str) -> None:
+        self._decks[name] = {
+            "id": deck_id,
+            "name": name,
+            "desc": "",
+            "mod": int(time.time()),
+            "usn": -1,
+            "lrnToday": [0, 0],
+            "revToday": [0, 0],
+            "newToday": [0, 0],
+            "timeToday": [0, 0],
+            "collapsed": False,
+            "browserCollapsed": False,
+            "dyn": 0,
+            "conf": 1,
+            "extendNew": 0,
+            "extendRev": 0,
+        }
+        self._deck_names[deck_id] = name
+
+    def _ensure_deck(self, name: str) -> int:
+        # Decks are created, along with their parents, as they are used.
+        parts = name.split("::")
+        for depth in range(1, len(parts) + 1):
+            deck_name = "::".join(parts[:depth])
+            if deck_name not in self._decks:
+                self._add_deck(self._get_id(), deck_name)
+
+        return self._decks[name]["id"]
+
+    def _add_model(self, model: AnkiModel) -> None:
+        field_names = model.inOrderFields
+        stored: Dict[str, Any] = {
+            "id": self._get_id(),
+            "name": model.modelName,
+            "type": 1 if model.isCloze else 0,
+            "mod": int(time.time()),
+            "usn": -1,
+            "sortf": 0,
+            "did": DEFAULT_DECK_ID,
+            "tmpls": [
+                {
+                    "name": template.Name,
+                    "ord": ordinal,
+                    "qfmt": template.Front,
+                    "afmt": template.Back,
+                    "did": None,
+                    "bqfmt": "",
+                    "bafmt": "",
+                }
+                for ordinal, template in enumerate(model.cardTemplates)
+            ],
+            "flds": [
+                {
+                    "name": field_name,
+                    "ord": ordinal,
+                    "sticky": False,
+                    "rtl": False,
+                    "font": "Arial",
+                    "size": 20,
+                    "media": [],
+                }
+                for ordinal, field_name in enumerate(field_names)
+            ],
+            "css": model.css,
+            "latexPre": LATEX_PRE,
+            "latexPost": LATEX_POST,
+            "latexsvg": False,
+            # Which fields each card needs, for releases of Anki that do
+            # not work this out from the templates themselves.
+            "req": [
+                [
+                    ordinal,
+                    "any",
+                    sorted(
+                        {
+                            field_names.index(name)
+                            for name in get_template_field_names(template.Front)
+                            if name in field_names
+                        }
+                    ),
+                ]
+                for ordinal, template in enumerate(model.cardTemplates)
+            ],
+            "tags": [],
+            "vers": [],
+        }
+        self._models[model.modelName] = stored
+        self._models_by_id[stored["id"]] = stored
+
+    def _get_model(self, name: str) -> Dict[str, Any]:
+        if name not in self._models:
+            raise AnkiError(f"model was not found: {name}")
+
+        return self._models[name]
+
+    def _is_duplicate(self, model: Dict[str, Any], first_field: str) -> bool:
+        # As in Anki, by the first field of notes of the same note type.
+        duplicates = self._collection.execute(
+            "SELECT flds FROM notes WHERE mid = ? AND csum = ?",
+            (model["id"], get_checksum(first_field)),
+        )
+        return any(
+            strip_html(flds.split(FIELD_SEPARATOR)[0]) == strip_html(first_field)
+            for flds, in duplicates
+        )
+
+    def _index_note(self, note_id: int, deck_name: str, fields: Dict[str, str]) -> None:
+        deck_key = deck_name.casefold()
+        self._notes_by_deck[deck_key].add(note_id)
+        for name, value in fields.items():
+            self._notes_by_value[(deck_key, name.casefold(), value.casefold())].add(
+                note_id
+            )
+
+    def _unindex_note(
+        self, note_id: int, deck_name: str, fields: Dict[str, str]
+    ) -> None:
+        deck_key = deck_name.casefold()
+        for name, value in fields.items():
+            key = (deck_key, name.casefold(), value.casefold())
+            self._notes_by_value[key].discard(note_id)
+            if not self._notes_by_value[key]:
+                del self._notes_by_value[key]
+
+    def _get_card_ordinals(
+        self, model: Dict[str, Any], fields: Dict[str, str]
+    ) -> List[int]:
+        if model["type"] == 1:
+            ordinals = sorted(
+                {
+                    int(number) - 1
+                    for value in fields.values()
+                    for number in CLOZE_NUMBER.findall(value)
+                }
+            )
+        else:
+            ordinals = [
+                template["ord"]
+                for template in model["tmpls"]
+                if shows_field(template["qfmt"], fields)
+            ]
+
+        # As in Anki, a note has at least one card.
+        return ordinals or [0]
+
+    def _write_note(
+        self, note_id: int, model: Dict[str, Any], fields: Dict[str, str]
+    ) -> None:
+        values = [fields.get(field["name"], "") for field in model["flds"]]
+        self._collection.execute(
+            "UPDATE notes SET mod = ?, flds = ?, sfld = ?, csum = ? WHERE id = ?",
+            (
+                int(time.time()),
+                FIELD_SEPARATOR.join(values),
+                strip_html(values[0]),
+                get_checksum(values[0]),
+                note_id,
+            ),
+        )
+
+    def _add_cards(
+        self, note_id: int, deck_id: int, position: int, ordinals: Iterable[int]
+    ) -> None:
+        self._collection.executemany(
+            """
+            INSERT INTO cards (
+                id, nid, did, ord, mod, usn, type, queue, due, ivl, factor,
+                reps, lapses, left, odue, odid, flags, data
+            )
+            VALUES (?, ?, ?, ?, ?, -1, 0, 0, ?, 0, 0, 0, 0, 0, 0, 0, 0, '')
+            """,
+            [
+                (self._get_id(), note_id, deck_id, ordinal, int(time.time()), position)
+                for ordinal in ordinals
+            ],
+        )
+
+    def _read_notes(
+        self, note_ids: List[int]
+    ) -> Dict[int, Tuple[Dict[str, Any], Dict[str, str], List[str], int, int]]:
+        notes: Dict[int, Tuple[Dict[str, Any], Dict[str, str], List[str], int, int]]
+        notes = {}
+        if not note_ids:
+            return notes
+
+        for note_id, mid, tags, flds, did, due in self._collection.execute(
+            f"""
+            SELECT notes.id, notes.mid, notes.tags, notes.flds, MIN(cards.did),
+                MIN(cards.due)
+            FROM notes
+            JOIN cards ON cards.nid = notes.id
+            WHERE notes.id IN ({', '.join('?' for _ in note_ids)})
+            GROUP BY notes.id
+            """,
+            note_ids,
+        ):
+            model = self._models_by_id[mid]
+            fields = dict(
+                zip(
+                    (field["name"] for field in model["flds"]),
+                    flds.split(FIELD_SEPARATOR),
+                )
+            )
+            notes[note_id] = (model, fields, tags.split(), did, due)
+
+        return notes
+
+    def _write_collection(self) -> None:
+        now = time.time()
+        conf = {
+            "activeDecks": [DEFAULT_DECK_ID],
+            "curDeck": DEFAULT_DECK_ID,
+            "newSpread": 0,
+            "collapseTime": 1200,
+            "timeLim": 0,
+            "estTimes": True,
+            "dueCounts": True,
+            "curModel": None,
+            "nextPos": self._next_position,
+            "sortType": "noteFld",
+            "sortBackwards": False,
+            "addToCur": True,
+        }
+        self._collection.execute(
+            """
+            INSERT INTO col (
+                id, crt, mod, scm, ver, dty, usn, ls, conf, models, decks,
+                dconf, tags
+            )
+            VALUES (1, ?, ?, ?, 11, 0, 0, 0, ?, ?, ?, ?, '{}')
+            """,
+            (
+                int(now // 86400 * 86400),
+                int(now * 1000),
+                int(now * 1000),
+                json.dumps(conf),
+                json.dumps(
+                    {str(model["id"]): model for model in self._models.values()}
+                ),
+                json.dumps({str(deck["id"]): deck for deck in self._decks.values()}),
+                json.dumps({"1": DEFAULT_DECK_CONFIG}),
+            ),
+        )
+
+
+class ApkgBackend(Backend):
+    """Writes an import's notes, note type and media into an Anki package."""
+
+    _writer: PackageWriter
+
+    def __init__(self, path: str):
+        self._writer = PackageWriter(path)
+
+        super().__init__()
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self._writer.__exit__(exc_type, exc_value, traceback)
+
+    def close(self) -> None:
+        self._writer.close()
+
+    def ensure_model(self, model: AnkiModel) -> ModelInfo:
+        return self._writer.ensure_model(model)
+
+    def find_notes(self, deck_name: str, fields: Dict[str, str] = None) -> List[int]:
+        return self._writer.find_notes(deck_name, fields)
+
+    def get_notes(self, ids: List[int]) -> Dict[int, AnkiNote]:
+        return self._writer.get_notes(ids)
+
+    def add_notes(
+        self,
+        notes: List[AnkiNote],
+        options: AnkiNoteOptions = None,
+        keys: List[Optional[str]] = None,
+    ) -> List[AnkiActionResult]:
+        allow_duplicate = options is not None and options.allowDuplicate
+
+        results: List[AnkiActionResult] = []
+        for note, key in zip(notes, keys or itertools.repeat(None)):
+            try:
+                note_id = self._writer.add_note(note, allow_duplicate, key)
+            except AnkiError as e:
+                results.append(AnkiActionResult("addNote", error=str(e)))
+            else:
+                results.append(AnkiActionResult("addNote", note_id))
+
+        return results
+
+    def update_notes(
+        self, updates: List[Tuple[int, AnkiNote]]
+    ) -> List[AnkiActionResult]:
+        results: List[AnkiActionResult] = []
+        for note_id, note in updates:
+            try:
+                self._writer.update_note(note_id, note)
+            except AnkiError as e:
+                results.append(AnkiActionResult("updateNoteFields", error=str(e)))
+            else:
+                results.append(AnkiActionResult("updateNoteFields"))
+
+        return results
+
+    def store_media_file(self, media: AnkiMediaUpload) -> str:
+        if media.data is not None:
+            data = base64.b64decode(media.data)
+        elif media.path is not None:
+            with open(media.path, "rb") as inf:
+                data = inf.read()
+        elif media.url is not None:
+            response = requests.get(media.url)
+            response.raise_for_status()
+            data = response.content
+        else:
+            raise AnkiError("You must provide a path, url or data field.")
+
+        self._writer.store_media(media.filename, data)
+
+        return media.filename
@@ -0,0 +1,224 @@
+from __future__ import annotations
+
+import asyncio
+import dataclasses
+from typing import Any
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+from . import metrics
+from .api import DEFAULT_TIMEOUT
+from .api import RETRY_STATUSES
+from .api import AnkiActionResult
+from .api import AnkiError
+from .api import AnkiMediaUpload
+from .api import AnkiModel
+from .api import AnkiNote
+from .api import AnkiNoteDoesNotExist
+from .api import AnkiNoteOptions
+from .api import _build_action
+from .api import _encode_request
+from .api import _get_add_note_params
+from .api import _get_timer_name
+from .api import _get_update_note_params
+from .api import _is_transient
+from .api import _parse_multi_results
+from .api import _parse_note_info
+from .exceptions import DejimaUserError
+
+
+class AsyncConnection:
+    _hostname: str
+    _port: int
+    _concurrency: int
+    _keepalive_timeout: float
+    _keep_alive: bool
+    _timeout: Tuple[float, float]
+    _retries: int
+    _backoff: float
+    _compress_threshold: Optional[int]
+    _semaphore: Optional[asyncio.Semaphore]
+
+    def __init__(
+        self,
+        hostname="127.0.0.1",
+        port=8765,
+        concurrency: int = 8,
+        keepalive_timeout: float = 30,
+        keep_alive: bool = True,
+        timeout: Tuple[float, float] = DEFAULT_TIMEOUT,
+        retries: int = 3,
+        backoff: float = 0.5,
+        compress_threshold: Optional[int] = None,
+    ):
+        try:
+            import aiohttp  # noqa: F401
+        except ImportError:
+            raise DejimaUserError(
+                "The asyncio AnkiConnect client requires aiohttp; "
+                "install it with `pip install dejima[async]`."
+            )
+
+        if concurrency < 1:
+            raise ValueError("Concurrency must be at least 1.")
+
+        self._hostname = hostname
+        self._port = port
+        self._concurrency = concurrency
+        self._keepalive_timeout = keepalive_timeout
+        self._keep_alive = keep_alive
+        self._timeout = timeout
+        self._retries = retries
+        self._backoff = backoff
+        self._compress_threshold = compress_threshold
+        self._session = None
+        self._semaphore = None
+
+        super().__init__()
+
+    async def __aenter__(self) -> AsyncConnection:
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback) -> None:
+        await self.close()
+
+    def _get_session(self):
+        import aiohttp
+
+        # Created lazily so that they belong to the running event loop.
+        if self._session is None:
+            connect_timeout, read_timeout = self._timeout
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(
+                    limit=self._concurrency,
+                    keepalive_timeout=self._keepalive_timeout,
+                    force_close=not self._keep_alive,
+                ),
+                timeout=aiohttp.ClientTimeout(
+                    sock_connect=connect_timeout, sock_read=read_timeout
+                ),
+            )
+            self._semaphore = asyncio.Semaphore(self._concurrency)
+
+        return self._session
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def _post(
+        self, payload: bytes, headers: Dict[str, str], timer: metrics.Timer
+    ) -> Any:
+        import aiohttp
+
+        session = self._get_session()
+        assert self._semaphore is not None
+
+        # As with the synchronous transport, only failures to connect and
+        # responses AnkiConnect could not have acted upon are retried; a
+        # request that timed out may still have been carried out.
+        for attempt in range(self._retries + 1):
+            retry = attempt < self._retries
+            async with self._semaphore:
+                try:
+                    # Only the round trips themselves are timed, not waiting
+                    # for a free connection or backing off between them.
+                    with timer.time():
+                        async with session.post(
+                            f"http://{self._hostname}:{self._port}/",
+                            data=payload,
+                            headers=headers,
+                        ) as response:
+                            metrics.get_counter("anki.requests").add()
+                            metrics.get_counter("anki.bytes_sent").add(len(payload))
+                            if not (retry and response.status in RETRY_STATUSES):
+                                response.raise_for_status()
+                                return await response.json(content_type=None)
+                except aiohttp.ClientConnectorError:
+                    if not retry:
+                        raise
+
+            metrics.get_counter("anki.retries").add()
+            await asyncio.sleep(self._backoff * 2**attempt)
+
+    async def _dispatch(self, action: str, params: Dict[str, Any] = None) -> Any:
+        request = _build_action(action, params)
+        payload, headers = _encode_request(request, self._compress_threshold)
+        timer = metrics.get_timer(_get_timer_name(request))
+
+        for attempt in range(self._retries + 1):
+            result = await self._post(payload, headers, timer)
+
+            if result["error"] is None:
+                return result["result"]
+            elif attempt < self._retries and _is_transient(result["error"]):
+                metrics.get_counter("anki.retries").add()
+                await asyncio.sleep(self._backoff * 2**attempt)
+                continue
+
+            raise AnkiError(result["error"])
+
+    async def multi(self, actions: List[Dict[str, Any]]) -> List[AnkiActionResult]:
+        results = await self._dispatch("multi", {"actions": actions})
+
+        return _parse_multi_results(actions, results)
+
+    async def get_deck_names(self) -> List[str]:
+        return await self._dispatch("deckNames")
+
+    async def get_model_names(self) -> List[str]:
+        return await self._dispatch("modelNames")
+
+    async def create_model(self, model: AnkiModel) -> Dict:
+        return await self._dispatch("createModel", dataclasses.asdict(model))
+
+    async def get_model_field_names(self, model_name: str) -> List[str]:
+        return await self._dispatch("modelFieldNames", {"modelName": model_name})
+
+    async def get_model_templates(self, model_name: str) -> Dict[str, Dict[str, str]]:
+        return await self._dispatch("modelTemplates", {"modelName": model_name})
+
+    async def add_note(self, note: AnkiNote, options: AnkiNoteOptions = None) -> int:
+        return await self._dispatch("addNote", _get_add_note_params(note, options))
+
+    async def add_notes(
+        self, notes: List[AnkiNote], options: AnkiNoteOptions = None
+    ) -> List[Optional[int]]:
+        return await self._dispatch(
+            "addNotes",
+            {"notes": [_get_add_note_params(note, options)["note"] for note in notes]},
+        )
+
+    async def update_note(self, id: int, note: AnkiNote) -> None:
+        return await self._dispatch(
+            "updateNoteFields", _get_update_note_params(id, note)
+        )
+
+    async def get_note(self, id) -> AnkiNote:
+        notes = await self._dispatch("notesInfo", {"notes": [id]})
+        if len(notes) == 0:
+            raise AnkiNoteDoesNotExist(id)
+
+        return _parse_note_info(notes[0])
+
+    async def get_notes(self, ids: List[int]) -> Dict[int, AnkiNote]:
+        notes = await self._dispatch("notesInfo", {"notes": ids})
+
+        return {
+            result["noteId"]: _parse_note_info(result)
+            for result in notes
+            if result.get("noteId") is not None
+        }
+
+    async def find_notes(self, query: str) -> List[int]:
+        query = query.replace("\n", " ")
+        return await self._dispatch(
+            "findNotes",
+            {"query": query},
+        )
+
+    async def store_media_file(self, media: AnkiMediaUpload) -> str:
+        return await self._dispatch("storeMediaFile", dataclasses.asdict(media))
@@ -0,0 +1,629 @@
+from __future__ import annotations
+
+import asyncio
+import dataclasses
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Set
+from typing import Tuple
+
+from .api import AnkiActionResult
+from .api import AnkiError
+from .api import AnkiMediaUpload
+from .api import AnkiModel
+from .api import AnkiNote
+from .api import AnkiNoteOptions
+from .api import Connection
+from .api import _build_action
+from .api import _get_add_note_params
+from .api import _get_update_note_params
+from .api import escape
+from .async_api import AsyncConnection
+from .util import chunked
+from .util import gather_all
+
+BACKEND_ANKICONNECT = "ankiconnect"
+BACKEND_BATCHED = "batched"
+BACKEND_NULL = "null"
+BACKEND_APKG = "apkg"
+
+BACKENDS = [BACKEND_ANKICONNECT, BACKEND_BATCHED, BACKEND_NULL, BACKEND_APKG]
+
+ModelInfo = Tuple[List[str], Dict[str, Dict[str, str]]]
+
+
+def get_search_query(deck_name: str, fields: Dict[str, str] = None) -> str:
+    query = f"deck:{escape(deck_name)}"
+    if fields:
+        clauses = " or ".join(
+            f"{field_name}:{escape(value)}" for field_name, value in fields.items()
+        )
+        query = f"{query} ({clauses})"
+
+    return query
+
+
+def get_added_note_query(note: AnkiNote) -> Optional[str]:
+    # Finds the notes that may be ``note``, were it added by a request
+    # AnkiConnect went on to reject.
+    if not note.fields:
+        return None
+
+    field_name, value = next(iter(note.fields.items()))
+    return f"deck:{escape(note.deckName)} {field_name}:{escape(value)}"
+
+
+def match_added_notes(
+    notes: List[AnkiNote],
+    candidates: List[List[int]],
+    existing: Dict[int, AnkiNote],
+) -> List[Optional[int]]:
+    # Only a note matching every field and carrying the import's tags
+    # counts as added; notes sharing its first field may be duplicates
+    # allowed on purpose, and identical ones may be from other imports.
+    claimed: Set[int] = set()
+    note_ids: List[Optional[int]] = []
+    for note, found in zip(notes, candidates):
+        note_id = next(
+            (
+                note_id
+                for note_id in found
+                if note_id in existing
+                and note_id not in claimed
+                and existing[note_id].modelName == note.modelName
+                and set(note.tags) <= set(existing[note_id].tags)
+                and all(
+                    existing[note_id].fields.get(name) == value
+                    for name, value in note.fields.items()
+                )
+            ),
+            None,
+        )
+        if note_id is not None:
+            claimed.add(note_id)
+        note_ids.append(note_id)
+
+    return note_ids
+
+
+def get_model_templates(model: AnkiModel) -> Dict[str, Dict[str, str]]:
+    # In the shape AnkiConnect's ``modelTemplates`` returns them in.
+    return {
+        template.Name: {"Front": template.Front, "Back": template.Back}
+        for template in model.cardTemplates
+    }
+
+
+class Backend:
+    """Where an import writes its notes, their note type and media."""
+
+    def __enter__(self) -> Backend:
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+    def close(self) -> None:
+        pass
+
+    def ensure_model(self, model: AnkiModel) -> ModelInfo:
+        # The fields and card templates of the note type as they are in
+        # the collection, which it is added to first if it is missing.
+        raise NotImplementedError()
+
+    def find_notes(self, deck_name: str, fields: Dict[str, str] = None) -> List[int]:
+        # The notes in the deck, or only those with the value of any of
+        # ``fields``, compared as a ``field:"value"`` search compares them.
+        raise NotImplementedError()
+
+    def get_notes(self, ids: List[int]) -> Dict[int, AnkiNote]:
+        raise NotImplementedError()
+
+    def add_notes(
+        self,
+        notes: List[AnkiNote],
+        options: AnkiNoteOptions = None,
+        keys: List[Optional[str]] = None,
+    ) -> List[AnkiActionResult]:
+        # ``keys`` are the foreign keys of the entries the notes are for,
+        # by which a backend may identify the notes it writes.
+        raise NotImplementedError()
+
+    def update_notes(
+        self, updates: List[Tuple[int, AnkiNote]]
+    ) -> List[AnkiActionResult]:
+        raise NotImplementedError()
+
+    def store_media_file(self, media: AnkiMediaUpload) -> str:
+        raise NotImplementedError()
+
+
+class AsyncBackend:
+    """Where an import running on an event loop writes its notes and media.
+
+    Its methods are those of ``Backend``, as coroutines.
+    """
+
+    async def __aenter__(self) -> AsyncBackend:
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback) -> None:
+        await self.close()
+
+    async def close(self) -> None:
+        pass
+
+    async def ensure_model(self, model: AnkiModel) -> ModelInfo:
+        raise NotImplementedError()
+
+    async def find_notes(
+        self, deck_name: str, fields: Dict[str, str] = None
+    ) -> List[int]:
+        raise NotImplementedError()
+
+    async def get_notes(self, ids: List[int]) -> Dict[int, AnkiNote]:
+        raise NotImplementedError()
+
+    async def add_notes(
+        self,
+        notes: List[AnkiNote],
+        options: AnkiNoteOptions = None,
+        keys: List[Optional[str]] = None,
+    ) -> List[AnkiActionResult]:
+        raise NotImplementedError()
+
+    async def update_notes(
+        self, updates: List[Tuple[int, AnkiNote]]
+    ) -> List[AnkiActionResult]:
+        raise NotImplementedError()
+
+    async def store_media_file(self, media: AnkiMediaUpload) -> str:
+        raise NotImplementedError()
+
+
+class AnkiConnectBackend(Backend):
+    """Sends each note to AnkiConnect in a request of its own."""
+
+    _api: Connection
+
+    def __init__(self, api: Connection):
+        self._api = api
+
+        super().__init__()
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self._api.__exit__(exc_type, exc_value, traceback)
+
+    def close(self) -> None:
+        self._api.close()
+
+    def ensure_model(self, model: AnkiModel) -> ModelInfo:
+        if model.modelName in self._api.get_model_names():
+            return (
+                self._api.get_model_field_names(model.modelName),
+                self._api.get_model_templates(model.modelName),
+            )
+
+        self._api.create_model(model)
+        return model.inOrderFields, get_model_templates(model)
+
+    def find_notes(self, deck_name: str, fields: Dict[str, str] = None) -> List[int]:
+        return self._api.find_notes(get_search_query(deck_name, fields))
+
+    def get_notes(self, ids: List[int]) -> Dict[int, AnkiNote]:
+        return self._api.get_notes(ids)
+
+    def add_notes(
+        self,
+        notes: List[AnkiNote],
+        options: AnkiNoteOptions = None,
+        keys: List[Optional[str]] = None,
+    ) -> List[AnkiActionResult]:
+        results: List[AnkiActionResult] = []
+        for note in notes:
+            try:
+                results.append(
+                    AnkiActionResult("addNote", self._api.add_note(note, options))
+                )
+            except AnkiError as e:
+                results.append(AnkiActionResult("addNote", error=str(e)))
+
+        return results
+
+    def update_notes(
+        self, updates: List[Tuple[int, AnkiNote]]
+    ) -> List[AnkiActionResult]:
+        results: List[AnkiActionResult] = []
+        for note_id, note in updates:
+            try:
+                self._api.update_note(note_id, note)
+            except AnkiError as e:
+                results.append(AnkiActionResult("updateNoteFields", error=str(e)))
+            else:
+                results.append(AnkiActionResult("updateNoteFields"))
+
+        return results
+
+    def store_media_file(self, media: AnkiMediaUpload) -> str:
+        return self._api.store_media_file(media)
+
+
+class BatchedAnkiConnectBackend(AnkiConnectBackend):
+    """Sends notes to AnkiConnect ``batch_size`` at a time."""
+
+    _batch_size: int
+
+    def __init__(self, api: Connection, batch_size: int = 50):
+        if batch_size < 1:
+            raise ValueError("Batches must hold at least one action.")
+
+        self._batch_size = batch_size
+
+        super().__init__(api)
+
+    def add_notes(
+        self,
+        notes: List[AnkiNote],
+        options: AnkiNoteOptions = None,
+        keys: List[Optional[str]] = None,
+    ) -> List[AnkiActionResult]:
+        results: List[AnkiActionResult] = []
+        for chunk in chunked(notes, self._batch_size):
+            try:
+                note_ids: List[Optional[int]] = self._api.add_notes(chunk, options)
+            except AnkiError:
+                # Some AnkiConnect releases reject the whole request when
+                # any single note fails, possibly after having added the
+                # notes before it.  Those are looked up rather than added a
+                # second time, and each of the others is retried on its own
+                # so that the failure can be attributed to it.
+                note_ids = self._find_added_notes(chunk)
+
+            retried: List[AnkiActionResult] = []
+            with self._api.batch(self._batch_size) as batch:
+                for note, note_id in zip(chunk, note_ids):
+                    if note_id is None:
+                        batch.add_note(note, options, retried.append)
+
+            failures = iter(retried)
+            results.extend(
+                AnkiActionResult("addNotes", note_id)
+                if note_id is not None
+                else next(failures)
+                for note_id in note_ids
+            )
+
+        return results
+
+    def _find_added_notes(self, notes: List[AnkiNote]) -> List[Optional[int]]:
+        candidates: List[List[int]] = [[] for _ in notes]
+
+        def on_found(found: List[int], result: AnkiActionResult) -> None:
+            found.extend(result.result or [])
+
+        with self._api.batch(self._batch_size) as batch:
+            for note, found in zip(notes, candidates):
+                query = get_added_note_query(note)
+                if query is not None:
+                    batch.queue(
+                        "findNotes",
+                        {"query": query},
+                        functools.partial(on_found, found),
+                    )
+
+        candidate_ids = sorted({note_id for found in candidates for note_id in found})
+        existing = self._api.get_notes(candidate_ids) if candidate_ids else {}
+
+        return match_added_notes(notes, candidates, existing)
+
+    def update_notes(
+        self, updates: List[Tuple[int, AnkiNote]]
+    ) -> List[AnkiActionResult]:
+        results: List[AnkiActionResult] = []
+        with self._api.batch(self._batch_size) as batch:
+            for note_id, note in updates:
+                batch.update_note(note_id, note, results.append)
+
+        return results
+
+
+class NullBackend(Backend):
+    """Writes nothing anywhere, so that the rest of an import can be measured.
+
+    Notes are kept in memory only so that duplicates are found and merged
+    as they would be in Anki.
+    """
+
+    _models: Dict[str, AnkiModel]
+    _notes: Dict[int, AnkiNote]
+
+    def __init__(self):
+        self._models = {}
+        self._notes = {}
+        self._next_id = 1
+        # Imports run together in a batch share their backend.
+        self._lock = threading.Lock()
+
+        super().__init__()
+
+    def ensure_model(self, model: AnkiModel) -> ModelInfo:
+        with self._lock:
+            model = self._models.setdefault(model.modelName, model)
+
+        return model.inOrderFields, get_model_templates(model)
+
+    def find_notes(self, deck_name: str, fields: Dict[str, str] = None) -> List[int]:
+        terms = {(k.casefold(), v.casefold()) for k, v in (fields or {}).items()}
+
+        found: List[int] = []
+        with self._lock:
+            for note_id, note in self._notes.items():
+                if note.deckName.casefold() != deck_name.casefold():
+                    continue
+
+                if not terms or terms.intersection(
+                    (k.casefold(), v.casefold()) for k, v in note.fields.items()
+                ):
+                    found.append(note_id)
+
+        return found
+
+    def get_notes(self, ids: List[int]) -> Dict[int, AnkiNote]:
+        with self._lock:
+            return {
+                note_id: dataclasses.replace(
+                    self._notes[note_id],
+                    fields=dict(self._notes[note_id].fields),
+                    tags=list(self._notes[note_id].tags),
+                )
+                for note_id in ids
+                if note_id in self._notes
+            }
+
+    def add_notes(
+        self,
+        notes: List[AnkiNote],
+        options: AnkiNoteOptions = None,
+        keys: List[Optional[str]] = None,
+    ) -> List[AnkiActionResult]:
+        results: List[AnkiActionResult] = []
+        with self._lock:
+            for note in notes:
+                note_id = self._next_id
+                self._next_id += 1
+                self._notes[note_id] = dataclasses.replace(
+                    note, fields=dict(note.fields), tags=list(note.tags)
+                )
+                results.append(AnkiActionResult("addNotes", note_id))
+
+        return results
+
+    def update_notes(
+        self, updates: List[Tuple[int, AnkiNote]]
+    ) -> List[AnkiActionResult]:
+        results: List[AnkiActionResult] = []
+        with self._lock:
+            for note_id, note in updates:
+                if note_id not in self._notes:
+                    results.append(
+                        AnkiActionResult(
+                            "updateNoteFields", error=f"Note was not found: {note_id}"
+                        )
+                    )
+                    continue
+
+                self._notes[note_id].fields.update(note.fields)
+                results.append(AnkiActionResult("updateNoteFields"))
+
+        return results
+
+    def store_media_file(self, media: AnkiMediaUpload) -> str:
+        return media.filename
+
+
+class SyncBackendAdapter(AsyncBackend):
+    """Lets an import running on an event loop write through a ``Backend``.
+
+    Notes are written on the event loop's own thread, blocking it as
+    they would block any import, while media are stored by
+    ``media_workers`` threads alongside.
+    """
+
+    _backend: Backend
+    _executor: ThreadPoolExecutor
+
+    def __init__(self, backend: Backend, media_workers: int = 4):
+        if media_workers < 1:
+            raise ValueError("At least one worker is required.")
+
+        self._backend = backend
+        self._executor = ThreadPoolExecutor(max_workers=media_workers)
+
+        super().__init__()
+
+    async def close(self) -> None:
+        self._executor.shutdown(wait=True)
+
+    async def ensure_model(self, model: AnkiModel) -> ModelInfo:
+        return self._backend.ensure_model(model)
+
+    async def find_notes(
+        self, deck_name: str, fields: Dict[str, str] = None
+    ) -> List[int]:
+        return self._backend.find_notes(deck_name, fields)
+
+    async def get_notes(self, ids: List[int]) -> Dict[int, AnkiNote]:
+        return self._backend.get_notes(ids)
+
+    async def add_notes(
+        self,
+        notes: List[AnkiNote],
+        options: AnkiNoteOptions = None,
+        keys: List[Optional[str]] = None,
+    ) -> List[AnkiActionResult]:
+        return self._backend.add_notes(notes, options, keys)
+
+    async def update_notes(
+        self, updates: List[Tuple[int, AnkiNote]]
+    ) -> List[AnkiActionResult]:
+        return self._backend.update_notes(updates)
+
+    async def store_media_file(self, media: AnkiMediaUpload) -> str:
+        return await asyncio.get_running_loop().run_in_executor(
+            self._executor, self._backend.store_media_file, media
+        )
+
+
+class AsyncAnkiConnectBackend(AsyncBackend):
+    """Sends each note to AnkiConnect in a request of its own, concurrently."""
+
+    _api: AsyncConnection
+
+    def __init__(self, api: AsyncConnection):
+        self._api = api
+
+        super().__init__()
+
+    async def close(self) -> None:
+        await self._api.close()
+
+    async def ensure_model(self, model: AnkiModel) -> ModelInfo:
+        if model.modelName in await self._api.get_model_names():
+            return (
+                await self._api.get_model_field_names(model.modelName),
+                await self._api.get_model_templates(model.modelName),
+            )
+
+        await self._api.create_model(model)
+        return model.inOrderFields, get_model_templates(model)
+
+    async def find_notes(
+        self, deck_name: str, fields: Dict[str, str] = None
+    ) -> List[int]:
+        return await self._api.find_notes(get_search_query(deck_name, fields))
+
+    async def get_notes(self, ids: List[int]) -> Dict[int, AnkiNote]:
+        return await self._api.get_notes(ids)
+
+    async def add_notes(
+        self,
+        notes: List[AnkiNote],
+        options: AnkiNoteOptions = None,
+        keys: List[Optional[str]] = None,
+    ) -> List[AnkiActionResult]:
+        async def add_note(note: AnkiNote) -> AnkiActionResult:
+            try:
+                return AnkiActionResult(
+                    "addNote", await self._api.add_note(note, options)
+                )
+            except AnkiError as e:
+                return AnkiActionResult("addNote", error=str(e))
+
+        return await gather_all(add_note(note) for note in notes)
+
+    async def update_notes(
+        self, updates: List[Tuple[int, AnkiNote]]
+    ) -> List[AnkiActionResult]:
+        async def update_note(note_id: int, note: AnkiNote) -> AnkiActionResult:
+            try:
+                await self._api.update_note(note_id, note)
+            except AnkiError as e:
+                return AnkiActionResult("updateNoteFields", error=str(e))
+
+            return AnkiActionResult("updateNoteFields")
+
+        return await gather_all(update_note(note_id, note) for note_id, note in updates)
+
+    async def store_media_file(self, media: AnkiMediaUpload) -> str:
+        return await self._api.store_media_file(media)
+
+
+class AsyncBatchedAnkiConnectBackend(AsyncAnkiConnectBackend):
+    """Sends notes to AnkiConnect ``batch_size`` at a time, concurrently."""
+
+    _batch_size: int
+
+    def __init__(self, api: AsyncConnection, batch_size: int = 50):
+        if batch_size < 1:
+            raise ValueError("Batches must hold at least one action.")
+
+        self._batch_size = batch_size
+
+        super().__init__(api)
+
+    async def _multi(self, actions: List[Dict[str, Any]]) -> List[AnkiActionResult]:
+        results = await gather_all(
+            self._api.multi(chunk) for chunk in chunked(actions, self._batch_size)
+        )
+
+        return [result for chunk in results for result in chunk]
+
+    async def add_notes(
+        self,
+        notes: List[AnkiNote],
+        options: AnkiNoteOptions = None,
+        keys: List[Optional[str]] = None,
+    ) -> List[AnkiActionResult]:
+        async def add_chunk(chunk: List[AnkiNote]) -> List[AnkiActionResult]:
+            try:
+                note_ids = await self._api.add_notes(chunk, options)
+            except AnkiError:
+                # As in ``BatchedAnkiConnectBackend.add_notes``.
+                note_ids = await self._find_added_notes(chunk)
+
+            failures = iter(
+                await self._multi(
+                    [
+                        _build_action("addNote", _get_add_note_params(note, options))
+                        for note, note_id in zip(chunk, note_ids)
+                        if note_id is None
+                    ]
+                )
+            )
+            return [
+                AnkiActionResult("addNotes", note_id)
+                if note_id is not None
+                else next(failures)
+                for note_id in note_ids
+            ]
+
+        results = await gather_all(
+            add_chunk(chunk) for chunk in chunked(notes, self._batch_size)
+        )
+
+        return [result for chunk in results for result in chunk]
+
+    async def _find_added_notes(self, notes: List[AnkiNote]) -> List[Optional[int]]:
+        queries = [get_added_note_query(note) for note in notes]
+        found = iter(
+            await self._multi(
+                [
+                    _build_action("findNotes", {"query": query})
+                    for query in queries
+                    if query is not None
+                ]
+            )
+        )
+        candidates: List[List[int]] = [
+            (next(found).result or []) if query is not None else [] for query in queries
+        ]
+
+        candidate_ids = sorted({note_id for ids in candidates for note_id in ids})
+        existing = await self._api.get_notes(candidate_ids) if candidate_ids else {}
+
+        return match_added_notes(notes, candidates, existing)
+
+    async def update_notes(
+        self, updates: List[Tuple[int, AnkiNote]]
+    ) -> List[AnkiActionResult]:
+        return await self._multi(
+            [
+                _build_action("updateNoteFields", _get_update_note_params(id, note))
+                for id, note in updates
+            ]
+        )
@@ -0,0 +1,166 @@
+import base64
+import datetime
+import json
+import random
+from typing import Any
+from typing import Dict
+from typing import List
+from typing import TextIO
+
+WORDS = [
+    "agua",
+    "casa",
+    "perro",
+    "gato",
+    "libro",
+    "tiempo",
+    "noche",
+    "ciudad",
+    "camino",
+    "mundo",
+    "hombre",
+    "mujer",
+    "amigo",
+    "trabajo",
+    "puerta",
+    "ventana",
+]
+TRANSLATIONS = {
+    "agua": "water",
+    "casa": "house",
+    "perro": "dog",
+    "gato": "cat",
+    "libro": "book",
+    "tiempo": "time",
+    "noche": "night",
+    "ciudad": "city",
+    "camino": "road",
+    "mundo": "world",
+    "hombre": "man",
+    "mujer": "woman",
+    "amigo": "friend",
+    "trabajo": "work",
+    "puerta": "door",
+    "ventana": "window",
+}
+EPOCH = datetime.datetime(2021, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+def _get_sentence(rnd: random.Random, length: int = 6) -> List[str]:
+    return [rnd.choice(WORDS) for _ in range(length)]
+
+
+def _get_data_url(rnd: random.Random, mime_type: str, size: int) -> str:
+    encoded = base64.b64encode(rnd.getrandbits(8 * size).to_bytes(size, "little"))
+    return f"data:{mime_type};base64,{encoded.decode('ascii')}"
+
+
+def _get_lln_phrase(
+    rnd: random.Random, idx: int, words: List[str], media_size: int
+) -> Dict[str, Any]:
+    created = EPOCH + datetime.timedelta(seconds=idx)
+    phrase: Dict[str, Any] = {
+        "subtitleTokens": {
+            "1": [{"form": {"text": word}, "pos": "NOUN"} for word in words],
+        },
+        "subtitles": {
+            "0": " ".join(_get_sentence(rnd)),
+            "1": " ".join(words),
+            "2": " ".join(_get_sentence(rnd)),
+        },
+        "mTranslations": {"1": " ".join(TRANSLATIONS[word] for word in words)},
+        "hTranslations": {"1": " ".join(TRANSLATIONS[word] for word in words)},
+        "reference": {
+            "source": "NETFLIX",
+            "movieId": str(80000000 + idx // 1000),
+            "langCode_N": "es",
+            "langCode_G": "es",
+            "title": f"Movie {idx // 1000}",
+            "subtitleIndex": idx % 1000,
+            "numSubs": 1000,
+        },
+    }
+    if media_size:
+        for name in ("thumb_prev", "thumb_next"):
+            phrase[name] = {
+                "height": 180,
+                "width": 320,
+                "time": idx * 1000,
+                "dataURL": _get_data_url(rnd, "image/jpeg", media_size),
+            }
+        phrase["audio"] = {
+            "source": "microsoft",
+            "voice": "es-ES-ElviraNeural",
+            "outputFormat": "audio-24khz-48kbitrate-mono-mp3",
+            "dateCreated": created.isoformat(),
+            "dataURL": _get_data_url(rnd, "audio/mpeg", media_size),
+        }
+
+    return phrase
+
+
+def get_lln_item(idx: int, media_size: int = 0, seed: int = 0) -> Dict[str, Any]:
+    rnd = random.Random(seed * 1_000_003 + idx)
+    words = _get_sentence(rnd)
+    item: Dict[str, Any] = {
+        "langCode_G": "es",
+        "translationLangCode_G": "en",
+        "timeCreated": int((EPOCH + datetime.timedelta(seconds=idx)).timestamp())
+        * 1000,
+    }
+    phrase = _get_lln_phrase(rnd, idx, words, media_size)
+
+    if idx % 2:
+        word = rnd.choice(words)
+        item.update(
+            {
+                "itemType": "WORD",
+                "color": "C0",
+                "wordTranslationsArr": [TRANSLATIONS[word]],
+                "wordType": "lemma",
+                "word": {"text": word},
+                "context": {"wordIndex": words.index(word), "phrase": phrase},
+            }
+        )
+    else:
+        item.update({"itemType": "PHRASE", "context": {"phrase": phrase}})
+
+    return item
+
+
+def write_lln_export(
+    fp: TextIO, count: int, media_size: int = 0, seed: int = 0
+) -> None:
+    # Items are written one at a time so that large exports need not fit
+    # in memory.
+    fp.write("[")
+    for idx in range(count):
+        if idx:
+            fp.write(",")
+        fp.write("\n")
+        json.dump(get_lln_item(idx, media_size, seed), fp)
+    fp.write("\n]\n")
+
+
+def write_boox_export(
+    fp: TextIO, count: int, duplicate_ratio: float = 0.0, seed: int = 0
+) -> None:
+    rnd = random.Random(seed)
+    fp.write("Reading Notes | <<Benchmark>>\n")
+    fp.write("Dejima\n")
+
+    for idx in range(count):
+        # Duplicates repeat an earlier annotation's text under a different
+        # note, which the import merges into the existing one.
+        source = idx
+        if idx and rnd.random() < duplicate_ratio:
+            source = rnd.randrange(idx)
+        words = random.Random(seed * 1_000_003 + source).choices(WORDS, k=6)
+        created = EPOCH + datetime.timedelta(minutes=idx)
+
+        fp.write(f"Chapter {idx // 100 + 1}\n")
+        fp.write(f"{created:%Y-%m-%d %H:%M}  |  Page No.: {idx + 1}\n")
+        fp.write(f"【Original Text】{' '.join(words)} {source}\n")
+        fp.write(f"【Annotations】{' '.join(TRANSLATIONS[w] for w in words)} {idx}\n")
+        fp.write(f"【Page Number】{idx + 1}\n")
+        fp.write("-------------------\n")
@@ -0,0 +1,258 @@
+from __future__ import annotations
+
+import collections
+import gzip
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler
+from http.server import HTTPServer
+from socketserver import ThreadingMixIn
+from typing import Any
+from typing import Callable
+from typing import Counter
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+# Matches the ``field:"value"`` terms of the queries dejima sends.
+QUERY_TERM = re.compile(r'([^\s():"]+):"((?:[^"\\]|\\.)*)"')
+ESCAPED_CHARACTER = re.compile(r"\\(.)")
+
+
+def parse_query(query: str) -> Tuple[Optional[str], List[Tuple[str, str]]]:
+    # Splits a query of the kind dejima sends -- ``field:"value"`` terms,
+    # one of which may name the deck -- into the deck's name and the
+    # field terms, casefolded as Anki compares them.
+    deck_name: Optional[str] = None
+    terms: List[Tuple[str, str]] = []
+    for match in QUERY_TERM.finditer(query):
+        name = match.group(1).casefold()
+        value = ESCAPED_CHARACTER.sub(r"\1", match.group(2)).casefold()
+        if name == "deck":
+            deck_name = value
+        else:
+            terms.append((name, value))
+
+    return deck_name, terms
+
+
+class FakeAnkiConnect(ThreadingMixIn, HTTPServer):
+    """A local stand-in for AnkiConnect keeping its notes in memory.
+
+    It understands the actions dejima sends while importing, and waits
+    ``latency`` seconds before answering each request to approximate the
+    cost of a round trip to Anki.
+    """
+
+    daemon_threads = True
+
+    latency: float
+    notes: Dict[int, Dict[str, Any]]
+    # Only the size of stored media is kept.
+    media: Dict[str, int]
+    models: Dict[str, Dict[str, Any]]
+    requests: Counter[str]
+    actions: Counter[str]
+
+    def __init__(self, hostname: str = "127.0.0.1", port: int = 0, latency=0.0):
+        self.latency = latency
+        self.notes = {}
+        self.media = {}
+        self.models = {}
+        self.requests = collections.Counter()
+        self.actions = collections.Counter()
+        self._next_id = 1
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+        super().__init__((hostname, port), FakeAnkiConnectHandler)
+
+    @property
+    def port(self) -> int:
+        return self.server_address[1]
+
+    @property
+    def round_trips(self) -> int:
+        return sum(self.requests.values())
+
+    def __enter__(self) -> FakeAnkiConnect:
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.shutdown()
+        self.server_close()
+
+    def handle_request_data(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        action = request["action"]
+
+        try:
+            with self._lock:
+                self.requests[action] += 1
+                result = self.run(action, request.get("params") or {})
+        except Exception as e:
+            return {"result": None, "error": str(e)}
+
+        return {"result": result, "error": None}
+
+    def run(self, action: str, params: Dict[str, Any]) -> Any:
+        self.actions[action] += 1
+
+        handler: Optional[Callable[[Dict[str, Any]], Any]] = getattr(
+            self, f"action_{action}", None
+        )
+        if handler is None:
+            raise Exception(f"unsupported action: {action}")
+
+        return handler(params)
+
+    def _add_note(self, note: Dict[str, Any]) -> int:
+        if note["modelName"] not in self.models:
+            raise Exception(f"model was not found: {note['modelName']}")
+        if not next(iter(note["fields"].values()), ""):
+            raise Exception("cannot create note because it is empty")
+
+        note_id = self._next_id
+        self._next_id += 1
+        self.notes[note_id] = {
+            "modelName": note["modelName"],
+            "deckName": note["deckName"],
+            "fields": dict(note["fields"]),
+            "tags": list(note.get("tags", [])),
+        }
+
+        return note_id
+
+    def action_multi(self, params: Dict[str, Any]) -> List[Dict[str, Any]]:
+        results: List[Dict[str, Any]] = []
+        for action in params["actions"]:
+            try:
+                result = self.run(action["action"], action.get("params") or {})
+            except Exception as e:
+                results.append({"result": None, "error": str(e)})
+            else:
+                results.append({"result": result, "error": None})
+
+        return results
+
+    def action_version(self, params: Dict[str, Any]) -> int:
+        return 6
+
+    def action_deckNames(self, params: Dict[str, Any]) -> List[str]:
+        return sorted({note["deckName"] for note in self.notes.values()})
+
+    def action_modelNames(self, params: Dict[str, Any]) -> List[str]:
+        return sorted(self.models)
+
+    def action_createModel(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        self.models[params["modelName"]] = params
+        return {}
+
+    def _get_model(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        if params["modelName"] not in self.models:
+            raise Exception(f"model was not found: {params['modelName']}")
+
+        return self.models[params["modelName"]]
+
+    def action_modelFieldNames(self, params: Dict[str, Any]) -> List[str]:
+        return self._get_model(params)["inOrderFields"]
+
+    def action_modelTemplates(
+        self, params: Dict[str, Any]
+    ) -> Dict[str, Dict[str, str]]:
+        return {
+            template["Name"]: {"Front": template["Front"], "Back": template["Back"]}
+            for template in self._get_model(params)["cardTemplates"]
+        }
+
+    def action_addNote(self, params: Dict[str, Any]) -> int:
+        return self._add_note(params["note"])
+
+    def action_addNotes(self, params: Dict[str, Any]) -> List[Optional[int]]:
+        note_ids: List[Optional[int]] = []
+        for note in params["notes"]:
+            try:
+                note_ids.append(self._add_note(note))
+            except Exception:
+                note_ids.append(None)
+
+        return note_ids
+
+    def action_updateNoteFields(self, params: Dict[str, Any]) -> None:
+        note_id = params["note"]["id"]
+        if note_id not in self.notes:
+            raise Exception(f"Note was not found: {note_id}")
+
+        self.notes[note_id]["fields"].update(params["note"]["fields"])
+
+    def action_notesInfo(self, params: Dict[str, Any]) -> List[Dict[str, Any]]:
+        results: List[Dict[str, Any]] = []
+        for note_id in params["notes"]:
+            note = self.notes.get(note_id)
+            if note is None:
+                results.append({})
+                continue
+
+            results.append(
+                {
+                    "noteId": note_id,
+                    "modelName": note["modelName"],
+                    "deckName": note["deckName"],
+                    "tags": note["tags"],
+                    "fields": {
+                        name: {"value": value, "order": order}
+                        for order, (name, value) in enumerate(note["fields"].items())
+                    },
+                }
+            )
+
+        return results
+
+    def action_findNotes(self, params: Dict[str, Any]) -> List[int]:
+        deck_name, terms = parse_query(params["query"])
+        found: List[int] = []
+        for note_id, note in self.notes.items():
+            if deck_name is not None and note["deckName"].casefold() != deck_name:
+                continue
+
+            fields = {k.casefold(): v.casefold() for k, v in note["fields"].items()}
+            if not terms or any(fields.get(name) == value for name, value in terms):
+                found.append(note_id)
+
+        return found
+
+    def action_storeMediaFile(self, params: Dict[str, Any]) -> str:
+        self.media[params["filename"]] = len(params.get("data") or "")
+        return params["filename"]
+
+
+class FakeAnkiConnectHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body are written separately; without this, delayed ACKs
+    # would add tens of milliseconds to every response.
+    disable_nagle_algorithm = True
+    server: FakeAnkiConnect
+
+    def do_POST(self) -> None:
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        if self.headers.get("Content-Encoding") == "gzip":
+            body = gzip.decompress(body)
+
+        if self.server.latency:
+            time.sleep(self.server.latency)
+
+        response = self.server.handle_request_data(json.loads(body))
+        data = json.dumps(response).encode("utf-8")
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
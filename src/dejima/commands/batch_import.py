@@ -0,0 +1,364 @@
+import argparse
+import dataclasses
+import datetime
+import glob
+import importlib
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import IO
+from typing import Any
+from typing import Dict
+from typing import List
+from typing import Optional
+
+from rich.markup import escape
+from rich.table import Table
+
+from .. import metrics
+from ..backends import Backend
+from ..db import BufferedWriter
+from ..db import Connection as DatabaseConnection
+from ..exceptions import DejimaError
+from ..exceptions import DejimaUserError
+from ..plugin import CommandPlugin
+from ..plugin import get_installed_sources
+from ..reporting import ImportCounts
+from ..reporting import ImportReporter
+from ..util import get_file_stat
+
+# The module's name is a keyword, so it cannot be imported by name.
+import_module = importlib.import_module(".import", __package__)
+ImportCommand = import_module.ImportCommand
+KeyClaims = import_module.KeyClaims
+scratch_history = import_module.scratch_history
+
+JOB_COMPLETED = "completed"
+JOB_FAILED = "failed"
+JOB_SKIPPED = "skipped"
+
+
+@dataclasses.dataclass
+class BatchJob:
+    source: str
+    deck_name: str
+    input_path: str
+    # Options for the source, as they would be given after its name.
+    args: List[str] = dataclasses.field(default_factory=list)
+    import_name: Optional[str] = None
+    counts: ImportCounts = dataclasses.field(default_factory=ImportCounts)
+    status: Optional[str] = None
+    error: Optional[str] = None
+
+    @property
+    def name(self) -> str:
+        return f"{os.path.basename(self.input_path)} ({self.deck_name})"
+
+
+class JobArgumentParser(argparse.ArgumentParser):
+    def error(self, message: str):
+        raise DejimaUserError(message)
+
+
+def expand_jobs(
+    source: str, deck_name: str, pattern: str, args: List[str] = None
+) -> List[BatchJob]:
+    return [
+        BatchJob(source, deck_name, os.path.abspath(path), list(args or []))
+        for path in sorted(glob.glob(pattern, recursive=True))
+        if os.path.isfile(path)
+    ]
+
+
+def load_manifest(fp: IO[str]) -> List[BatchJob]:
+    # A JSON list of jobs, each naming a source, a deck and an input path
+    # or glob pattern relative to the manifest, and optionally listing
+    # further options for the source.
+    try:
+        manifest = json.load(fp)
+    except ValueError as e:
+        raise DejimaUserError(f"Could not read the manifest: {e}")
+    if not isinstance(manifest, list):
+        raise DejimaUserError("The manifest must be a list of jobs.")
+
+    directory = os.path.dirname(os.path.abspath(getattr(fp, "name", ".")))
+    jobs: List[BatchJob] = []
+    for position, job in enumerate(manifest):
+        try:
+            source = job["source"]
+            deck_name = job["deck"]
+            pattern = job["input"]
+        except (KeyError, TypeError):
+            raise DejimaUserError(
+                f"Job {position} of the manifest must have a source, a deck "
+                "and an input."
+            )
+
+        jobs.extend(
+            expand_jobs(
+                source,
+                deck_name,
+                os.path.join(directory, os.path.expanduser(pattern)),
+                job.get("args"),
+            )
+        )
+
+    return jobs
+
+
+class BatchImportCommand(CommandPlugin):
+    @classmethod
+    def get_help(cls) -> str:
+        return "Import several inputs, each into its own deck, at once"
+
+    @classmethod
+    def add_arguments(cls, parser: argparse.ArgumentParser) -> None:
+        parser.add_argument(
+            "--manifest",
+            type=argparse.FileType("r"),
+            action="append",
+            default=[],
+            help=(
+                'JSON list of jobs such as {"source": "boox", "deck": "Books", '
+                '"input": "exports/*.txt", "args": []}; paths are relative '
+                "to the manifest"
+            ),
+        )
+        parser.add_argument(
+            "--glob",
+            nargs=3,
+            action="append",
+            default=[],
+            metavar=("SOURCE", "DECK", "PATTERN"),
+            help=(
+                "Import each file matching PATTERN using SOURCE into DECK; "
+                "quote PATTERN so that it is not expanded by the shell"
+            ),
+        )
+        parser.add_argument(
+            "--jobs",
+            type=int,
+            default=4,
+            help=(
+                "Number of decks to import into at once; inputs imported "
+                "into the same deck are imported one after another "
+                "(default: 4)"
+            ),
+        )
+        ImportCommand.add_import_arguments(parser)
+
+        return super().add_arguments(parser)
+
+    def get_jobs(self) -> List[BatchJob]:
+        sources = get_installed_sources()
+
+        jobs: List[BatchJob] = []
+        for manifest in self.options.manifest:
+            with manifest:
+                jobs.extend(load_manifest(manifest))
+        for source, deck_name, pattern in self.options.glob:
+            jobs.extend(expand_jobs(source, deck_name, pattern))
+
+        for job in jobs:
+            if job.source not in sources:
+                raise DejimaUserError(
+                    f"Unknown source {job.source!r}; installed sources are "
+                    f"{', '.join(sorted(sources))}."
+                )
+
+        # Inputs matched by more than one pattern are imported once.
+        unique: Dict[Any, BatchJob] = {}
+        for job in jobs:
+            unique.setdefault((job.source, job.deck_name, job.input_path), job)
+
+        return list(unique.values())
+
+    def get_job_options(self, job: BatchJob) -> argparse.Namespace:
+        src_class = get_installed_sources()[job.source]
+        parser = JobArgumentParser(prog=job.source)
+        src_class.add_arguments(parser)
+
+        options = vars(self.options).copy()
+        options.update(vars(parser.parse_args(["--input", job.input_path, *job.args])))
+        options.update(source=job.source, deck_name=job.deck_name)
+
+        return argparse.Namespace(**options)
+
+    def import_job(
+        self,
+        job: BatchJob,
+        backend: Backend,
+        writer: BufferedWriter,
+        claims: Any,
+        log: Optional[IO[str]],
+    ) -> None:
+        options = self.get_job_options(job)
+        try:
+            # Each job checks and records its progress on a connection of
+            # its own, as sqlite connections cannot be shared between
+            # threads; known entries and media are recorded by ``writer``.
+            db = DatabaseConnection(
+                synchronous=self.options.db_synchronous, path=self.options.database
+            )
+            command = ImportCommand(
+                options=options,
+                console=self.console,
+                backend=backend,
+                writer=writer,
+                claims=claims,
+            )
+            input_info = get_file_stat(options.input)
+            run = command.get_import_run(db, job.import_name, input_info)
+            reporter = ImportReporter(
+                self.console,
+                run.import_name,
+                mode=self.options.output,
+                log=log,
+                input=options.input,
+                job=job.name,
+            )
+            job.counts = reporter.counts
+            command.run_import(db, run, reporter, input_info)
+        finally:
+            options.input.close()
+
+    def import_deck(
+        self,
+        jobs: List[BatchJob],
+        backend: Backend,
+        writer: BufferedWriter,
+        claims: Dict[str, Any],
+        log: Optional[IO[str]],
+        cancelled: threading.Event,
+    ) -> None:
+        # Notes written by one job are looked up as possible duplicates by
+        # the next, so a deck's jobs are run one at a time and in order.
+        for job in jobs:
+            if cancelled.is_set():
+                job.status = JOB_SKIPPED
+                continue
+
+            try:
+                self.import_job(job, backend, writer, claims[job.source], log)
+            except Exception as e:
+                job.status = JOB_FAILED
+                job.error = str(e) or type(e).__name__
+                self.console.print(
+                    f"[red]{escape(job.name)}: {job.counts.get_summary()}[/red]"
+                )
+                self.console.print(
+                    f"[red][bold]{escape(job.name)} failed:[/bold] "
+                    f"{escape(job.error)}[/red]"
+                )
+            else:
+                job.status = JOB_COMPLETED
+                self.console.print(
+                    f"[blue]{escape(job.name)}: {job.counts.get_summary()}[/blue]"
+                )
+
+    def report_jobs(self, jobs: List[BatchJob]) -> ImportCounts:
+        total = ImportCounts()
+
+        table = Table(title="Batch import")
+        table.add_column("Input")
+        table.add_column("Source")
+        table.add_column("Deck")
+        table.add_column("Added", justify="right")
+        table.add_column("Merged", justify="right")
+        table.add_column("Invalid", justify="right")
+        table.add_column("Failed", justify="right")
+        table.add_column("Already processed", justify="right")
+        table.add_column("Skipped", justify="right")
+        table.add_column("Status")
+        for job in jobs:
+            counts = job.counts
+            total.add(counts)
+            table.add_row(
+                job.input_path,
+                job.source,
+                job.deck_name,
+                str(counts.added),
+                str(counts.merged),
+                str(counts.invalid),
+                str(counts.failed),
+                str(counts.already_processed),
+                str(counts.skipped),
+                job.status or JOB_SKIPPED,
+            )
+        self.console.print(table)
+
+        return total
+
+    def handle(self) -> None:
+        with scratch_history(self.options):
+            if self.options.use_async:
+                raise DejimaUserError(
+                    "--async cannot be used with batch imports; use --jobs to "
+                    "import several inputs at once."
+                )
+            if self.options.jobs < 1:
+                raise DejimaUserError("--jobs must be at least 1.")
+
+            jobs = self.get_jobs()
+            if not jobs:
+                raise DejimaUserError("No inputs were found to import.")
+
+            run_timestamp = datetime.datetime.utcnow()
+            batch_name = f'import{run_timestamp.strftime("%Y%m%dT%H%M%S")}'
+            for number, job in enumerate(jobs, 1):
+                job.import_name = f"{batch_name}-{number}"
+            decks: Dict[str, List[BatchJob]] = {}
+            for job in jobs:
+                decks.setdefault(job.deck_name, []).append(job)
+            claims = {job.source: KeyClaims() for job in jobs}
+
+            # Opens the backend and reports metrics as one import would.
+            command = ImportCommand(options=self.options, console=self.console)
+
+            metrics.reset()
+            db = DatabaseConnection(
+                synchronous=self.options.db_synchronous,
+                path=self.options.database,
+                check_same_thread=False,
+            )
+            writer = db.buffered_writer(
+                self.options.db_batch_size, self.options.db_flush_interval
+            )
+            backend = command.get_backend(
+                min(self.options.jobs, len(decks)) * (self.options.media_workers + 1)
+            )
+            log = open(self.options.log, "a") if self.options.log else None
+            cancelled = threading.Event()
+            try:
+                with backend, writer, ThreadPoolExecutor(self.options.jobs) as executor:
+                    futures = [
+                        executor.submit(
+                            self.import_deck,
+                            deck_jobs,
+                            backend,
+                            writer,
+                            claims,
+                            log,
+                            cancelled,
+                        )
+                        for deck_jobs in decks.values()
+                    ]
+                    try:
+                        for future in futures:
+                            future.result()
+                    except BaseException:
+                        # Imports that have started are left to finish.
+                        cancelled.set()
+                        raise
+            finally:
+                if log is not None:
+                    log.close()
+                total = self.report_jobs(jobs)
+                command.report_metrics(batch_name, total)
+
+            self.console.print(f"[blue]{total.get_summary()}[/blue]")
+
+            failed = [job for job in jobs if job.status == JOB_FAILED]
+            if failed:
+                raise DejimaError(f"{len(failed)} of {len(jobs)} imports failed.")
@@ -0,0 +1,250 @@
+import argparse
+import dataclasses
+import importlib
+import multiprocessing
+import os
+import queue
+import shlex
+import shutil
+import sys
+import tempfile
+import time
+from typing import Any
+from typing import Dict
+from typing import List
+
+from rich.console import Console
+from rich.table import Table
+
+from ..benchmark.generators import write_boox_export
+from ..benchmark.generators import write_lln_export
+from ..benchmark.server import FakeAnkiConnect
+from ..exceptions import DejimaUserError
+from ..plugin import CommandPlugin
+
+SOURCES = {
+    "lln-json": "lln.json",
+    "boox": "boox.txt",
+}
+
+
+@dataclasses.dataclass
+class BenchmarkResult:
+    source: str
+    entries: int
+    elapsed: float
+    round_trips: int
+    peak_rss: int
+    sqlite_time: float
+
+    @property
+    def entries_per_second(self) -> float:
+        return self.entries / self.elapsed if self.elapsed else 0.0
+
+    @property
+    def round_trips_per_entry(self) -> float:
+        return self.round_trips / self.entries if self.entries else 0.0
+
+
+def get_peak_rss() -> int:
+    import resource
+
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Reported in kilobytes on Linux, but in bytes on macOS.
+    if sys.platform == "darwin":
+        return peak_rss
+
+    return peak_rss * 1024
+
+
+def run_import(args: List[str], results: Any) -> None:
+    # Runs in its own process so that the peak RSS is the import's alone.
+    from ..metrics import get_timer
+
+    ImportCommand = importlib.import_module("dejima.commands.import").ImportCommand
+
+    parser = argparse.ArgumentParser()
+    ImportCommand.add_arguments(parser)
+    options = parser.parse_args(args)
+
+    started = time.perf_counter()
+    try:
+        ImportCommand(options=options, console=Console(quiet=True)).handle()
+    except Exception as e:
+        results.put({"error": repr(e)})
+        return
+
+    results.put(
+        {
+            "elapsed": time.perf_counter() - started,
+            "peak_rss": get_peak_rss(),
+            "sqlite_time": get_timer("sqlite").total,
+        }
+    )
+
+
+class BenchmarkCommand(CommandPlugin):
+    @classmethod
+    def get_help(cls) -> str:
+        return (
+            "Measure import throughput against a local stand-in for "
+            "AnkiConnect using generated exports"
+        )
+
+    @classmethod
+    def add_arguments(cls, parser: argparse.ArgumentParser) -> None:
+        parser.add_argument(
+            "--sources",
+            nargs="+",
+            choices=list(SOURCES),
+            default=list(SOURCES),
+            help="Sources to generate exports for (default: all)",
+        )
+        parser.add_argument(
+            "--entries",
+            nargs="+",
+            type=int,
+            default=[1000, 10000, 100000],
+            help="Number of entries to import on each run (default: 1000 10000 100000)",
+        )
+        parser.add_argument(
+            "--latency",
+            type=float,
+            default=0.0,
+            help="Seconds the stand-in waits before answering each request",
+        )
+        parser.add_argument(
+            "--media-size",
+            type=int,
+            default=0,
+            help=(
+                "Size in bytes of each thumbnail and audio clip attached to "
+                "generated lln-json entries (default: 0; no media)"
+            ),
+        )
+        parser.add_argument(
+            "--duplicates",
+            type=float,
+            default=0.0,
+            help=(
+                "Fraction of generated boox annotations repeating an earlier "
+                "annotation's text (default: 0)"
+            ),
+        )
+        parser.add_argument(
+            "--seed",
+            type=int,
+            default=0,
+            help="Seed for the generated exports (default: 0)",
+        )
+        parser.add_argument(
+            "--import-args",
+            type=shlex.split,
+            default=[],
+            help=('Options to run the import with, e.g. "--async --concurrency 16"'),
+        )
+        parser.add_argument(
+            "--workdir",
+            type=str,
+            default=None,
+            help=(
+                "Directory to write the exports and databases to; a temporary "
+                "directory is used and removed afterward by default"
+            ),
+        )
+        return super().add_arguments(parser)
+
+    def generate(self, source: str, count: int, path: str) -> None:
+        with open(path, "w", encoding="utf-8") as outf:
+            if source == "lln-json":
+                write_lln_export(
+                    outf, count, self.options.media_size, self.options.seed
+                )
+            else:
+                write_boox_export(
+                    outf, count, self.options.duplicates, self.options.seed
+                )
+
+    def run(self, workdir: str, source: str, count: int) -> BenchmarkResult:
+        name = f"{source}-{count}"
+        export_path = os.path.join(workdir, f"{name}-{SOURCES[source]}")
+        if not os.path.exists(export_path):
+            self.generate(source, count, export_path)
+
+        database_path = os.path.join(workdir, f"{name}.sqlite3")
+        if os.path.exists(database_path):
+            os.unlink(database_path)
+
+        with FakeAnkiConnect(latency=self.options.latency) as server:
+            args = [
+                "Benchmark",
+                "--database",
+                database_path,
+                "--anki-port",
+                str(server.port),
+                *self.options.import_args,
+                source,
+                "--input",
+                export_path,
+            ]
+
+            context = multiprocessing.get_context("spawn")
+            results = context.Queue()
+            process = context.Process(target=run_import, args=(args, results))
+            process.start()
+            outcome: Dict[str, Any] = {}
+            while not outcome:
+                try:
+                    outcome = results.get(timeout=1)
+                except queue.Empty:
+                    if not process.is_alive():
+                        outcome = {"error": f"exit code {process.exitcode}"}
+            process.join()
+
+            if "error" in outcome:
+                raise DejimaUserError(
+                    f"Importing {count} {source} entries failed: {outcome['error']}"
+                )
+
+            return BenchmarkResult(
+                source=source,
+                entries=count,
+                elapsed=outcome["elapsed"],
+                round_trips=server.round_trips,
+                peak_rss=outcome["peak_rss"],
+                sqlite_time=outcome["sqlite_time"],
+            )
+
+    def handle(self) -> None:
+        workdir = self.options.workdir or tempfile.mkdtemp(prefix="dejima-benchmark-")
+        os.makedirs(workdir, exist_ok=True)
+
+        table = Table(title="Import benchmark")
+        table.add_column("Source")
+        table.add_column("Entries", justify="right")
+        table.add_column("Seconds", justify="right")
+        table.add_column("Entries/s", justify="right")
+        table.add_column("Round trips/entry", justify="right")
+        table.add_column("Peak RSS (MB)", justify="right")
+        table.add_column("SQLite (s)", justify="right")
+
+        try:
+            for source in self.options.sources:
+                for count in self.options.entries:
+                    with self.console.status(f"Importing {count} {source} entries"):
+                        result = self.run(workdir, source, count)
+
+                    table.add_row(
+                        result.source,
+                        str(result.entries),
+                        f"{result.elapsed:.2f}",
+                        f"{result.entries_per_second:.1f}",
+                        f"{result.round_trips_per_entry:.3f}",
+                        f"{result.peak_rss / 1024 / 1024:.1f}",
+                        f"{result.sqlite_time:.2f}",
+                    )
+        finally:
+            if not self.options.workdir:
+                shutil.rmtree(workdir, ignore_errors=True)
+
+        self.console.print(table)
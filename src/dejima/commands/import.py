@@ -1,29 +1,351 @@
 import argparse
-import base64
+import asyncio
+import contextlib
+import dataclasses
 import datetime
+import functools
+import itertools
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from hashlib import sha256
 from textwrap import dedent
+from typing import Any
+from typing import AsyncIterator
+from typing import Awaitable
+from typing import Callable
+from typing import Dict
+from typing import Generic
+from typing import Iterable
+from typing import Iterator
 from typing import List
+from typing import Optional
+from typing import Set
+from typing import Tuple
+from typing import TypeVar
 
+from rich.console import Console
+from rich.table import Table
+
+from .. import metrics
+from ..api import DEFAULT_TIMEOUT
+from ..api import AnkiActionResult
 from ..api import AnkiCardTemplate
+from ..api import AnkiError
 from ..api import AnkiMediaUpload
 from ..api import AnkiModel
 from ..api import AnkiNote
+from ..api import AnkiNoteDoesNotExist
 from ..api import AnkiNoteOptions
 from ..api import Connection as AnkiConnection
 from ..api import escape
+from ..apkg import ApkgBackend
+from ..async_api import AsyncConnection
+from ..backends import BACKEND_ANKICONNECT
+from ..backends import BACKEND_APKG
+from ..backends import BACKEND_BATCHED
+from ..backends import BACKEND_NULL
+from ..backends import BACKENDS
+from ..backends import AnkiConnectBackend
+from ..backends import AsyncAnkiConnectBackend
+from ..backends import AsyncBackend
+from ..backends import AsyncBatchedAnkiConnectBackend
+from ..backends import Backend
+from ..backends import BatchedAnkiConnectBackend
+from ..backends import NullBackend
+from ..backends import SyncBackendAdapter
+from ..backends import get_model_templates
+from ..db import RUN_COMPLETED
+from ..db import RUN_FAILED
+from ..db import RUN_RUNNING
+from ..db import SYNCHRONOUS_MODES
+from ..db import BufferedWriter
+from ..db import CachedModel
 from ..db import Connection as DatabaseConnection
+from ..db import ImportRun
+from ..db import SourceScan
+from ..duplicates import DuplicateIndex
+from ..exceptions import DejimaUserError
+from ..pipeline import Pipeline
+from ..plugin import KEY_PREFIX
 from ..plugin import CommandPlugin
+from ..plugin import Media
 from ..plugin import Note
+from ..plugin import SourcePlugin
 from ..plugin import get_installed_sources
+from ..reporting import OUTPUT_MODES
+from ..reporting import ImportCounts
+from ..reporting import ImportReporter
+from ..util import chunked
+from ..util import gather_all
+from ..util import get_file_fingerprint
+from ..util import get_file_stat
+from ..util import get_prefix_hash
+
+# Imports run together in a batch would otherwise both create a model
+# that neither found.
+MODEL_LOCK = threading.Lock()
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+class KeyClaims:
+    """Keys of the entries that imports of a source have begun importing."""
+
+    _keys: Set[str]
+
+    def __init__(self):
+        self._keys = set()
+        # Imports of the same source run together in a batch share claims.
+        self._lock = threading.Lock()
+
+        super().__init__()
+
+    def claim(self, key: str) -> bool:
+        with self._lock:
+            if key in self._keys:
+                return False
+
+            self._keys.add(key)
+            return True
+
+
+class RequestBatcher(Generic[T, R]):
+    """Sends what concurrent entries ask for in shared requests.
+
+    ``send`` is given up to ``batch_size`` items at a time and returns a
+    result for each of them.
+    """
+
+    _pending: List[Tuple[T, asyncio.Future]]
+    _tasks: Set[asyncio.Future]
+
+    def __init__(self, send: Callable[[List[T]], Awaitable[List[R]]], batch_size: int):
+        self._send_batch = send
+        self._batch_size = batch_size
+        self._pending = []
+        self._tasks = set()
+
+        super().__init__()
+
+    async def submit(self, item: T) -> R:
+        loop = asyncio.get_running_loop()
+        if not self._pending:
+            # Entries started together submit their items before this
+            # runs, so their items are sent together.
+            loop.call_soon(self._send)
+        future = loop.create_future()
+        self._pending.append((item, future))
+        if len(self._pending) >= self._batch_size:
+            self._send()
+
+        return await future
+
+    def _send(self) -> None:
+        if not self._pending:
+            return
+
+        pending, self._pending = self._pending, []
+        task = asyncio.ensure_future(self._process(pending))
+        # The event loop keeps only a weak reference to its tasks.
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _process(self, pending: List[Tuple[T, asyncio.Future]]) -> None:
+        try:
+            results = await self._send_batch([item for item, _ in pending])
+        except BaseException as e:
+            for _, future in pending:
+                if not future.done():
+                    future.set_exception(e)
+            if not isinstance(e, Exception):
+                raise
+            return
+
+        for (_, future), result in zip(pending, results):
+            if not future.done():
+                future.set_result(result)
+        # Were fewer results returned than items sent, the entries waiting
+        # for the rest would otherwise wait forever.
+        for _, future in itertools.islice(pending, len(results), None):
+            if not future.done():
+                future.set_exception(AnkiError("no result returned"))
+
+
+@dataclasses.dataclass
+class PreparedEntry:
+    idx: int
+    foreign_key: Optional[str]
+    entry: Note
+    known: bool = False
+    missing_fields: List[str] = dataclasses.field(default_factory=list)
+    clauses: List[str] = dataclasses.field(default_factory=list)
+    uploads: List[Tuple[AnkiMediaUpload, str]] = dataclasses.field(default_factory=list)
+    # Byte offset of the source's input just past this entry's record, if
+    # the source can resume reading from one.
+    offset: Optional[int] = None
+
+
+def get_missing_fields(source: SourcePlugin, entry: Note) -> List[str]:
+    missing: List[str] = []
+
+    for position, (field_name, field_info) in enumerate(source.fields.items()):
+        # Anki refuses to create notes whose first field is empty, so it
+        # is required even if the source declared it optional.
+        if (not field_info.optional or position == 0) and not entry.fields.get(
+            field_name
+        ):
+            missing.append(field_name)
+
+    return missing
+
+
+def get_backend_name(options: argparse.Namespace) -> str:
+    if options.backend is not None:
+        return options.backend
+
+    return BACKEND_APKG if options.apkg is not None else BACKEND_BATCHED
+
+
+@contextlib.contextmanager
+def scratch_history(options: argparse.Namespace) -> Iterator[None]:
+    backend = get_backend_name(options)
+    if backend == BACKEND_APKG and options.apkg is None:
+        raise DejimaUserError("--apkg must be given to use the apkg backend.")
+    if backend != BACKEND_APKG and options.apkg is not None:
+        raise DejimaUserError(f"--apkg cannot be used with the {backend} backend.")
+
+    # What the null backend and packages are given is not in Anki -- a
+    # package's notes are only once it has been imported there -- so their
+    # entries and media are recorded in a history of their own, discarded
+    # once the import is done.
+    if backend not in (BACKEND_NULL, BACKEND_APKG):
+        yield
+        return
+
+    if options.resume:
+        raise DejimaUserError(f"Imports using the {backend} backend cannot be resumed.")
+
+    database = options.database
+    with tempfile.TemporaryDirectory(prefix="dejima-") as directory:
+        options.database = os.path.join(directory, "dejima.db")
+        try:
+            yield
+        finally:
+            options.database = database
+
+
+def get_model(source: SourcePlugin) -> AnkiModel:
+    return AnkiModel(
+        source.get_model_name(),
+        list(source.fields.keys()),
+        source.get_card_style(),
+        source.get_is_cloze(),
+        [
+            AnkiCardTemplate(
+                Name=dedent(t.name).strip(),
+                Front=dedent(t.front).strip(),
+                Back=dedent(t.back).strip(),
+            )
+            for t in source.get_card_templates()
+        ],
+    )
+
+
+def get_template_fingerprint(templates: Dict[str, Dict[str, str]]) -> str:
+    data = json.dumps(
+        {
+            name: [template["Front"].strip(), template["Back"].strip()]
+            for name, template in templates.items()
+        },
+        sort_keys=True,
+    )
+    return sha256(data.encode("utf-8")).hexdigest()
+
+
+def get_unique_clauses(unique_fields: List[str], entry: Note) -> List[str]:
+    return [
+        f"{field_name}:{escape(entry.fields.get(field_name, ''))}"
+        for field_name in unique_fields
+    ]
+
+
+@metrics.timed("media.prepare")
+def get_media_upload(media: Media) -> Tuple[AnkiMediaUpload, str]:
+    encoded = media.get_encoded()
+    upload = AnkiMediaUpload(filename=media.filename, data=encoded)
+
+    return upload, sha256(encoded.encode("ascii")).hexdigest()
+
+
+def build_entries(
+    source: SourcePlugin, records: List[Tuple[int, Optional[int], Any]]
+) -> List[Tuple[int, Optional[int], Tuple[Optional[str], Note]]]:
+    timer = metrics.get_timer("source.build")
+    entries: List[Tuple[int, Optional[int], Tuple[Optional[str], Note]]] = []
+    for idx, offset, record in records:
+        with timer.time():
+            entries.append((idx, offset, source.get_entry(record)))
+
+    return entries
+
+
+def prepare_entries(
+    source: SourcePlugin, unique_fields: List[str], entries: List[PreparedEntry]
+) -> List[PreparedEntry]:
+    for prepared in entries:
+        if prepared.known:
+            continue
+
+        entry = prepared.entry
+        for field_name, field_info in source.fields.items():
+            if field_info.default and field_name not in entry.fields:
+                entry.fields[field_name] = field_info.default
+
+        prepared.missing_fields = get_missing_fields(source, entry)
+        if prepared.missing_fields:
+            continue
+
+        prepared.clauses = get_unique_clauses(unique_fields, entry)
+        prepared.uploads = [get_media_upload(media) for media in entry.media]
+
+    return entries
 
 
 class ImportCommand(CommandPlugin):
+    _backend: Optional[Backend]
+    _writer: Optional[BufferedWriter]
+    _claims: KeyClaims
+
+    def __init__(
+        self,
+        options: argparse.Namespace,
+        console: Console,
+        backend: Backend = None,
+        writer: BufferedWriter = None,
+        claims: KeyClaims = None,
+    ):
+        # Imports run in a batch share a backend and a database writer,
+        # which are opened and closed by the batch, and
+        # with other imports of the same source, which entries they have
+        # claimed; as when run one after another, an entry is imported
+        # into whichever deck it is read for first.
+        self._backend = backend
+        self._writer = writer
+        self._claims = claims if claims is not None else KeyClaims()
+
+        super().__init__(options=options, console=console)
+
     @classmethod
     def add_arguments(cls, parser: argparse.ArgumentParser) -> None:
         sources = get_installed_sources()
 
         parser.add_argument("deck_name", type=str)
-        parser.add_argument("--reimport", action="store_true", default=False)
+        cls.add_import_arguments(parser)
         subparsers = parser.add_subparsers(dest="source")
         subparsers.required = True
 
@@ -39,167 +361,1125 @@ class ImportCommand(CommandPlugin):
 
         return super().add_arguments(parser)
 
-    def handle(self) -> None:
-        run_timestamp = datetime.datetime.utcnow()
-        import_name = f'import{run_timestamp.strftime("%Y%m%dT%H%M%S")}'
+    @classmethod
+    def add_import_arguments(cls, parser: argparse.ArgumentParser) -> None:
+        parser.add_argument("--reimport", action="store_true", default=False)
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=50,
+            help=(
+                "Number of note creations or updates to send to AnkiConnect "
+                "per request (default: 50)"
+            ),
+        )
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=500,
+            help=(
+                "Number of source entries to check against the import "
+                "history at once (default: 500)"
+            ),
+        )
+        parser.add_argument(
+            "--db-batch-size",
+            type=int,
+            default=500,
+            help=(
+                "Number of import history records to write per database "
+                "transaction; entries whose notes were written to Anki are "
+                "recorded as soon as each request returns (default: 500)"
+            ),
+        )
+        parser.add_argument(
+            "--db-flush-interval",
+            type=float,
+            default=5.0,
+            help=(
+                "Maximum number of seconds to hold import history records "
+                "before writing them (default: 5)"
+            ),
+        )
+        parser.add_argument(
+            "--db-synchronous",
+            choices=SYNCHRONOUS_MODES,
+            default="NORMAL",
+            help="Sqlite 'synchronous' setting for the database (default: NORMAL)",
+        )
+        parser.add_argument(
+            "--media-workers",
+            type=int,
+            default=4,
+            help="Number of media files to upload concurrently (default: 4)",
+        )
+        parser.add_argument(
+            "--anki-host",
+            default="127.0.0.1",
+            help="Host AnkiConnect is listening on (default: 127.0.0.1)",
+        )
+        parser.add_argument(
+            "--anki-port",
+            type=int,
+            default=8765,
+            help="Port AnkiConnect is listening on (default: 8765)",
+        )
+        parser.add_argument(
+            "--backend",
+            choices=BACKENDS,
+            default=None,
+            help=(
+                "Where notes are written: to AnkiConnect one request per "
+                "note (ankiconnect) or --batch-size notes per request "
+                "(batched), nowhere (null), or into the package given with "
+                "--apkg (apkg) (default: apkg if --apkg is given, otherwise "
+                "batched)"
+            ),
+        )
+        parser.add_argument(
+            "--apkg",
+            default=None,
+            metavar="PATH",
+            help=(
+                "Write the notes, their note type and media into an Anki "
+                "package at PATH instead of sending them to AnkiConnect; "
+                "Anki need not be running"
+            ),
+        )
+        parser.add_argument(
+            "--database",
+            default=None,
+            help=(
+                "Path to the database recording which entries have been "
+                "imported (default: dejima.db in the user data directory)"
+            ),
+        )
+        parser.add_argument(
+            "--timeout",
+            type=float,
+            default=DEFAULT_TIMEOUT[1],
+            help=(
+                "Seconds to wait for AnkiConnect to respond to a request "
+                f"(default: {DEFAULT_TIMEOUT[1]:g})"
+            ),
+        )
+        parser.add_argument(
+            "--retries",
+            type=int,
+            default=3,
+            help=(
+                "Number of times to retry requests AnkiConnect could not "
+                "handle because Anki was busy or unreachable (default: 3)"
+            ),
+        )
+        parser.add_argument(
+            "--no-keep-alive",
+            dest="keep_alive",
+            action="store_false",
+            default=True,
+            help="Open a new connection to AnkiConnect for every request",
+        )
+        parser.add_argument(
+            "--compress-over",
+            type=int,
+            default=None,
+            metavar="BYTES",
+            help=(
+                "Gzip requests larger than this many bytes; AnkiConnect "
+                "itself does not accept compressed requests, so this is only "
+                "useful behind a proxy that decompresses them"
+            ),
+        )
+        parser.add_argument(
+            "--no-duplicate-index",
+            dest="duplicate_index",
+            action="store_false",
+            default=True,
+            help=(
+                "Search Anki for duplicates of each entry instead of indexing "
+                "the deck's notes once at the start of the import"
+            ),
+        )
+        parser.add_argument(
+            "--async",
+            dest="use_async",
+            action="store_true",
+            default=False,
+            help=(
+                "Send requests for independent entries to AnkiConnect "
+                "concurrently, batched as --backend batches them (requires "
+                "aiohttp); the null and apkg backends write locally, so it "
+                "makes no difference to them"
+            ),
+        )
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=8,
+            help=(
+                "Maximum number of concurrent requests to AnkiConnect when "
+                "using --async (default: 8)"
+            ),
+        )
+        parser.add_argument(
+            "--prepare-workers",
+            type=int,
+            default=1,
+            help=(
+                "Number of threads validating entries and encoding their "
+                "media ahead of the import (default: 1)"
+            ),
+        )
+        parser.add_argument(
+            "--no-legacy-keys",
+            dest="legacy_keys",
+            action="store_false",
+            default=True,
+            help=(
+                "Do not look for entries recorded under the keys used by "
+                "earlier releases of dejima; such entries will be imported "
+                "again"
+            ),
+        )
+        parser.add_argument(
+            "--processes",
+            type=int,
+            default=0,
+            help=(
+                "Number of processes calculating keys and building notes "
+                "from the source's records; by default, this is done on a "
+                "single thread"
+            ),
+        )
+        parser.add_argument(
+            "--queue-size",
+            type=int,
+            default=4,
+            help=(
+                "Number of chunks each stage of the import may read ahead of "
+                "the next (default: 4)"
+            ),
+        )
+        parser.add_argument(
+            "--stage-metrics",
+            action="store_true",
+            default=False,
+            help="Show how long each stage of the import spent working and waiting",
+        )
+        parser.add_argument(
+            "--resume",
+            action="store_true",
+            default=False,
+            help=(
+                "Continue the last import of this file into this deck that did "
+                "not finish from where it stopped, rather than reading the "
+                "file from the beginning"
+            ),
+        )
+        parser.add_argument(
+            "--checkpoint-interval",
+            type=float,
+            default=30.0,
+            metavar="SECONDS",
+            help=(
+                "How often to record how far the import has got, so that it "
+                "can be resumed (default: 30)"
+            ),
+        )
+        parser.add_argument(
+            "--model-cache-ttl",
+            type=float,
+            default=7 * 24 * 60 * 60,
+            metavar="SECONDS",
+            help=(
+                "How long what was learned about the note type in Anki is "
+                "relied upon before asking AnkiConnect again (default: a week)"
+            ),
+        )
+        parser.add_argument(
+            "--refresh-models",
+            action="store_true",
+            default=False,
+            help="Ask AnkiConnect about the note type even if it was cached",
+        )
+        parser.add_argument(
+            "--full-scan",
+            action="store_true",
+            default=False,
+            help=(
+                "Read the whole input, even if its beginning is unchanged "
+                "since it was last imported from"
+            ),
+        )
+        parser.add_argument(
+            "--output",
+            choices=OUTPUT_MODES,
+            default="notes",
+            help=(
+                "How to report progress: print a line for each note created "
+                "or updated (notes; the default), show a progress bar and "
+                "only print failures (progress), or print nothing until the "
+                "import is done (quiet)"
+            ),
+        )
+        parser.add_argument(
+            "--log",
+            type=str,
+            default=None,
+            metavar="PATH",
+            help=(
+                "Append what happened to each entry to PATH, one JSON object "
+                "per line"
+            ),
+        )
+        parser.add_argument(
+            "--metrics",
+            action="store_true",
+            default=False,
+            help=(
+                "Show how long reading the source, calculating keys, "
+                "querying the database and each AnkiConnect action took, "
+                "and how much was sent to AnkiConnect; entries built by "
+                "--processes workers are not timed"
+            ),
+        )
+        parser.add_argument(
+            "--metrics-json",
+            type=str,
+            default=None,
+            metavar="PATH",
+            help="Write the import's timings and counters to PATH as JSON",
+        )
+        parser.add_argument(
+            "--metrics-prometheus",
+            type=str,
+            default=None,
+            metavar="PATH",
+            help=(
+                "Write the import's timings and counters to PATH in the "
+                "Prometheus text format, e.g. for node_exporter's textfile "
+                "collector"
+            ),
+        )
 
-        db = DatabaseConnection()
-        api = AnkiConnection()
+    def get_backend(self, pool_size: int) -> Backend:
+        backend = get_backend_name(self.options)
+        if backend == BACKEND_NULL:
+            return NullBackend()
+        elif backend == BACKEND_APKG:
+            return ApkgBackend(self.options.apkg)
+        elif backend == BACKEND_ANKICONNECT:
+            return AnkiConnectBackend(self.get_anki_connection(pool_size))
 
+        return BatchedAnkiConnectBackend(
+            self.get_anki_connection(pool_size), self.options.batch_size
+        )
+
+    def get_anki_connection(self, pool_size: int) -> AnkiConnection:
+        return AnkiConnection(
+            self.options.anki_host,
+            self.options.anki_port,
+            pool_size=pool_size,
+            keep_alive=self.options.keep_alive,
+            timeout=(DEFAULT_TIMEOUT[0], self.options.timeout),
+            retries=self.options.retries,
+            compress_threshold=self.options.compress_over,
+        )
+
+    def get_collection(self) -> str:
+        backend = get_backend_name(self.options)
+        if backend == BACKEND_NULL:
+            return backend
+        elif backend == BACKEND_APKG:
+            return f"apkg:{os.path.abspath(self.options.apkg)}"
+
+        return f"{self.options.anki_host}:{self.options.anki_port}"
+
+    def get_cached_model(
+        self, db: DatabaseConnection, model_name: str
+    ) -> Optional[CachedModel]:
+        if self.options.refresh_models:
+            return None
+
+        cached = db.get_cached_model(self.get_collection(), model_name)
+        if cached is None:
+            return None
+
+        age = datetime.datetime.utcnow() - cached.checked
+        return cached if age.total_seconds() <= self.options.model_cache_ttl else None
+
+    def cache_model(
+        self,
+        db: DatabaseConnection,
+        model_name: str,
+        fields: List[str],
+        templates: Dict[str, Dict[str, str]],
+    ) -> CachedModel:
+        cached = CachedModel(
+            self.get_collection(),
+            model_name,
+            fields,
+            get_template_fingerprint(templates),
+            datetime.datetime.utcnow(),
+        )
+        db.save_cached_model(cached)
+
+        return cached
+
+    def report_model_drift(self, model: AnkiModel, cached: CachedModel) -> None:
+        differences: List[str] = []
+
+        missing = [name for name in model.inOrderFields if name not in cached.fields]
+        if missing:
+            differences.append(f"lacks the fields {', '.join(missing)}")
+        extra = [name for name in cached.fields if name not in model.inOrderFields]
+        if extra:
+            differences.append(f"has the additional fields {', '.join(extra)}")
+        if not missing and not extra and cached.fields != model.inOrderFields:
+            differences.append("orders its fields differently")
+        if cached.template_fingerprint != get_template_fingerprint(
+            get_model_templates(model)
+        ):
+            differences.append("has different card templates")
+
+        if differences:
+            self.console.print(
+                f'[yellow]The "{model.modelName}" note type in Anki does not '
+                f"match the one the {self.options.source} source defines: it "
+                f"{'; it '.join(differences)}.  Once it has been updated in "
+                "Anki, run with --refresh-models.[/yellow]"
+            )
+
+    async def ensure_model(
+        self, backend: AsyncBackend, db: DatabaseConnection, source: SourcePlugin
+    ) -> None:
+        # What is known of the model is kept so that imports need not ask
+        # AnkiConnect about it each time.
+        model = get_model(source)
+        cached = self.get_cached_model(db, model.modelName)
+        if cached is None:
+            with MODEL_LOCK:
+                fields, templates = await backend.ensure_model(model)
+                cached = self.cache_model(db, model.modelName, fields, templates)
+
+        self.report_model_drift(model, cached)
+
+    def get_source(self) -> SourcePlugin:
         sources = get_installed_sources()
-        source = sources[self.options.source](
+
+        return sources[self.options.source](
             self.options.source,
             self.options,
             self.console,
         )
 
-        model_name = source.get_model_name()
-        if model_name not in api.get_model_names():
-            model = AnkiModel(
-                source.get_model_name(),
-                list(source.fields.keys()),
-                source.get_card_style(),
-                source.get_is_cloze(),
-                [
-                    AnkiCardTemplate(
-                        Name=dedent(t.name).strip(),
-                        Front=dedent(t.front).strip(),
-                        Back=dedent(t.back).strip(),
+    def read_records(
+        self, source: SourcePlugin, run: ImportRun
+    ) -> Iterator[Tuple[int, Optional[int], Any]]:
+        # Records a resumed run has already imported are skipped without
+        # building entries from them, or, if the source can continue from
+        # where the run stopped reading, without reading them at all.
+        start = run.offset if run.records else None
+        records: Optional[Iterable[Tuple[Optional[int], Any]]]
+        records = source.get_positioned_records(start)
+        if records is None:
+            records = ((None, record) for record in source.get_records())
+            start = None
+        if run.records and start is None:
+            records = itertools.islice(records, run.records, None)
+
+        for idx, (offset, record) in enumerate(
+            metrics.get_timer("source.read").iterate(records), start=run.records
+        ):
+            yield idx, offset, record
+
+    def read_entries(
+        self, source: SourcePlugin, run: ImportRun
+    ) -> Iterator[Tuple[int, Optional[int], Tuple[Optional[str], Note]]]:
+        if not source.supports_records():
+            entries = itertools.islice(source.get_entries(), run.records, None)
+            for idx, entry in enumerate(entries, start=run.records):
+                yield idx, None, entry
+            return
+
+        timer = metrics.get_timer("source.build")
+        for idx, offset, record in self.read_records(source, run):
+            with timer.time():
+                entry = source.get_entry(record)
+
+            yield idx, offset, entry
+
+    def get_pipeline(
+        self,
+        db: DatabaseConnection,
+        source: SourcePlugin,
+        unique_fields: List[str],
+        run: ImportRun,
+    ) -> Pipeline:
+        if (
+            source.LEGACY_KEYS
+            and self.options.legacy_keys
+            and not self.options.reimport
+            and db.has_legacy_keys(
+                self.options.source, KEY_PREFIX, run.input_path, run.fingerprint
+            )
+        ):
+            source.enable_legacy_keys()
+
+        # Source entries are read, checked against the import history and
+        # prepared on their own threads while the previous chunks are being
+        # imported; only the import itself, which depends upon the notes
+        # written before it, runs on the main thread.
+        if self.options.processes and source.supports_records():
+            # Calculating keys and building notes is CPU-bound, so it is
+            # spread across processes; the records are still read here.
+            pipeline = Pipeline(
+                chunked(self.read_records(source, run), self.options.chunk_size),
+                queue_size=self.options.queue_size,
+            )
+            pipeline.add_stage(
+                "build",
+                functools.partial(build_entries, source),
+                workers=self.options.processes,
+                processes=True,
+            )
+        else:
+            if self.options.processes:
+                self.console.print(
+                    "[yellow]This source does not support building entries "
+                    "in parallel; --processes will be ignored.[/yellow]"
+                )
+            pipeline = Pipeline(
+                chunked(self.read_entries(source, run), self.options.chunk_size),
+                queue_size=self.options.queue_size,
+            )
+
+        lookup_db: Optional[DatabaseConnection] = None
+
+        def find_known_entries(
+            chunk: List[Tuple[int, Optional[int], Tuple[Optional[str], Note]]]
+        ) -> List[PreparedEntry]:
+            nonlocal lookup_db
+
+            known_keys: Set[str] = set()
+            if not self.options.reimport:
+                # Sqlite connections cannot be shared between threads.
+                if lookup_db is None:
+                    lookup_db = DatabaseConnection(
+                        synchronous=self.options.db_synchronous,
+                        path=self.options.database,
                     )
-                    for t in source.get_card_templates()
-                ],
+                known_keys = lookup_db.get_known_keys(
+                    self.options.source,
+                    (foreign_key for _, _, (foreign_key, _) in chunk if foreign_key),
+                )
+
+            if source.legacy_keys and not self.options.reimport:
+                assert lookup_db is not None
+                # Entries imported by earlier releases are recorded under
+                # their legacy keys; those records are moved to the current
+                # keys so that they are found directly from now on.
+                legacy_keys: Dict[str, str] = {}
+                for _, _, (foreign_key, _) in chunk:
+                    legacy_key = getattr(foreign_key, "legacy", None)
+                    if foreign_key and legacy_key and foreign_key not in known_keys:
+                        legacy_keys[legacy_key] = foreign_key
+                known_legacy_keys = lookup_db.get_known_keys(
+                    self.options.source, legacy_keys.keys()
+                )
+                lookup_db.rekey_known_entries(
+                    self.options.source,
+                    ((key, legacy_keys[key]) for key in known_legacy_keys),
+                )
+                known_keys.update(legacy_keys[key] for key in known_legacy_keys)
+
+            return [
+                PreparedEntry(
+                    idx,
+                    foreign_key,
+                    entry,
+                    known=foreign_key in known_keys,
+                    offset=offset,
+                )
+                for idx, offset, (foreign_key, entry) in chunk
+            ]
+
+        pipeline.add_stage("lookup", find_known_entries)
+        pipeline.add_stage(
+            "prepare",
+            functools.partial(prepare_entries, source, unique_fields),
+            workers=self.options.prepare_workers,
+        )
+
+        return pipeline
+
+    def retire_legacy_keys(
+        self,
+        db: DatabaseConnection,
+        source: SourcePlugin,
+        run: ImportRun,
+        first_record: int,
+    ) -> None:
+        # Once every record of an input has been looked up under its legacy
+        # key, those recorded under one have been moved to their current
+        # keys, so later imports of the same, unchanged input need not
+        # calculate legacy keys at all.  Other inputs of the source may
+        # still hold records recorded under legacy keys.
+        if (
+            source.legacy_keys
+            and first_record == 0
+            and run.input_path is not None
+            and run.fingerprint is not None
+        ):
+            db.retire_legacy_keys(self.options.source, run.input_path, run.fingerprint)
+
+    def report_stage_metrics(self, pipeline: Pipeline) -> None:
+        if not self.options.stage_metrics:
+            return
+
+        for stage_metrics in pipeline.metrics:
+            self.console.print(f"[dim]{stage_metrics.get_summary()}[/dim]")
+
+    def report_metrics(self, import_name: str, counts: ImportCounts) -> None:
+        if self.options.metrics:
+            timers = Table(title="Timings")
+            timers.add_column("Operation")
+            timers.add_column("Calls", justify="right")
+            timers.add_column("Total (s)", justify="right")
+            timers.add_column("Mean (ms)", justify="right")
+            timers.add_column("Max (ms)", justify="right")
+            for name, timer in sorted(metrics.get_timers().items()):
+                if not timer.count:
+                    continue
+                timers.add_row(
+                    name,
+                    str(timer.count),
+                    f"{timer.total:.3f}",
+                    f"{timer.mean * 1000:.2f}",
+                    f"{timer.max * 1000:.2f}",
+                )
+            self.console.print(timers)
+
+            counters = Table(title="Counters")
+            counters.add_column("Counter")
+            counters.add_column("Value", justify="right")
+            for name, counter in sorted(metrics.get_counters().items()):
+                if not counter.value:
+                    continue
+                counters.add_row(name, str(counter.value))
+            self.console.print(counters)
+
+        if self.options.metrics_json:
+            with open(self.options.metrics_json, "w") as outf:
+                json.dump(
+                    {
+                        "import_name": import_name,
+                        "counts": dataclasses.asdict(counts),
+                        **metrics.to_dict(),
+                    },
+                    outf,
+                    indent=2,
+                )
+
+        if self.options.metrics_prometheus:
+            # Written alongside and then moved into place so that a collector
+            # never reads a partially-written file.
+            partial_path = f"{self.options.metrics_prometheus}.{os.getpid()}.tmp"
+            with open(partial_path, "w") as outf:
+                outf.write(metrics.to_prometheus())
+            os.replace(partial_path, self.options.metrics_prometheus)
+
+    def get_import_run(
+        self,
+        db: DatabaseConnection,
+        import_name: str,
+        input_info: Optional[os.stat_result],
+    ) -> ImportRun:
+        input = getattr(self.options, "input", None)
+        fingerprint = get_file_fingerprint(input) if input is not None else None
+        input_name = getattr(input, "name", None)
+        input_path = (
+            os.path.abspath(input_name)
+            if isinstance(input_name, str) and not input_name.startswith("<")
+            else None
+        )
+
+        if self.options.resume:
+            if fingerprint is None:
+                raise DejimaUserError(
+                    "Only imports reading from a file can be resumed."
+                )
+
+            resumed = db.get_resumable_import_run(
+                self.options.source, self.options.deck_name, fingerprint
+            )
+            if resumed is not None:
+                self.console.print(
+                    f'Resuming import "{resumed.import_name}" of '
+                    f"{resumed.input_path} after {resumed.records} records"
+                )
+                resumed.status = RUN_RUNNING
+                db.update_import_run(resumed)
+                return resumed
+
+            self.console.print(
+                f"[yellow]No unfinished import of {input_path} into "
+                f"{self.options.deck_name} was found; importing all of it."
+                "[/yellow]"
+            )
+
+        run = ImportRun(
+            import_name,
+            self.options.source,
+            self.options.deck_name,
+            input_path,
+            fingerprint,
+        )
+        if (
+            run.input_path is not None
+            and input_info is not None
+            and not self.options.full_scan
+            and not self.options.reimport
+        ):
+            self.skip_scanned_records(db, run, input_info)
+        db.start_import_run(run)
+
+        return run
+
+    def skip_scanned_records(
+        self, db: DatabaseConnection, run: ImportRun, input_info: os.stat_result
+    ) -> None:
+        # Inputs that are re-imported as they grow are only read from
+        # where the last import of them left off, if what came before is
+        # unchanged.
+        assert run.input_path is not None
+
+        scan = db.get_source_scan(self.options.source, run.input_path)
+        if scan is None or input_info.st_size < scan.prefix_length:
+            return
+
+        if (input_info.st_size, input_info.st_mtime_ns) != (scan.size, scan.mtime):
+            with metrics.get_timer("source.scan").time():
+                prefix_hash = get_prefix_hash(self.options.input, scan.prefix_length)
+            if prefix_hash != scan.prefix_hash:
+                return
+
+        run.records = scan.records
+        run.offset = scan.offset
+        self.console.print(
+            f"Skipping {scan.records} records imported from {run.input_path} before"
+        )
+
+    def save_source_scan(
+        self, db: DatabaseConnection, run: ImportRun, input_info: os.stat_result
+    ) -> None:
+        assert run.input_path is not None
+
+        # Without an offset, the records cannot be tied to fewer bytes of
+        # the input than all of those there were when the import started.
+        length = run.offset if run.offset is not None else input_info.st_size
+        with metrics.get_timer("source.scan").time():
+            prefix_hash = get_prefix_hash(self.options.input, length)
+        if prefix_hash is None:
+            return
+
+        db.save_source_scan(
+            SourceScan(
+                self.options.source,
+                run.input_path,
+                input_info.st_size,
+                input_info.st_mtime_ns,
+                length,
+                prefix_hash,
+                run.records,
+                run.offset,
             )
-            api.create_model(model)
+        )
+
+    def checkpoint(
+        self,
+        db: DatabaseConnection,
+        run: ImportRun,
+        reporter: ImportReporter,
+        last: PreparedEntry,
+    ) -> None:
+        # Every entry up to ``last`` must have been imported and recorded.
+        # Failed entries are not recorded, so once one has failed, the
+        # checkpoint stays where it was so that resuming retries it.
+        if reporter.counts.failed or reporter.counts.media_failed:
+            return
+
+        run.records = last.idx + 1
+        run.offset = last.offset
+        db.update_import_run(run)
+
+    def handle(self) -> None:
+        with scratch_history(self.options):
+            run_timestamp = datetime.datetime.utcnow()
 
-        added = 0
-        merged = 0
-        invalid = 0
-        total = 0
+            metrics.reset()
+            db = DatabaseConnection(
+                synchronous=self.options.db_synchronous, path=self.options.database
+            )
+            input = getattr(self.options, "input", None)
+            input_info = get_file_stat(input) if input is not None else None
+            run = self.get_import_run(
+                db, f'import{run_timestamp.strftime("%Y%m%dT%H%M%S")}', input_info
+            )
+            import_name = run.import_name
 
-        for idx, (foreign_key, entry) in enumerate(source.get_entries()):
+            log = open(self.options.log, "a") if self.options.log else None
+            reporter = ImportReporter(
+                self.console,
+                import_name,
+                mode=self.options.output,
+                log=log,
+                input=input,
+            )
+            counts = reporter.counts
             try:
-                total += 1
-                if (
-                    not foreign_key
-                    or self.options.reimport
-                    or not db.annotation_is_known(self.options.source, foreign_key)
-                ):
-                    note_is_valid = True
-                    for field_name, field_info in source.fields.items():
-                        if not field_info.optional and not entry.fields.get(field_name):
-                            self.console.print(
-                                f"[yellow]Invalid note (missing '{field_name}') "
-                                f"[bold]Idx {idx}[/bold] "
-                                "[/yellow]"
-                            )
-                            invalid += 1
-                            note_is_valid = False
-                            if foreign_key:
-                                db.mark_entry_processed(
-                                    self.options.source, foreign_key, None, import_name
-                                )
+                self.run_import(db, run, reporter, input_info)
+            except BaseException:
+                self.console.print(f"[red]{counts.get_summary()}[/red]")
+                self.console.print(
+                    f'[red][bold]Import "{import_name}" failed.[/bold][/red]'
+                )
+                raise
+            finally:
+                if log is not None:
+                    log.close()
+                self.report_metrics(import_name, counts)
 
-                        if field_info.default and field_name not in entry.fields:
-                            entry.fields[field_name] = field_info.default
-                    if not note_is_valid:
-                        continue
-                    clauses: List[str] = []
-                    for field_name, field_info in source.fields.items():
-                        if field_info.unique:
-                            clauses.append(
-                                f"{field_name}:{escape(entry.fields.get(field_name, ''))}"
-                            )
-                            pass
+            self.console.print(f"[blue]{counts.get_summary()}[/blue]")
+
+    def run_import(
+        self,
+        db: DatabaseConnection,
+        run: ImportRun,
+        reporter: ImportReporter,
+        input_info: Optional[os.stat_result],
+    ) -> None:
+        if run.records:
+            reporter.skipped(run.records)
+
+        try:
+            with reporter:
+                loop = asyncio.new_event_loop()
+                try:
+                    loop.run_until_complete(self.import_entries(db, run, reporter))
+                finally:
+                    loop.close()
+        except BaseException:
+            run.status = RUN_FAILED
+            db.update_import_run(run)
+            db.invalidate_cached_models(self.get_collection())
+            raise
+
+        if reporter.counts.failed:
+            # Perhaps because the note type was changed or removed since it
+            # was cached; the next import checks it again.
+            db.invalidate_cached_models(self.get_collection())
 
-                    duplicates = []
+        run.status = RUN_COMPLETED
+        db.update_import_run(run)
+        if run.input_path is not None and input_info is not None:
+            self.save_source_scan(db, run, input_info)
+
+    @contextlib.asynccontextmanager
+    async def open_backend(self) -> AsyncIterator[AsyncBackend]:
+        backend_name = get_backend_name(self.options)
+        if self.options.use_async and backend_name in (
+            BACKEND_ANKICONNECT,
+            BACKEND_BATCHED,
+        ):
+            api = AsyncConnection(
+                self.options.anki_host,
+                self.options.anki_port,
+                concurrency=self.options.concurrency,
+                keep_alive=self.options.keep_alive,
+                timeout=(DEFAULT_TIMEOUT[0], self.options.timeout),
+                retries=self.options.retries,
+                compress_threshold=self.options.compress_over,
+            )
+            async_backend: AsyncBackend
+            if backend_name == BACKEND_ANKICONNECT:
+                async_backend = AsyncAnkiConnectBackend(api)
+            else:
+                async_backend = AsyncBatchedAnkiConnectBackend(
+                    api, self.options.batch_size
+                )
+            async with async_backend:
+                yield async_backend
+            return
+
+        backend = self._backend
+        if backend is None:
+            backend = self.get_backend(self.options.media_workers + 1)
+        # A shared backend is closed by the batch that opened it.
+        opened = backend if self._backend is None else contextlib.nullcontext()
+        with opened:
+            async with SyncBackendAdapter(
+                backend, self.options.media_workers
+            ) as adapter:
+                yield adapter
+
+    async def import_entries(
+        self, db: DatabaseConnection, run: ImportRun, reporter: ImportReporter
+    ) -> None:
+        import_name = run.import_name
+        first_record = run.records
+        writer = self._writer
+        if writer is None:
+            writer = db.buffered_writer(
+                self.options.db_batch_size, self.options.db_flush_interval
+            )
+        source = self.get_source()
+        model_name = source.get_model_name()
+        add_options = AnkiNoteOptions(allowDuplicate=True)
+        # Media stored in one collection are not in any other.
+        collection = self.get_collection()
+
+        unique_fields = [
+            field_name
+            for field_name, field_info in source.fields.items()
+            if field_info.unique
+        ]
+
+        # Entries are imported concurrently, so two entries sharing a
+        # unique value must not both look for duplicates before either has
+        # been written, and two merges into one note must not interleave.
+        # Locks are taken in a fixed order -- clauses, then the note -- so
+        # that entries waiting on one another cannot deadlock.
+        clause_locks: Dict[str, asyncio.Lock] = defaultdict(asyncio.Lock)
+        note_locks: Dict[int, asyncio.Lock] = defaultdict(asyncio.Lock)
+        # Media shared by several entries is only stored once per run,
+        # and not at all if an earlier run already stored it.
+        submitted_media: Set[Tuple[str, str]] = set()
+        # Entries repeated within a source are only imported once.
+        claims = self._claims
+
+        async with self.open_backend() as backend:
+            await self.ensure_model(backend, db, source)
+
+            duplicate_index: Optional[DuplicateIndex] = None
+            if unique_fields and self.options.duplicate_index:
+                duplicate_index = await DuplicateIndex.load(
+                    backend, self.options.deck_name, unique_fields
+                )
+
+            # Entries whose notes were written are recorded as soon as
+            # each request returns, in one transaction per request.
+            async def get_notes(note_ids: List[int]) -> List[Optional[AnkiNote]]:
+                notes = await backend.get_notes(note_ids)
+                return [notes.get(note_id) for note_id in note_ids]
+
+            async def add_notes(
+                adds: List[Tuple[Optional[str], AnkiNote]]
+            ) -> List[AnkiActionResult]:
+                results = await backend.add_notes(
+                    [note for _, note in adds],
+                    add_options,
+                    [foreign_key for foreign_key, _ in adds],
+                )
+                writer.commit_entries_processed(
+                    self.options.source,
+                    [
+                        (foreign_key, result.result)
+                        for (foreign_key, _), result in zip(adds, results)
+                        if foreign_key and result.error is None
+                    ],
+                    import_name,
+                )
+                return results
+
+            async def update_notes(
+                updates: List[Tuple[Optional[str], int, AnkiNote]]
+            ) -> List[AnkiActionResult]:
+                results = await backend.update_notes(
+                    [(anki_id, note) for _, anki_id, note in updates]
+                )
+                writer.commit_entries_processed(
+                    self.options.source,
+                    [
+                        (foreign_key, anki_id)
+                        for (foreign_key, anki_id, _), result in zip(updates, results)
+                        if foreign_key and result.error is None
+                    ],
+                    import_name,
+                )
+                return results
+
+            note_loader = RequestBatcher(get_notes, self.options.batch_size)
+            note_adder = RequestBatcher(add_notes, self.options.batch_size)
+            note_updater = RequestBatcher(update_notes, self.options.batch_size)
+
+            async def merge_entry(
+                idx: int, foreign_key: Optional[str], entry: Note, anki_id: int
+            ) -> None:
+                async with note_locks[anki_id]:
+                    duplicate_anki = await note_loader.submit(anki_id)
+                    if duplicate_anki is None:
+                        # The note was deleted after it was found.
+                        reporter.update_failed(
+                            idx, foreign_key, anki_id, AnkiNoteDoesNotExist(anki_id)
+                        )
+                        return
+
+                    duplicate_note = Note(
+                        fields=duplicate_anki.fields, tags=duplicate_anki.tags
+                    )
+
+                    anki_note = source.resolve_duplicate(duplicate_note, entry)
+
+                    duplicate_anki.fields = anki_note.fields
+                    duplicate_anki.tags = anki_note.tags
+
+                    result = await note_updater.submit(
+                        (foreign_key, anki_id, duplicate_anki)
+                    )
+                    if result.error is not None:
+                        reporter.update_failed(idx, foreign_key, anki_id, result.error)
+                        return
+
+                    if duplicate_index is not None:
+                        duplicate_index.add(anki_id, duplicate_anki.fields)
+
+                reporter.updated(idx, foreign_key, anki_id)
+
+            async def add_entry(
+                idx: int, foreign_key: Optional[str], entry: Note
+            ) -> None:
+                new_note = AnkiNote(
+                    model_name,
+                    self.options.deck_name,
+                    entry.fields,
+                    entry.tags
+                    + [
+                        "dejima-import",
+                        import_name,
+                    ],
+                )
+                result = await note_adder.submit((foreign_key, new_note))
+                if result.error is not None:
+                    reporter.create_failed(idx, foreign_key, result.error)
+                    return
+
+                anki_id = result.result
+                if duplicate_index is not None:
+                    duplicate_index.add(anki_id, new_note.fields)
+                reporter.created(idx, foreign_key, anki_id)
+
+            async def import_entry(
+                idx: int, foreign_key: Optional[str], entry: Note, clauses: List[str]
+            ) -> None:
+                # Anki's field searches are case-insensitive.
+                locks = [
+                    clause_locks[clause]
+                    for clause in sorted({clause.casefold() for clause in clauses})
+                ]
+                acquired: List[asyncio.Lock] = []
+                try:
+                    for lock in locks:
+                        await lock.acquire()
+                        acquired.append(lock)
+
+                    duplicates: List[int] = []
                     if clauses:
-                        duplicates = api.find_notes(
-                            f"""
-                            deck:{escape(self.options.deck_name)}
-                            (
-                                {' or '.join(clauses)}
+                        if duplicate_index is not None:
+                            duplicates = duplicate_index.find(entry.fields)
+                        else:
+                            duplicates = await backend.find_notes(
+                                self.options.deck_name,
+                                {
+                                    field_name: entry.fields.get(field_name, "")
+                                    for field_name in unique_fields
+                                },
                             )
-                        """
-                        )
 
                     if duplicates:
                         if len(duplicates) > 1:
-                            self.console.print(
-                                "[red]Multiple duplicate notes found for "
-                                f"entry {entry} (idx: {idx}): "
-                                f"{duplicates}.[/red]"
-                            )
+                            reporter.multiple_duplicates(idx, entry, duplicates)
 
-                        anki_id = duplicates[0]
-                        duplicate_anki = api.get_note(anki_id)
+                        await merge_entry(idx, foreign_key, entry, duplicates[0])
+                    else:
+                        await add_entry(idx, foreign_key, entry)
+                finally:
+                    for lock in acquired:
+                        lock.release()
 
-                        duplicate_note = Note(
-                            fields=duplicate_anki.fields, tags=duplicate_anki.tags
-                        )
+            async def store_media(
+                idx: int, upload: AnkiMediaUpload, checksum: str
+            ) -> None:
+                # We can store the media regardless of whether the entry
+                # turns out to be a duplicate -- Anki will search for and
+                # find unreferenced media automatically -- and a note is
+                # no less imported for lacking its media.
+                try:
+                    await backend.store_media_file(upload)
+                except Exception as e:
+                    reporter.media_failed(idx, upload.filename, e)
+                    return
 
-                        anki_note = source.resolve_duplicate(duplicate_note, entry)
+                writer.mark_media_stored(collection, upload.filename, checksum)
 
-                        duplicate_anki.fields = anki_note.fields
-                        duplicate_anki.tags = anki_note.tags
+            # Reading the next chunk blocks the event loop, but no request
+            # is in flight by then.
+            last_entry: Optional[PreparedEntry] = None
+            last_checkpoint = time.monotonic()
+            pipeline = self.get_pipeline(db, source, unique_fields, run)
+            with writer, pipeline:
+                for entries in pipeline:
+                    last_entry = entries[-1]
+                    tasks: List[Awaitable[None]] = []
+                    for prepared in entries:
+                        idx = prepared.idx
+                        foreign_key = prepared.foreign_key
+                        entry = prepared.entry
 
-                        api.update_note(anki_id, duplicate_anki)
-                        if foreign_key:
-                            db.mark_entry_processed(
-                                self.options.source, foreign_key, anki_id, import_name
-                            )
-                        self.console.print(
-                            "[bright_green]Updated note "
-                            f"[bold]{anki_id}[/bold][/bright_green]"
-                        )
-                        merged += 1
-                    else:
-                        new_note = AnkiNote(
-                            model_name,
-                            self.options.deck_name,
-                            entry.fields,
-                            entry.tags
-                            + [
-                                "dejima-import",
-                                import_name,
-                            ],
-                        )
-                        anki_id = api.add_note(
-                            new_note, AnkiNoteOptions(allowDuplicate=True)
-                        )
-                        if foreign_key:
-                            db.mark_entry_processed(
-                                self.options.source, foreign_key, anki_id, import_name
-                            )
-                        added += 1
-                        self.console.print(
-                            "[green]Created note " f"[bold]{anki_id}[/bold]" "[/green]"
-                        )
+                        reporter.advance()
+                        if prepared.known or (
+                            foreign_key and not claims.claim(foreign_key)
+                        ):
+                            continue
 
-                    # We can upload the media regardless of whether
-                    # this element turns out to be a duplicate --
-                    # Anki will search for and find unreferenced media
-                    # automatically.
-                    for media in entry.media:
-                        api.store_media_file(
-                            AnkiMediaUpload(
-                                filename=media.filename,
-                                data=base64.b64encode(media.data).decode("ascii"),
-                            )
+                        if prepared.missing_fields:
+                            reporter.invalid(idx, foreign_key, prepared.missing_fields)
+                            if foreign_key:
+                                writer.mark_entry_processed(
+                                    self.options.source, foreign_key, None, import_name
+                                )
+                            continue
+
+                        tasks.append(
+                            import_entry(idx, foreign_key, entry, prepared.clauses)
                         )
 
-            except Exception:
-                self.console.print(
-                    f"[red]Added [bold]{added}[/bold] new records[/red] "
-                    f"({merged} merged; {invalid} invalid; "
-                    f"{total - added - invalid - merged} already processed)"
-                )
-                self.console.print(
-                    f'[red][bold]Import "{import_name}" failed.[/bold][/red]'
-                )
-                raise
+                        for upload, checksum in prepared.uploads:
+                            if (upload.filename, checksum) in submitted_media:
+                                continue
+                            submitted_media.add((upload.filename, checksum))
+                            if not self.options.reimport and db.media_is_stored(
+                                collection, upload.filename, checksum
+                            ):
+                                continue
 
-        self.console.print(
-            f"[blue]Added [bold]{added}[/bold] new records[/blue] "
-            f"({merged} merged; {invalid} invalid; "
-            f"{total - added - invalid - merged} already processed)"
-        )
+                            tasks.append(store_media(idx, upload, checksum))
+
+                    await gather_all(tasks)
+
+                    writer.flush()
+                    clause_locks.clear()
+                    note_locks.clear()
+
+                    if (
+                        time.monotonic() - last_checkpoint
+                        >= self.options.checkpoint_interval
+                    ):
+                        self.checkpoint(db, run, reporter, entries[-1])
+                        last_checkpoint = time.monotonic()
+
+            if last_entry is not None:
+                self.checkpoint(db, run, reporter, last_entry)
+            self.retire_legacy_keys(db, source, run, first_record)
+
+        self.report_stage_metrics(pipeline)
@@ -1,66 +1,480 @@
+from __future__ import annotations
+
+import contextlib
+import dataclasses
 import datetime
+import json
 import os.path
 import sqlite3
+import threading
+import time
+from typing import Iterable
+from typing import Iterator
+from typing import List
 from typing import Optional
+from typing import Set
+from typing import Tuple
 
 import appdirs
 
 from . import constants
+from . import metrics
 
 USER_DATA_DIR = appdirs.user_data_dir(constants.APP_NAME, constants.AUTHOR_NAME)
 DB_PATH = os.path.join(USER_DATA_DIR, "dejima.db")
 
+# Batches of keys larger than this are looked up by joining against a
+# temporary table rather than binding each key as a query parameter; sqlite
+# limits the number of parameters per statement (999 in older releases).
+KNOWN_KEYS_IN_CLAUSE_LIMIT = 500
+
+# Each migration brings the schema forward by one version; the version a
+# database is at is tracked in sqlite's ``user_version`` pragma.
+MIGRATIONS: List[List[str]] = [
+    [
+        """
+        CREATE TABLE IF NOT EXISTS known_entries (
+            key string,
+            source string,
+            anki_id integer,
+            importName string,
+            imported timestamp
+        )
+        """,
+    ],
+    [
+        """
+        CREATE TABLE known_entries_new (
+            key string NOT NULL,
+            source string NOT NULL,
+            anki_id integer,
+            importName string,
+            imported timestamp,
+            PRIMARY KEY (source, key)
+        )
+        """,
+        """
+        INSERT INTO known_entries_new
+            (key, source, anki_id, importName, imported)
+        SELECT key, source, anki_id, importName, imported
+        FROM known_entries
+        WHERE rowid IN (
+            SELECT MAX(rowid)
+            FROM known_entries
+            WHERE key IS NOT NULL AND source IS NOT NULL
+            GROUP BY source, key
+        )
+        """,
+        "DROP TABLE known_entries",
+        "ALTER TABLE known_entries_new RENAME TO known_entries",
+    ],
+    [
+        """
+        CREATE TABLE stored_media (
+            filename string PRIMARY KEY,
+            checksum string NOT NULL,
+            stored timestamp
+        )
+        """,
+    ],
+    [
+        """
+        CREATE TABLE import_runs (
+            importName string PRIMARY KEY,
+            source string NOT NULL,
+            deckName string NOT NULL,
+            inputPath string,
+            fingerprint string,
+            records integer NOT NULL DEFAULT 0,
+            offset integer,
+            status string NOT NULL,
+            started timestamp,
+            updated timestamp
+        )
+        """,
+        """
+        CREATE INDEX import_runs_fingerprint
+        ON import_runs (source, deckName, fingerprint)
+        """,
+    ],
+    [
+        """
+        CREATE TABLE source_scans (
+            source string NOT NULL,
+            inputPath string NOT NULL,
+            size integer NOT NULL,
+            mtime integer NOT NULL,
+            prefixLength integer NOT NULL,
+            prefixHash string NOT NULL,
+            records integer NOT NULL,
+            offset integer,
+            scanned timestamp,
+            PRIMARY KEY (source, inputPath)
+        )
+        """,
+    ],
+    [
+        """
+        CREATE TABLE anki_models (
+            collection string NOT NULL,
+            modelName string NOT NULL,
+            fields string NOT NULL,
+            templateFingerprint string NOT NULL,
+            checked timestamp NOT NULL,
+            PRIMARY KEY (collection, modelName)
+        )
+        """,
+    ],
+    [
+        """
+        CREATE TABLE retired_legacy_keys (
+            source string PRIMARY KEY,
+            retired timestamp
+        )
+        """,
+    ],
+    [
+        # A source's other inputs may still hold records imported under
+        # legacy keys, so keys are retired per input; retirements of whole
+        # sources are dropped, and their legacy keys looked for again.
+        "DROP TABLE retired_legacy_keys",
+        """
+        CREATE TABLE retired_legacy_keys (
+            source string NOT NULL,
+            inputPath string NOT NULL,
+            fingerprint string NOT NULL,
+            retired timestamp,
+            PRIMARY KEY (source, inputPath)
+        )
+        """,
+    ],
+    [
+        # Media are recorded as stored per collection, as models are.  Which
+        # collection media recorded before were stored in is not known, so
+        # they are uploaded again.
+        "DROP TABLE stored_media",
+        """
+        CREATE TABLE stored_media (
+            collection string NOT NULL,
+            filename string NOT NULL,
+            checksum string NOT NULL,
+            stored timestamp,
+            PRIMARY KEY (collection, filename)
+        )
+        """,
+    ],
+]
+
+# Statuses of import runs; only runs that did not complete can be resumed.
+RUN_RUNNING = "running"
+RUN_FAILED = "failed"
+RUN_COMPLETED = "completed"
+
+INSERT_KNOWN_ENTRY_SQL = """
+    INSERT OR REPLACE INTO known_entries
+        (key, source, anki_id, imported, importName)
+    VALUES
+        (?, ?, ?, ?, ?)
+"""
+INSERT_STORED_MEDIA_SQL = """
+    INSERT OR REPLACE INTO stored_media
+        (collection, filename, checksum, stored)
+    VALUES
+        (?, ?, ?, ?)
+"""
+
+
+@dataclasses.dataclass
+class ImportRun:
+    import_name: str
+    source: str
+    deck_name: str
+    input_path: Optional[str]
+    fingerprint: Optional[str]
+    # Number of the input's records that have been imported and recorded,
+    # and, if the source can resume reading from one, the byte offset just
+    # past the last of them.
+    records: int = 0
+    offset: Optional[int] = None
+    status: str = RUN_RUNNING
+
+
+@dataclasses.dataclass
+class SourceScan:
+    source: str
+    input_path: str
+    # The input file's size and modification time (in nanoseconds) when
+    # it was last imported from.
+    size: int
+    mtime: int
+    # While the first ``prefix_length`` bytes of the input are unchanged,
+    # so are its first ``records`` records, which were all imported;
+    # ``offset`` is where the source can resume reading after them.
+    prefix_length: int
+    prefix_hash: str
+    records: int
+    offset: Optional[int] = None
+
+
+@dataclasses.dataclass
+class CachedModel:
+    # The AnkiConnect instance the model was found in, as host:port.
+    collection: str
+    model_name: str
+    fields: List[str]
+    template_fingerprint: str
+    checked: datetime.datetime
+
+
+KnownEntryRow = Tuple[str, str, Optional[int], datetime.datetime, str]
+StoredMediaRow = Tuple[str, str, str, datetime.datetime]
+
+JOURNAL_MODES = ["DELETE", "TRUNCATE", "PERSIST", "MEMORY", "WAL", "OFF"]
+SYNCHRONOUS_MODES = ["OFF", "NORMAL", "FULL", "EXTRA"]
+
+
+SQLITE_TIMER = metrics.get_timer("sqlite")
+
+
+class TimedCursor(sqlite3.Cursor):
+    def execute(self, *args, **kwargs):
+        with SQLITE_TIMER.time():
+            return super().execute(*args, **kwargs)
+
+    def executemany(self, *args, **kwargs):
+        with SQLITE_TIMER.time():
+            return super().executemany(*args, **kwargs)
+
+    def fetchone(self, *args, **kwargs):
+        with SQLITE_TIMER.time():
+            return super().fetchone(*args, **kwargs)
+
+    def fetchall(self, *args, **kwargs):
+        with SQLITE_TIMER.time():
+            return super().fetchall(*args, **kwargs)
+
+
+class BufferedWriter:
+    _connection: Connection
+    _size: int
+    _interval: Optional[float]
+    _rows: List[KnownEntryRow]
+    _media_rows: List[StoredMediaRow]
+    _last_flush: float
+
+    def __init__(self, connection: Connection, size: int = 500, interval: float = None):
+        if size < 1:
+            raise ValueError("Batch size must be at least 1.")
+
+        self._connection = connection
+        self._size = size
+        self._interval = interval
+        self._rows = []
+        self._media_rows = []
+        self._last_flush = time.monotonic()
+        # Imports run together in a batch share one writer; the lock is
+        # also held while writing, as the connection may not be used by
+        # more than one thread at once.
+        self._lock = threading.Lock()
+
+        super().__init__()
+
+    def __len__(self) -> int:
+        return len(self._rows) + len(self._media_rows)
+
+    def __enter__(self) -> BufferedWriter:
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        # Rows are only buffered once what they record has happened, so
+        # they are written even if the import is failing.
+        self.flush()
+
+    def mark_entry_processed(
+        self, source: str, key: str, anki_id: Optional[int], import_name: str
+    ):
+        self.mark_entries_processed(source, [(key, anki_id)], import_name)
+
+    def mark_entries_processed(
+        self,
+        source: str,
+        entries: Iterable[Tuple[str, Optional[int]]],
+        import_name: str,
+    ):
+        imported = datetime.datetime.utcnow()
+        rows = [
+            (key, source, anki_id, imported, import_name) for key, anki_id in entries
+        ]
+        with self._lock:
+            self._rows.extend(rows)
+        self._flush_if_due()
+
+    def commit_entries_processed(
+        self,
+        source: str,
+        entries: Iterable[Tuple[str, Optional[int]]],
+        import_name: str,
+    ):
+        # Entries whose notes have just been written to Anki are recorded
+        # at once rather than buffered: were the import killed before
+        # they were written, the notes would be created again by the next
+        # run, or when it is resumed.
+        imported = datetime.datetime.utcnow()
+        rows = [
+            (key, source, anki_id, imported, import_name) for key, anki_id in entries
+        ]
+        with self._lock:
+            self._rows.extend(rows)
+        self.flush()
+
+    def mark_media_stored(self, collection: str, filename: str, checksum: str):
+        row = (collection, filename, checksum, datetime.datetime.utcnow())
+        with self._lock:
+            self._media_rows.append(row)
+        self._flush_if_due()
+
+    def _flush_if_due(self) -> None:
+        if len(self) >= self._size or (
+            self._interval is not None
+            and time.monotonic() - self._last_flush >= self._interval
+        ):
+            self.flush()
+
+    @metrics.timed("db.write")
+    def flush(self) -> None:
+        with self._lock:
+            self._last_flush = time.monotonic()
+            if not len(self):
+                return
+
+            rows, self._rows = self._rows, []
+            media_rows, self._media_rows = self._media_rows, []
+            with self._connection.transaction() as cursor:
+                cursor.executemany(INSERT_KNOWN_ENTRY_SQL, rows)
+                cursor.executemany(INSERT_STORED_MEDIA_SQL, media_rows)
+
 
 class Connection:
     _db: sqlite3.Connection
 
-    def __init__(self):
-        if not os.path.exists(USER_DATA_DIR):
-            os.makedirs(USER_DATA_DIR, exist_ok=True)
+    def __init__(
+        self,
+        journal_mode: str = "WAL",
+        synchronous: str = "NORMAL",
+        path: str = None,
+        check_same_thread: bool = True,
+    ):
+        if journal_mode.upper() not in JOURNAL_MODES:
+            raise ValueError(f"Unknown journal mode: {journal_mode}")
+        if synchronous.upper() not in SYNCHRONOUS_MODES:
+            raise ValueError(f"Unknown synchronous mode: {synchronous}")
+
+        if path is None:
+            path = DB_PATH
+
+        directory = os.path.dirname(os.path.abspath(path))
+        if not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
 
         self._db = sqlite3.Connection(
-            DB_PATH,
+            path,
             detect_types=sqlite3.PARSE_DECLTYPES,
             isolation_level=None,
+            check_same_thread=check_same_thread,
         )
+        self._db.execute(f"PRAGMA journal_mode = {journal_mode.upper()}")
+        self._db.execute(f"PRAGMA synchronous = {synchronous.upper()}")
 
-        self._create_tables()
+        self._migrate()
 
         super().__init__()
 
     def get_cursor(self) -> sqlite3.Cursor:
-        return self._db.cursor()
+        return self._db.cursor(TimedCursor)
 
-    def _create_tables(self):
+    @contextlib.contextmanager
+    def transaction(self) -> Iterator[sqlite3.Cursor]:
         cursor = self.get_cursor()
-        cursor.execute(
-            """
-            CREATE TABLE IF NOT EXISTS known_entries (
-                key string,
-                source string,
-                anki_id integer,
-                importName string,
-                imported timestamp
-            )
-        """
-        )
+        cursor.execute("BEGIN")
+        try:
+            yield cursor
+        except BaseException:
+            cursor.execute("ROLLBACK")
+            raise
+        else:
+            cursor.execute("COMMIT")
+        finally:
+            cursor.close()
+
+    def buffered_writer(
+        self, size: int = 500, interval: float = None
+    ) -> BufferedWriter:
+        return BufferedWriter(self, size, interval)
+
+    def get_schema_version(self) -> int:
+        cursor = self.get_cursor()
+        cursor.execute("PRAGMA user_version")
+        version = cursor.fetchone()[0]
         cursor.close()
 
+        return version
+
+    def _migrate(self):
+        version = self.get_schema_version()
+
+        for number, statements in enumerate(MIGRATIONS[version:], start=version + 1):
+            with self.transaction() as cursor:
+                for statement in statements:
+                    cursor.execute(statement)
+                cursor.execute(f"PRAGMA user_version = {number}")
+
     def mark_entry_processed(
         self, source: str, key: str, anki_id: Optional[int], import_name: str
     ):
+        self.mark_entries_processed(source, [(key, anki_id)], import_name)
+
+    @metrics.timed("db.write")
+    def mark_entries_processed(
+        self,
+        source: str,
+        entries: Iterable[Tuple[str, Optional[int]]],
+        import_name: str,
+    ):
+        imported = datetime.datetime.utcnow()
+
+        self._insert_known_entries(
+            (key, source, anki_id, imported, import_name) for key, anki_id in entries
+        )
+
+    def _insert_known_entries(self, rows: Iterable[KnownEntryRow]):
+        with self.transaction() as cursor:
+            cursor.executemany(INSERT_KNOWN_ENTRY_SQL, rows)
+
+    @metrics.timed("db.write")
+    def mark_media_stored(self, collection: str, filename: str, checksum: str):
+        with self.transaction() as cursor:
+            cursor.execute(
+                INSERT_STORED_MEDIA_SQL,
+                (collection, filename, checksum, datetime.datetime.utcnow()),
+            )
+
+    @metrics.timed("db.lookup")
+    def media_is_stored(self, collection: str, filename: str, checksum: str) -> bool:
         cursor = self.get_cursor()
         cursor.execute(
             """
-            INSERT INTO known_entries
-                (key, source, anki_id, imported, importName)
-            VALUES
-                (?, ?, ?, ?, ?)
+            SELECT 1
+            FROM stored_media
+            WHERE collection = ? AND filename = ? AND checksum = ?
         """,
-            (key, source, anki_id, datetime.datetime.utcnow(), import_name),
+            (collection, filename, checksum),
         )
+
+        exists = cursor.fetchone() is not None
         cursor.close()
 
+        return exists
+
     def annotation_is_known(self, source: str, key: str) -> bool:
         cursor = self.get_cursor()
         cursor.execute(
@@ -79,3 +493,260 @@ class Connection:
         cursor.close()
 
         return exists
+
+    def has_legacy_keys(
+        self,
+        source: str,
+        prefix: str,
+        input_path: Optional[str] = None,
+        fingerprint: Optional[str] = None,
+    ) -> bool:
+        # Legacy keys left once an input's have been retired are for records
+        # it no longer holds, so they are not looked for while it is
+        # unchanged; they may still be for records in other inputs.
+        cursor = self.get_cursor()
+        cursor.execute(
+            """
+            SELECT 1
+            FROM known_entries
+            WHERE
+                source = ?
+                AND substr(key, 1, ?) != ?
+                AND NOT EXISTS (
+                    SELECT 1
+                    FROM retired_legacy_keys
+                    WHERE source = ? AND inputPath = ? AND fingerprint = ?
+                )
+            LIMIT 1
+        """,
+            (source, len(prefix), prefix, source, input_path, fingerprint),
+        )
+
+        exists = cursor.fetchone() is not None
+        cursor.close()
+
+        return exists
+
+    def retire_legacy_keys(self, source: str, input_path: str, fingerprint: str):
+        with self.transaction() as cursor:
+            cursor.execute(
+                """
+                INSERT OR REPLACE INTO retired_legacy_keys
+                    (source, inputPath, fingerprint, retired)
+                VALUES (?, ?, ?, ?)
+            """,
+                (source, input_path, fingerprint, datetime.datetime.utcnow()),
+            )
+
+    def rekey_known_entries(self, source: str, keys: Iterable[Tuple[str, str]]):
+        with self.transaction() as cursor:
+            cursor.executemany(
+                """
+                UPDATE OR REPLACE known_entries
+                SET key = ?
+                WHERE source = ? AND key = ?
+            """,
+                ((new_key, source, old_key) for old_key, new_key in keys),
+            )
+
+    def start_import_run(self, run: ImportRun) -> None:
+        now = datetime.datetime.utcnow()
+        with self.transaction() as cursor:
+            cursor.execute(
+                """
+                INSERT OR REPLACE INTO import_runs (
+                    importName, source, deckName, inputPath, fingerprint,
+                    records, offset, status, started, updated
+                )
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+                (
+                    run.import_name,
+                    run.source,
+                    run.deck_name,
+                    run.input_path,
+                    run.fingerprint,
+                    run.records,
+                    run.offset,
+                    run.status,
+                    now,
+                    now,
+                ),
+            )
+
+    def update_import_run(self, run: ImportRun) -> None:
+        with self.transaction() as cursor:
+            cursor.execute(
+                """
+                UPDATE import_runs
+                SET records = ?, offset = ?, status = ?, updated = ?
+                WHERE importName = ?
+            """,
+                (
+                    run.records,
+                    run.offset,
+                    run.status,
+                    datetime.datetime.utcnow(),
+                    run.import_name,
+                ),
+            )
+
+    def get_resumable_import_run(
+        self, source: str, deck_name: str, fingerprint: str
+    ) -> Optional[ImportRun]:
+        cursor = self.get_cursor()
+        cursor.execute(
+            """
+            SELECT
+                importName, source, deckName, inputPath, fingerprint,
+                records, offset, status
+            FROM import_runs
+            WHERE
+                source = ?
+                AND deckName = ?
+                AND fingerprint = ?
+                AND status != ?
+            ORDER BY started DESC
+            LIMIT 1
+        """,
+            (source, deck_name, fingerprint, RUN_COMPLETED),
+        )
+        row = cursor.fetchone()
+        cursor.close()
+
+        return ImportRun(*row) if row is not None else None
+
+    def get_source_scan(self, source: str, input_path: str) -> Optional[SourceScan]:
+        cursor = self.get_cursor()
+        cursor.execute(
+            """
+            SELECT
+                source, inputPath, size, mtime, prefixLength, prefixHash,
+                records, offset
+            FROM source_scans
+            WHERE source = ? AND inputPath = ?
+        """,
+            (source, input_path),
+        )
+        row = cursor.fetchone()
+        cursor.close()
+
+        return SourceScan(*row) if row is not None else None
+
+    def save_source_scan(self, scan: SourceScan) -> None:
+        with self.transaction() as cursor:
+            cursor.execute(
+                """
+                INSERT OR REPLACE INTO source_scans (
+                    source, inputPath, size, mtime, prefixLength, prefixHash,
+                    records, offset, scanned
+                )
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+                (
+                    scan.source,
+                    scan.input_path,
+                    scan.size,
+                    scan.mtime,
+                    scan.prefix_length,
+                    scan.prefix_hash,
+                    scan.records,
+                    scan.offset,
+                    datetime.datetime.utcnow(),
+                ),
+            )
+
+    def get_cached_model(
+        self, collection: str, model_name: str
+    ) -> Optional[CachedModel]:
+        cursor = self.get_cursor()
+        cursor.execute(
+            """
+            SELECT collection, modelName, fields, templateFingerprint, checked
+            FROM anki_models
+            WHERE collection = ? AND modelName = ?
+        """,
+            (collection, model_name),
+        )
+        row = cursor.fetchone()
+        cursor.close()
+
+        if row is None:
+            return None
+
+        collection, model_name, fields, template_fingerprint, checked = row
+        return CachedModel(
+            collection, model_name, json.loads(fields), template_fingerprint, checked
+        )
+
+    def save_cached_model(self, model: CachedModel) -> None:
+        with self.transaction() as cursor:
+            cursor.execute(
+                """
+                INSERT OR REPLACE INTO anki_models (
+                    collection, modelName, fields, templateFingerprint, checked
+                )
+                VALUES (?, ?, ?, ?, ?)
+            """,
+                (
+                    model.collection,
+                    model.model_name,
+                    json.dumps(model.fields),
+                    model.template_fingerprint,
+                    model.checked,
+                ),
+            )
+
+    def invalidate_cached_models(self, collection: str) -> None:
+        with self.transaction() as cursor:
+            cursor.execute(
+                "DELETE FROM anki_models WHERE collection = ?", (collection,)
+            )
+
+    @metrics.timed("db.lookup")
+    def get_known_keys(self, source: str, keys: Iterable[str]) -> Set[str]:
+        keys = list(set(keys))
+        if not keys:
+            return set()
+
+        if len(keys) <= KNOWN_KEYS_IN_CLAUSE_LIMIT:
+            cursor = self.get_cursor()
+            cursor.execute(
+                f"""
+                SELECT key
+                FROM known_entries
+                WHERE source = ? AND key IN ({', '.join('?' for _ in keys)})
+            """,
+                (source, *keys),
+            )
+            known = {row[0] for row in cursor.fetchall()}
+            cursor.close()
+
+            return known
+
+        with self.transaction() as cursor:
+            cursor.execute(
+                """
+                CREATE TEMP TABLE IF NOT EXISTS lookup_keys (
+                    key string PRIMARY KEY
+                )
+            """
+            )
+            cursor.executemany(
+                "INSERT INTO lookup_keys (key) VALUES (?)",
+                ((key,) for key in keys),
+            )
+            cursor.execute(
+                """
+                SELECT known_entries.key
+                FROM lookup_keys
+                JOIN known_entries
+                    ON known_entries.source = ?
+                    AND known_entries.key = lookup_keys.key
+            """,
+                (source,),
+            )
+            known = {row[0] for row in cursor.fetchall()}
+            cursor.execute("DELETE FROM lookup_keys")
+
+        return known
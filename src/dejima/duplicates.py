@@ -0,0 +1,88 @@
+from __future__ import annotations
+
+from collections import defaultdict
+from typing import Dict
+from typing import Iterable
+from typing import List
+from typing import Set
+from typing import Tuple
+
+from .backends import AsyncBackend
+from .util import chunked
+from .util import gather_all
+
+UniqueValue = Tuple[str, str]
+
+
+class DuplicateIndex:
+    """In-memory index of a deck's notes by the values of their unique fields.
+
+    Lookups mirror a ``field:"value"`` search, which matches field names
+    and values case-insensitively.
+    """
+
+    _field_names: List[str]
+    _notes_by_value: Dict[UniqueValue, Set[int]]
+    _values_by_note: Dict[int, List[UniqueValue]]
+
+    def __init__(self, field_names: Iterable[str]):
+        self._field_names = list(field_names)
+        self._notes_by_value = defaultdict(set)
+        self._values_by_note = {}
+
+        super().__init__()
+
+    @classmethod
+    async def load(
+        cls,
+        backend: AsyncBackend,
+        deck_name: str,
+        field_names: Iterable[str],
+        batch_size: int = 500,
+    ) -> DuplicateIndex:
+        index = cls(field_names)
+
+        note_ids = await backend.find_notes(deck_name)
+        for notes in await gather_all(
+            backend.get_notes(chunk) for chunk in chunked(note_ids, batch_size)
+        ):
+            for note_id, note in notes.items():
+                index.add(note_id, note.fields)
+
+        return index
+
+    def __len__(self) -> int:
+        return len(self._values_by_note)
+
+    def get_unique_values(self, fields: Dict[str, str]) -> List[UniqueValue]:
+        # Anki field names are matched case-insensitively, too.
+        normalized = {k.casefold(): v for k, v in fields.items()}
+
+        return [
+            (field_name, normalized.get(field_name, "").casefold())
+            for field_name in (name.casefold() for name in self._field_names)
+        ]
+
+    def add(self, note_id: int, fields: Dict[str, str]) -> None:
+        self.remove(note_id)
+
+        present = {k.casefold() for k in fields.keys()}
+        values = [
+            value for value in self.get_unique_values(fields) if value[0] in present
+        ]
+        for value in values:
+            self._notes_by_value[value].add(note_id)
+        self._values_by_note[note_id] = values
+
+    def remove(self, note_id: int) -> None:
+        for value in self._values_by_note.pop(note_id, []):
+            self._notes_by_value[value].discard(note_id)
+            if not self._notes_by_value[value]:
+                del self._notes_by_value[value]
+
+    def find(self, fields: Dict[str, str]) -> List[int]:
+        found: Set[int] = set()
+        for value in self.get_unique_values(fields):
+            found.update(self._notes_by_value.get(value, ()))
+
+        return sorted(found)
@@ -0,0 +1,241 @@
+from __future__ import annotations
+
+import bisect
+import contextlib
+import functools
+import re
+import threading
+import time
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import Iterable
+from typing import Iterator
+from typing import List
+from typing import Tuple
+from typing import TypeVar
+
+T = TypeVar("T")
+F = TypeVar("F", bound=Callable[..., Any])
+
+# Upper bounds, in seconds, of the buckets timings are counted in.
+BUCKETS: Tuple[float, ...] = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+
+class Timer:
+    """Accumulates the time spent on an operation across threads.
+
+    Each timing is also counted in the first of ``BUCKETS`` it fits in,
+    giving a histogram of how long the operation took.
+    """
+
+    name: str
+    total: float
+    count: int
+    max: float
+    buckets: List[int]
+
+    def __init__(self, name: str):
+        self.name = name
+        self._lock = threading.Lock()
+        self.reset()
+
+        super().__init__()
+
+    def add(self, seconds: float) -> None:
+        bucket = bisect.bisect_left(BUCKETS, seconds)
+        with self._lock:
+            self.total += seconds
+            self.count += 1
+            self.buckets[bucket] += 1
+            if seconds > self.max:
+                self.max = seconds
+
+    @contextlib.contextmanager
+    def time(self) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(time.perf_counter() - started)
+
+    def iterate(self, items: Iterable[T]) -> Iterator[T]:
+        # Times retrieving each item, but not what is done with it.
+        iterator = iter(items)
+        while True:
+            started = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            self.add(time.perf_counter() - started)
+
+            yield item
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+    def reset(self) -> None:
+        with self._lock:
+            self.total = 0.0
+            self.count = 0
+            self.max = 0.0
+            # The last bucket counts timings exceeding every bound.
+            self.buckets = [0] * (len(BUCKETS) + 1)
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            cumulative = 0
+            buckets: Dict[str, int] = {}
+            for bound, count in zip(BUCKETS + (float("inf"),), self.buckets):
+                cumulative += count
+                buckets[_format_bound(bound)] = cumulative
+
+            return {
+                "total": self.total,
+                "count": self.count,
+                "max": self.max,
+                "buckets": buckets,
+            }
+
+
+class Counter:
+    """Counts events, or an amount such as bytes, across threads."""
+
+    name: str
+    value: int
+
+    def __init__(self, name: str):
+        self.name = name
+        self.value = 0
+        self._lock = threading.Lock()
+
+        super().__init__()
+
+    def add(self, amount: int = 1) -> None:
+        with self._lock:
+            self.value += amount
+
+    def reset(self) -> None:
+        with self._lock:
+            self.value = 0
+
+
+_timers: Dict[str, Timer] = {}
+_counters: Dict[str, Counter] = {}
+_registry_lock = threading.Lock()
+
+
+def _format_bound(bound: float) -> str:
+    return "+Inf" if bound == float("inf") else repr(bound)
+
+
+def get_timer(name: str) -> Timer:
+    with _registry_lock:
+        if name not in _timers:
+            _timers[name] = Timer(name)
+
+        return _timers[name]
+
+
+def get_timers() -> Dict[str, Timer]:
+    with _registry_lock:
+        return dict(_timers)
+
+
+def timed(name: str) -> Callable[[F], F]:
+    def decorator(fn: F) -> F:
+        timer = get_timer(name)
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with timer.time():
+                return fn(*args, **kwargs)
+
+        return wrapper  # type: ignore
+
+    return decorator
+
+
+def get_counter(name: str) -> Counter:
+    with _registry_lock:
+        if name not in _counters:
+            _counters[name] = Counter(name)
+
+        return _counters[name]
+
+
+def get_counters() -> Dict[str, Counter]:
+    with _registry_lock:
+        return dict(_counters)
+
+
+def reset() -> None:
+    for timer in get_timers().values():
+        timer.reset()
+    for counter in get_counters().values():
+        counter.reset()
+
+
+def to_dict() -> Dict[str, Any]:
+    return {
+        "timers": {
+            name: timer.to_dict()
+            for name, timer in sorted(get_timers().items())
+            if timer.count
+        },
+        "counters": {
+            name: counter.value
+            for name, counter in sorted(get_counters().items())
+            if counter.value
+        },
+    }
+
+
+def _get_prometheus_name(name: str) -> str:
+    return re.sub(r"[^a-zA-Z0-9_]", "_", name)
+
+
+def _escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def to_prometheus(prefix: str = "dejima") -> str:
+    # In the text exposition format read by, e.g., node_exporter's
+    # textfile collector; timers share one histogram labelled by name.
+    snapshot = to_dict()
+    lines: List[str] = []
+
+    if snapshot["timers"]:
+        histogram = f"{prefix}_operation_duration_seconds"
+        lines.append(f"# HELP {histogram} Time spent on each operation.")
+        lines.append(f"# TYPE {histogram} histogram")
+        for name, timer in snapshot["timers"].items():
+            label = f'operation="{_escape_label(name)}"'
+            for bound, count in timer["buckets"].items():
+                lines.append(f'{histogram}_bucket{{{label},le="{bound}"}} {count}')
+            lines.append(f"{histogram}_sum{{{label}}} {timer['total']!r}")
+            lines.append(f"{histogram}_count{{{label}}} {timer['count']}")
+
+    for name, value in snapshot["counters"].items():
+        counter = f"{prefix}_{_get_prometheus_name(name)}_total"
+        lines.append(f"# TYPE {counter} counter")
+        lines.append(f"{counter} {value}")
+
+    return "".join(f"{line}\n" for line in lines)
@@ -0,0 +1,328 @@
+from __future__ import annotations
+
+import collections
+import dataclasses
+import queue
+import threading
+import time
+from concurrent.futures import Executor
+from concurrent.futures import Future
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any
+from typing import Callable
+from typing import Deque
+from typing import Iterable
+from typing import Iterator
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+# How often threads blocked on a queue check whether the pipeline has
+# been closed.
+POLL_INTERVAL = 0.1
+
+
+@dataclasses.dataclass
+class StageMetrics:
+    name: str
+    workers: int
+    items: int = 0
+    # Seconds spent processing items, summed across the stage's workers.
+    busy: float = 0.0
+    # Seconds spent waiting for the previous stage to provide an item.
+    starved: float = 0.0
+    # Seconds spent waiting for the next stage to make room for an item.
+    blocked: float = 0.0
+
+    def get_summary(self) -> str:
+        return (
+            f"{self.name}: {self.items} items; "
+            f"{self.busy:.2f}s busy, "
+            f"{self.starved:.2f}s waiting for input, "
+            f"{self.blocked:.2f}s waiting for output"
+        )
+
+
+class PipelineClosed(Exception):
+    pass
+
+
+class _Failure:
+    exception: BaseException
+
+    def __init__(self, exception: BaseException):
+        self.exception = exception
+
+        super().__init__()
+
+
+_DONE = object()
+
+
+class _Stage:
+    fn: Callable[[Any], Any]
+    processes: bool
+    metrics: StageMetrics
+
+    def __init__(
+        self, name: str, fn: Callable[[Any], Any], workers: int, processes: bool
+    ):
+        self.fn = fn
+        self.processes = processes
+        self.metrics = StageMetrics(name, workers)
+
+        super().__init__()
+
+    def timed(self, item: Any) -> Tuple[Any, float]:
+        return _timed(self.fn, item)
+
+
+def _timed(fn: Callable[[Any], Any], item: Any) -> Tuple[Any, float]:
+    started = time.perf_counter()
+    result = fn(item)
+    return result, time.perf_counter() - started
+
+
+class Pipeline:
+    """Runs items through a series of stages, each on its own threads.
+
+    Stages are connected by bounded queues, so a stage that falls behind
+    makes the stages before it wait instead of letting items accumulate
+    in memory.  Items leave every stage in the order they entered it.
+    """
+
+    _items: Iterable[Any]
+    _queue_size: int
+    _stages: List[_Stage]
+    _threads: List[threading.Thread]
+    _closed: threading.Event
+
+    def __init__(self, items: Iterable[Any], name: str = "read", queue_size: int = 100):
+        if queue_size < 1:
+            raise ValueError("Queue size must be at least 1.")
+
+        self._items = items
+        self._queue_size = queue_size
+        self._source = StageMetrics(name, 1)
+        self._stages = []
+        self._threads = []
+        self._closed = threading.Event()
+
+        super().__init__()
+
+    def add_stage(
+        self,
+        name: str,
+        fn: Callable[[Any], Any],
+        workers: int = 1,
+        processes: bool = False,
+    ) -> None:
+        """Adds a stage applying ``fn`` to each item.
+
+        If ``processes`` is set, the stage's workers are processes rather
+        than threads; ``fn``, the items and their results must then be
+        picklable.
+        """
+        if self._threads:
+            raise RuntimeError("Stages cannot be added to a running pipeline.")
+        if workers < 1:
+            raise ValueError("Stages must have at least one worker.")
+
+        self._stages.append(_Stage(name, fn, workers, processes))
+
+    @property
+    def metrics(self) -> List[StageMetrics]:
+        return [self._source] + [stage.metrics for stage in self._stages]
+
+    def __enter__(self) -> Pipeline:
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+    def _put(self, output: queue.Queue, item: Any, metrics: StageMetrics) -> None:
+        started = time.perf_counter()
+        while True:
+            if self._closed.is_set():
+                raise PipelineClosed()
+            try:
+                output.put(item, timeout=POLL_INTERVAL)
+                break
+            except queue.Full:
+                continue
+        metrics.blocked += time.perf_counter() - started
+
+    def _get(self, input: queue.Queue, metrics: StageMetrics) -> Any:
+        started = time.perf_counter()
+        while True:
+            if self._closed.is_set():
+                raise PipelineClosed()
+            try:
+                item = input.get(timeout=POLL_INTERVAL)
+                break
+            except queue.Empty:
+                continue
+        metrics.starved += time.perf_counter() - started
+
+        return item
+
+    def _read(self, output: queue.Queue) -> None:
+        metrics = self._source
+        try:
+            iterator = iter(self._items)
+            while True:
+                started = time.perf_counter()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    break
+                except Exception as e:
+                    self._put(output, _Failure(e), metrics)
+                    return
+                metrics.busy += time.perf_counter() - started
+                metrics.items += 1
+
+                self._put(output, item, metrics)
+            self._put(output, _DONE, metrics)
+        except PipelineClosed:
+            pass
+
+    def _run_stage(self, stage: _Stage, input: queue.Queue, output: queue.Queue):
+        metrics = stage.metrics
+        try:
+            while True:
+                item = self._get(input, metrics)
+                if item is _DONE or isinstance(item, _Failure):
+                    self._put(output, item, metrics)
+                    return
+
+                try:
+                    result, elapsed = stage.timed(item)
+                except Exception as e:
+                    self._put(output, _Failure(e), metrics)
+                    return
+                metrics.busy += elapsed
+                metrics.items += 1
+
+                self._put(output, result, metrics)
+        except PipelineClosed:
+            pass
+
+    def _run_parallel_stage(
+        self, stage: _Stage, input: queue.Queue, output: queue.Queue
+    ):
+        metrics = stage.metrics
+        workers = metrics.workers
+        pending: Deque[Future] = collections.deque()
+        executor: Executor
+        if stage.processes:
+            executor = ProcessPoolExecutor(max_workers=workers)
+        else:
+            executor = ThreadPoolExecutor(
+                max_workers=workers, thread_name_prefix=f"pipeline-{metrics.name}"
+            )
+
+        def emit_oldest() -> Optional[_Failure]:
+            try:
+                result, elapsed = pending.popleft().result()
+            except Exception as e:
+                return _Failure(e)
+            metrics.busy += elapsed
+            metrics.items += 1
+
+            self._put(output, result, metrics)
+            return None
+
+        try:
+            while True:
+                item = self._get(input, metrics)
+                if item is _DONE or isinstance(item, _Failure):
+                    while pending:
+                        failure = emit_oldest()
+                        if failure is not None:
+                            item = failure
+                            break
+                    self._put(output, item, metrics)
+                    return
+
+                pending.append(executor.submit(_timed, stage.fn, item))
+                # Results are emitted in order, so a slow item holds back
+                # those submitted after it; at most two items per worker
+                # are held while waiting for it, and none once there is
+                # nothing left to submit.
+                while pending and (
+                    pending[0].done() or len(pending) >= workers * 2 or input.empty()
+                ):
+                    failure = emit_oldest()
+                    if failure is not None:
+                        self._put(output, failure, metrics)
+                        return
+        except PipelineClosed:
+            pass
+        finally:
+            for future in pending:
+                future.cancel()
+            # Idle workers are waited for once the stage is done so that no
+            # processes are left behind; there is no reason to wait for busy
+            # ones once the pipeline has been closed.
+            executor.shutdown(wait=not self._closed.is_set())
+
+    def _start(self) -> queue.Queue:
+        output: queue.Queue = queue.Queue(self._queue_size)
+        self._threads.append(
+            threading.Thread(
+                target=self._read,
+                args=(output,),
+                name=f"pipeline-{self._source.name}",
+                daemon=True,
+            )
+        )
+
+        for stage in self._stages:
+            input, output = output, queue.Queue(self._queue_size)
+            target = (
+                self._run_parallel_stage
+                if stage.metrics.workers > 1 or stage.processes
+                else self._run_stage
+            )
+            self._threads.append(
+                threading.Thread(
+                    target=target,
+                    args=(stage, input, output),
+                    name=f"pipeline-{stage.metrics.name}",
+                    daemon=True,
+                )
+            )
+
+        for thread in self._threads:
+            thread.start()
+
+        return output
+
+    def __iter__(self) -> Iterator[Any]:
+        if self._threads:
+            raise RuntimeError("Pipelines can only be iterated once.")
+
+        output = self._start()
+        try:
+            while True:
+                item = output.get()
+                if item is _DONE:
+                    # Every thread has finished once the last stage is done,
+                    # so their metrics are final.
+                    for thread in self._threads:
+                        thread.join()
+                    return
+                elif isinstance(item, _Failure):
+                    raise item.exception
+
+                yield item
+        finally:
+            self.close()
+
+    def close(self) -> None:
+        # Threads notice this the next time they wait on a queue; one that
+        # is busy reading from the source or processing an item finishes
+        # doing so first.
+        self._closed.set()
@@ -1,8 +1,13 @@
 from __future__ import annotations
 
 import argparse
+import base64
 import dataclasses
+import io
 import logging
+from hashlib import sha256
+from typing import Any
+from typing import Callable
 from typing import Dict
 from typing import Iterable
 from typing import List
@@ -14,15 +19,50 @@ from rich.console import Console
 from safdie import BaseCommand
 from safdie import get_entrypoints
 
+from . import metrics
 from .constants import SOURCE_ENTRYPOINT_NAME
 
 logger = logging.getLogger(__name__)
 
+# Keys derived with ``calculate_key`` start with this, which tells them
+# apart from keys stored by releases that hashed entire records.
+KEY_PREFIX = "v2:"
+
 
 def get_installed_sources() -> Dict[str, Type[SourcePlugin]]:
     return get_entrypoints(SOURCE_ENTRYPOINT_NAME, SourcePlugin)
 
 
+@metrics.timed("source.key")
+def calculate_key(*values: Any) -> str:
+    # Each value is hashed as it is encoded rather than being serialized
+    # into one string first; values are length-prefixed so that, say,
+    # ("ab", "c") and ("a", "bc") have different keys.
+    digest = sha256()
+    for value in values:
+        if value is None:
+            digest.update(b"\x00")
+            continue
+
+        encoded = str(value).encode("utf-8")
+        digest.update(f"{len(encoded)}:".encode("ascii"))
+        digest.update(encoded)
+
+    return f"{KEY_PREFIX}{digest.hexdigest()}"
+
+
+class ForeignKey(str):
+    """A foreign key that may have been stored under a legacy key."""
+
+    legacy: Optional[str]
+
+    def __new__(cls, value: str, legacy: Optional[str] = None):
+        key = super().__new__(cls, value)
+        key.legacy = legacy
+
+        return key
+
+
 class NoteField:
     _unique: bool
     _attribute_name: str
@@ -87,7 +127,39 @@ class CardTemplate:
 @dataclasses.dataclass
 class Media:
     filename: str
-    data: bytes
+    data: Optional[bytes] = None
+    encoded: Optional[str] = None  # Base64'd bytes
+    path: Optional[str] = None
+    loader: Optional[Callable[[], bytes]] = None
+
+    def __post_init__(self):
+        if (
+            self.data is None
+            and self.encoded is None
+            and self.path is None
+            and self.loader is None
+        ):
+            raise ValueError(
+                f"No data, encoded data, path or loader provided for {self.filename}."
+            )
+
+    def get_data(self) -> bytes:
+        if self.data is not None:
+            return self.data
+        elif self.encoded is not None:
+            return base64.b64decode(self.encoded)
+        elif self.path is not None:
+            with open(self.path, "rb") as inf:
+                return inf.read()
+
+        assert self.loader is not None
+        return self.loader()
+
+    def get_encoded(self) -> str:
+        if self.encoded is not None:
+            return self.encoded
+
+        return base64.b64encode(self.get_data()).decode("ascii")
 
 
 @dataclasses.dataclass
@@ -117,6 +189,9 @@ class _SourcePluginBase(type):
 
 class SourcePlugin(metaclass=_SourcePluginBase):
     CLOZE = False
+    # Whether earlier releases of this source stored different keys for
+    # the same records; see ``enable_legacy_keys``.
+    LEGACY_KEYS = False
 
     _entrypoint_name: str
     _options: argparse.Namespace
@@ -129,9 +204,39 @@ class SourcePlugin(metaclass=_SourcePluginBase):
         self._entrypoint_name = entrypoint_name
         self._options = options
         self._console = console
+        self._legacy_keys = False
 
         super().__init__()
 
+    def __getstate__(self) -> Dict[str, Any]:
+        # Consoles and open files cannot be sent to another process; the
+        # records are read in the parent process, so only the remaining
+        # options are needed to build entries from them.
+        state = self.__dict__.copy()
+        state["_console"] = None
+        state["_options"] = argparse.Namespace(
+            **{
+                name: value
+                for name, value in vars(self._options).items()
+                if not isinstance(value, io.IOBase)
+            }
+        )
+
+        return state
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        self.__dict__.update(state)
+        self._console = Console(stderr=True)
+
+    @property
+    def legacy_keys(self) -> bool:
+        return self._legacy_keys
+
+    def enable_legacy_keys(self) -> None:
+        # Calculating legacy keys is as expensive as it ever was, so they
+        # are only provided while the import history still contains some.
+        self._legacy_keys = True
+
     @property
     def fields(self) -> Dict[str, NoteField]:
         return {v.field_name: v for k, v in self._fields.items()}
@@ -164,9 +269,38 @@ class SourcePlugin(metaclass=_SourcePluginBase):
     def add_arguments(self, parser: argparse.ArgumentParser) -> None:
         pass
 
-    def get_entries(self) -> Iterable[Tuple[Optional[str], Note]]:
+    def get_records(self) -> Iterable[Any]:
         raise NotImplementedError()
 
+    def get_entry(self, record: Any) -> Tuple[Optional[str], Note]:
+        raise NotImplementedError()
+
+    def get_positioned_records(
+        self, start: Optional[int] = None
+    ) -> Optional[Iterable[Tuple[int, Any]]]:
+        # Sources that can continue reading their input from a byte offset
+        # return each record along with the offset just past it; ``start``
+        # is one of those offsets.  Other sources return None.
+        return None
+
+    @classmethod
+    def supports_records(cls) -> bool:
+        # Sources reading their input through ``get_records`` and building
+        # entries with ``get_entry`` can have entries built in parallel;
+        # the records must be picklable to be sent to other processes.
+        return (
+            cls.get_records is not SourcePlugin.get_records
+            and cls.get_entry is not SourcePlugin.get_entry
+        )
+
+    def get_entries(self) -> Iterable[Tuple[Optional[str], Note]]:
+        build_timer = metrics.get_timer("source.build")
+        for record in metrics.get_timer("source.read").iterate(self.get_records()):
+            with build_timer.time():
+                entry = self.get_entry(record)
+
+            yield entry
+
     def resolve_duplicate(self, original: Note, new: Note) -> Note:
         for field_name, field_info in self.fields.items():
             if not field_info.merge:
@@ -188,7 +322,7 @@ class CommandPlugin(BaseCommand):
 
     def __init__(self, options: argparse.Namespace, console: Console):
         self._console: Console = console
-        super().__init__(options)
+        super().__init__(options=options)
 
     @property
     def console(self) -> Console:
@@ -0,0 +1,330 @@
+from __future__ import annotations
+
+import dataclasses
+import datetime
+import json
+import os
+import stat
+import time
+from typing import IO
+from typing import Any
+from typing import List
+from typing import Optional
+from typing import Tuple
+from typing import Union
+
+from rich.console import Console
+from rich.progress import BarColumn
+from rich.progress import Progress
+from rich.progress import TaskID
+from rich.progress import TextColumn
+from rich.progress import TimeElapsedColumn
+from rich.progress import TimeRemainingColumn
+from rich.text import Text
+
+OUTPUT_MODES = ["notes", "progress", "quiet"]
+
+# Seconds between updates of the progress display; when not attached to a
+# terminal, between progress lines.
+PROGRESS_INTERVAL = 0.5
+PLAIN_PROGRESS_INTERVAL = 10.0
+
+MessagePart = Union[str, Tuple[str, str]]
+
+
+@dataclasses.dataclass
+class ImportCounts:
+    total: int = 0
+    added: int = 0
+    merged: int = 0
+    invalid: int = 0
+    failed: int = 0
+    media_failed: int = 0
+    # Records not read at all, as an earlier import already got past them.
+    skipped: int = 0
+
+    @property
+    def already_processed(self) -> int:
+        return self.total - self.added - self.merged - self.invalid - self.failed
+
+    def add(self, other: ImportCounts) -> None:
+        for field in dataclasses.fields(self):
+            setattr(
+                self, field.name, getattr(self, field.name) + getattr(other, field.name)
+            )
+
+    def get_summary(self) -> str:
+        return (
+            f"Added [bold]{self.added}[/bold] new records "
+            f"({self.merged} merged; {self.invalid} invalid; "
+            f"{self.failed} failed; "
+            f"{self.already_processed} already processed)"
+            + (f"; {self.skipped} skipped as imported before" if self.skipped else "")
+            + (
+                f"; {self.media_failed} media uploads failed"
+                if self.media_failed
+                else ""
+            )
+        )
+
+    def get_status(self) -> str:
+        return (
+            f"{self.added} added, {self.merged} merged, "
+            f"{self.invalid} invalid, {self.failed} failed"
+        )
+
+
+def get_input_size(input: Any) -> Optional[int]:
+    try:
+        info = os.fstat(input.fileno())
+    except (AttributeError, OSError, ValueError):
+        return None
+
+    return info.st_size if stat.S_ISREG(info.st_mode) else None
+
+
+def get_input_position(input: Any) -> Optional[int]:
+    # The position of the underlying binary stream, which, unlike that
+    # of a text stream, can be asked for while it is being read.
+    try:
+        return getattr(input, "buffer", input).tell()
+    except (AttributeError, OSError, ValueError):
+        return None
+
+
+class ImportReporter:
+    """Counts the outcome of each entry of an import and reports it.
+
+    In the ``notes`` mode, each outcome is printed; in the ``progress``
+    mode, a progress bar is shown instead, and only failures are printed;
+    in the ``quiet`` mode, nothing is.  Outcomes are also written to
+    ``log``, if provided, as lines of JSON.  Styling is skipped when the
+    console is not a terminal.
+
+    Imports that are one ``job`` of a batch prefix what they print with
+    its name and show no progress of their own.
+    """
+
+    counts: ImportCounts
+
+    _console: Console
+    _mode: str
+    _import_name: str
+    _log: Optional[IO[str]]
+    _input: Any
+    _job: Optional[str]
+    _progress: Optional[Progress]
+    _task: Optional[TaskID]
+
+    def __init__(
+        self,
+        console: Console,
+        import_name: str,
+        mode: str = "notes",
+        log: Optional[IO[str]] = None,
+        input: Any = None,
+        job: Optional[str] = None,
+    ):
+        if mode not in OUTPUT_MODES:
+            raise ValueError(f"Unknown output mode: {mode}")
+
+        self.counts = ImportCounts()
+        self._console = console
+        self._mode = mode
+        self._import_name = import_name
+        self._log = log
+        self._input = input
+        self._job = job
+        self._progress = None
+        self._task = None
+        # Asking the console means asking the OS every time.
+        self._is_terminal = console.is_terminal
+        self._started = time.monotonic()
+        self._last_update = self._started
+
+        super().__init__()
+
+    @property
+    def is_terminal(self) -> bool:
+        return self._is_terminal
+
+    def __enter__(self) -> ImportReporter:
+        self._started = time.monotonic()
+        self._last_update = self._started
+        if self._mode == "progress" and self.is_terminal and self._job is None:
+            self._start_progress()
+
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        if self._progress is not None:
+            self._update_progress()
+            self._progress.stop()
+            self._progress = None
+        if self._log is not None:
+            self._log.flush()
+
+    def _start_progress(self) -> None:
+        size = get_input_size(self._input)
+        columns: List[Any] = [TextColumn("{task.fields[status]}")]
+        if size:
+            # How far along the import is, and so how long it has left, is
+            # estimated from how much of its input has been read.
+            columns += [
+                BarColumn(bar_width=20),
+                TextColumn("[progress.percentage]{task.percentage:>3.0f}%"),
+                TimeRemainingColumn(),
+            ]
+        else:
+            columns.append(TimeElapsedColumn())
+
+        self._progress = Progress(
+            *columns,
+            console=self._console,
+            refresh_per_second=1 / PROGRESS_INTERVAL,
+        )
+        self._task = self._progress.add_task(
+            "Importing", total=size or 1, status=self._get_status()
+        )
+        self._progress.start()
+
+    def _get_status(self) -> str:
+        elapsed = time.monotonic() - self._started
+        rate = self.counts.total / elapsed if elapsed else 0.0
+
+        return f"{self.counts.total} read ({rate:.0f}/s): {self.counts.get_status()}"
+
+    def _update_progress(self) -> None:
+        assert self._progress is not None and self._task is not None
+
+        position = get_input_position(self._input)
+        if position is None:
+            self._progress.update(self._task, status=self._get_status())
+        else:
+            self._progress.update(
+                self._task, completed=position, status=self._get_status()
+            )
+
+    def _write_log(self, event: str, idx: int, **fields: Any) -> None:
+        if self._log is None:
+            return
+
+        # Written at once, as the jobs of a batch share one log.
+        self._log.write(
+            json.dumps(
+                {
+                    "time": datetime.datetime.utcnow().isoformat(),
+                    "import": self._import_name,
+                    "event": event,
+                    "idx": idx,
+                    **fields,
+                }
+            )
+            + "\n"
+        )
+
+    def _print(self, style: str, *parts: MessagePart) -> None:
+        if self._job is not None:
+            parts = (f"{self._job}: ", *parts)
+
+        if not self.is_terminal:
+            if not self._console.quiet:
+                self._console.file.write(
+                    "".join(
+                        part if isinstance(part, str) else part[0] for part in parts
+                    )
+                    + "\n"
+                )
+            return
+
+        self._console.print(Text.assemble(*parts, style=style))
+
+    def _print_note(self, style: str, *parts: MessagePart) -> None:
+        if self._mode == "notes":
+            self._print(style, *parts)
+
+    def _print_failure(self, *parts: MessagePart) -> None:
+        if self._mode != "quiet":
+            self._print("red", *parts)
+
+    def advance(self) -> None:
+        # Called once per entry read from the source, so this is kept as
+        # cheap as possible until an update is due.
+        self.counts.total += 1
+        if self._mode != "progress" or self._job is not None:
+            return
+
+        now = time.monotonic()
+        if self._progress is not None:
+            if now - self._last_update >= PROGRESS_INTERVAL:
+                self._last_update = now
+                self._update_progress()
+        elif now - self._last_update >= PLAIN_PROGRESS_INTERVAL:
+            self._last_update = now
+            self._print("", self._get_status())
+
+    def skipped(self, records: int) -> None:
+        # The first ``records`` records of the input.
+        self.counts.skipped += records
+        self._write_log("skipped", 0, records=records)
+
+    def created(self, idx: int, foreign_key: Optional[str], anki_id: int) -> None:
+        self.counts.added += 1
+        self._write_log("created", idx, key=foreign_key, anki_id=anki_id)
+        self._print_note("green", "Created note ", (str(anki_id), "bold"))
+
+    def updated(self, idx: int, foreign_key: Optional[str], anki_id: int) -> None:
+        self.counts.merged += 1
+        self._write_log("updated", idx, key=foreign_key, anki_id=anki_id)
+        self._print_note("bright_green", "Updated note ", (str(anki_id), "bold"))
+
+    def invalid(
+        self, idx: int, foreign_key: Optional[str], missing_fields: List[str]
+    ) -> None:
+        self.counts.invalid += 1
+        self._write_log("invalid", idx, key=foreign_key, missing=missing_fields)
+        self._print_note(
+            "yellow",
+            f"Invalid note (missing {', '.join(repr(f) for f in missing_fields)}) ",
+            (f"Idx {idx}", "bold"),
+        )
+
+    def create_failed(self, idx: int, foreign_key: Optional[str], error: Any) -> None:
+        self.counts.failed += 1
+        self._write_log("create_failed", idx, key=foreign_key, error=str(error))
+        self._print_failure(
+            "Could not create note for ", (f"Idx {idx}", "bold"), f": {error}"
+        )
+
+    def update_failed(
+        self, idx: int, foreign_key: Optional[str], anki_id: int, error: Any
+    ) -> None:
+        self.counts.failed += 1
+        self._write_log(
+            "update_failed", idx, key=foreign_key, anki_id=anki_id, error=str(error)
+        )
+        self._print_failure(
+            "Could not update note ",
+            (str(anki_id), "bold"),
+            " for ",
+            (f"Idx {idx}", "bold"),
+            f": {error}",
+        )
+
+    def media_failed(self, idx: int, filename: str, error: Any) -> None:
+        self.counts.media_failed += 1
+        self._write_log("media_failed", idx, filename=filename, error=str(error))
+        self._print_failure(
+            "Could not store media ",
+            (filename, "bold"),
+            " for ",
+            (f"Idx {idx}", "bold"),
+            f": {error}",
+        )
+
+    def multiple_duplicates(self, idx: int, entry: Any, duplicates: List[int]) -> None:
+        self._write_log("multiple_duplicates", idx, duplicates=duplicates)
+        self._print_failure(
+            f"Multiple duplicate notes found for entry {entry} "
+            f"(idx: {idx}): {duplicates}."
+        )
@@ -9,13 +9,18 @@ from typing import Tuple
 
 from boox_annotation_parser import parser as boox_parser
 
+from .. import metrics
 from ..plugin import CardTemplate
+from ..plugin import ForeignKey
 from ..plugin import Note
 from ..plugin import NoteField
 from ..plugin import SourcePlugin
+from ..plugin import calculate_key
 
 
 class BooxSource(SourcePlugin):
+    LEGACY_KEYS = True
+
     Front = NoteField(unique=True, merge=True)
     Back = NoteField(unique=True, merge=True)
     Reverse = NoteField(default="1", field_name="Add Reverse", optional=True)
@@ -75,18 +80,33 @@ class BooxSource(SourcePlugin):
         )
         return super().add_arguments(parser)
 
-    def _calculate_key(self, note: boox_parser.Annotation) -> str:
+    def _calculate_key(self, note: boox_parser.Annotation) -> ForeignKey:
+        return ForeignKey(
+            calculate_key(
+                note.section_name,
+                note.time.isoformat(),
+                note.original_text,
+                note.annotations,
+                note.page_number,
+            ),
+            self._calculate_legacy_key(note) if self.legacy_keys else None,
+        )
+
+    @metrics.timed("source.legacy_key")
+    def _calculate_legacy_key(self, note: boox_parser.Annotation) -> str:
         data = json.dumps(dataclasses.asdict(note), sort_keys=True, default=str)
         return sha256(data.encode("utf-8")).hexdigest()
 
-    def get_entries(self) -> Iterable[Tuple[str, Note]]:
+    def get_records(self) -> Iterable[boox_parser.Annotation]:
         annotation_info = boox_parser.get_annotations(self.options.input)
-        for annotation in annotation_info.annotations:
-            foreign_key = self._calculate_key(annotation)
-            note = Note(
-                fields={
-                    self.Front.field_name: annotation.original_text,
-                    self.Back.field_name: annotation.annotations,
-                }
-            )
-            yield foreign_key, note
+        return annotation_info.annotations
+
+    def get_entry(self, annotation: boox_parser.Annotation) -> Tuple[str, Note]:
+        foreign_key = self._calculate_key(annotation)
+        note = Note(
+            fields={
+                self.Front.field_name: annotation.original_text,
+                self.Back.field_name: annotation.annotations,
+            }
+        )
+        return foreign_key, note
@@ -1,12 +1,12 @@
 import argparse
-import base64
 import dataclasses
 import mimetypes
 import sys
-import uuid
 from hashlib import sha256
+from typing import Any
 from typing import Dict
 from typing import Iterable
+from typing import Iterator
 from typing import List
 from typing import Optional
 from typing import Tuple
@@ -15,21 +15,27 @@ from typing import Union
 from lln_json_parser import parser
 from lln_json_parser import types
 
+from .. import metrics
 from ..plugin import CardTemplate
+from ..plugin import ForeignKey
 from ..plugin import Media
 from ..plugin import Note
 from ..plugin import NoteField
 from ..plugin import SourcePlugin
+from ..plugin import calculate_key
+from ..streaming import JsonArrayReader
 
 
 @dataclasses.dataclass
 class MediaDescriptor:
     filename: str
     field_value: str
-    file_data: bytes
+    encoded_data: str
 
 
 class LLNJsonSource(SourcePlugin):
+    LEGACY_KEYS = True
+
     Source = NoteField()
     SourceLanguage = NoteField(optional=True)
 
@@ -109,7 +115,35 @@ class LLNJsonSource(SourcePlugin):
             ),
         ]
 
-    def _calculate_key(self, saved: Union[types.SavedPhrase, types.SavedWord]) -> str:
+    def _calculate_key(
+        self, saved: Union[types.SavedPhrase, types.SavedWord]
+    ) -> ForeignKey:
+        # Saved items are identified by what was saved and when rather
+        # than by their whole contents, which include their media.
+        phrase = saved.context.phrase if saved.context else None
+        text: Optional[str] = None
+        if isinstance(saved, types.SavedWord):
+            text = saved.word.text
+        elif phrase:
+            text = phrase.subtitles.target
+
+        return ForeignKey(
+            calculate_key(
+                saved.item_type,
+                saved.lang_code,
+                saved.translation_lang_code,
+                saved.time_created.isoformat(),
+                text,
+                phrase.reference.movie_id if phrase else None,
+                phrase.reference.subtitle_index if phrase else None,
+            ),
+            self._calculate_legacy_key(saved) if self.legacy_keys else None,
+        )
+
+    @metrics.timed("source.legacy_key")
+    def _calculate_legacy_key(
+        self, saved: Union[types.SavedPhrase, types.SavedWord]
+    ) -> str:
         data = saved.json(sort_keys=True)
         return sha256(data.encode("utf-8")).hexdigest()
 
@@ -123,11 +157,21 @@ class LLNJsonSource(SourcePlugin):
             default=sys.stdin,
             help="File to read from (default: stdin)",
         )
+        arg_parser.add_argument(
+            "--no-stream",
+            dest="stream",
+            action="store_false",
+            default=True,
+            help=(
+                "Load the whole export into memory at once instead of "
+                "reading one saved item at a time"
+            ),
+        )
         return super().add_arguments(arg_parser)
 
     def _generate_media_data(
         self, media: Union[types.Thumbnail, types.Audio]
-    ) -> Optional[Tuple[str, bytes]]:
+    ) -> Optional[Tuple[str, str]]:
         if not media or not media.data_url:
             return None
 
@@ -139,10 +183,12 @@ class LLNJsonSource(SourcePlugin):
         if not extension:
             return None
 
-        filename = f"{uuid.uuid4()}{extension}"
         _, encoded_data = media.data_url.split(",")
+        # Naming files after their contents lets the same clip or image
+        # saved on several entries be stored in Anki only once.
+        filename = f"{sha256(encoded_data.encode('ascii')).hexdigest()}{extension}"
 
-        return filename, base64.b64decode(encoded_data)
+        return filename, encoded_data
 
     def _get_thumbnail_media_descriptor(
         self, thumbnail: Optional[types.Thumbnail]
@@ -177,21 +223,21 @@ class LLNJsonSource(SourcePlugin):
         )
         if thumb_prev:
             fields[self.ThumbnailPre.field_name] = thumb_prev.field_value
-            media.append(Media(thumb_prev.filename, thumb_prev.file_data))
+            media.append(Media(thumb_prev.filename, encoded=thumb_prev.encoded_data))
 
         thumb_next: Optional[MediaDescriptor] = self._get_thumbnail_media_descriptor(
             phrase.thumb_next
         )
         if thumb_next:
             fields[self.ThumbnailPost.field_name] = thumb_next.field_value
-            media.append(Media(thumb_next.filename, thumb_next.file_data))
+            media.append(Media(thumb_next.filename, encoded=thumb_next.encoded_data))
 
         audio: Optional[MediaDescriptor] = self._get_audio_media_descriptor(
             phrase.audio
         )
         if audio:
             fields[self.Audio.field_name] = audio.field_value
-            media.append(Media(audio.filename, audio.file_data))
+            media.append(Media(audio.filename, encoded=audio.encoded_data))
 
         return media, fields
 
@@ -232,17 +278,60 @@ class LLNJsonSource(SourcePlugin):
 
         return Note(fields=fields, media=media)
 
-    def get_entries(self) -> Iterable[Tuple[str, Note]]:
-        entries = parser.get_entries(self.options.input)
+    def get_records(
+        self,
+    ) -> Iterable[Union[types.SavedPhrase, types.SavedWord, Dict[str, Any]]]:
+        if not getattr(self.options, "stream", True):
+            return parser.get_entries(self.options.input)
+
+        return (record for _, record in self._read_records())
+
+    def _read_records(
+        self, start: Optional[int] = None
+    ) -> Iterator[Tuple[int, Dict[str, Any]]]:
+        # Read raw bytes where possible; decoding happens per item.  Items
+        # are parsed into saved phrases and words in ``get_entry`` so that
+        # it can be done in parallel.
+        stream = getattr(self.options.input, "buffer", self.options.input)
+        if start is not None:
+            stream.seek(start)
+
+        reader = JsonArrayReader(stream, start=start)
+        for item in reader:
+            if item["itemType"] in ("WORD", "PHRASE"):
+                yield reader.offset, item
+
+    def get_positioned_records(
+        self, start: Optional[int] = None
+    ) -> Optional[Iterable[Tuple[int, Dict[str, Any]]]]:
+        if not getattr(self.options, "stream", True):
+            return None
+
+        stream = getattr(self.options.input, "buffer", self.options.input)
+        if start is not None and not stream.seekable():
+            return None
 
-        for entry in entries:
-            foreign_key = self._calculate_key(entry)
+        return self._read_records(start)
 
-            if isinstance(entry, types.SavedPhrase):
-                note = self._get_note_for_saved_phrase(entry)
-            elif isinstance(entry, types.SavedWord):
-                note = self._get_note_for_saved_word(entry)
+    def get_entry(
+        self, record: Union[types.SavedPhrase, types.SavedWord, Dict[str, Any]]
+    ) -> Tuple[str, Note]:
+        entry: Union[types.SavedPhrase, types.SavedWord]
+        if isinstance(record, dict):
+            if record["itemType"] == "WORD":
+                entry = types.SavedWord(**record)
             else:
-                raise ValueError(f"Unexpected note type: {entry}")
+                entry = types.SavedPhrase(**record)
+        else:
+            entry = record
+
+        foreign_key = self._calculate_key(entry)
+
+        if isinstance(entry, types.SavedPhrase):
+            note = self._get_note_for_saved_phrase(entry)
+        elif isinstance(entry, types.SavedWord):
+            note = self._get_note_for_saved_word(entry)
+        else:
+            raise ValueError(f"Unexpected note type: {entry}")
 
-            yield foreign_key, note
+        return foreign_key, note
@@ -0,0 +1,152 @@
+import codecs
+import json
+from typing import IO
+from typing import Any
+from typing import Iterator
+from typing import Optional
+
+WHITESPACE = " \t\r\n"
+
+
+class JsonStreamError(ValueError):
+    pass
+
+
+class JsonArrayReader:
+    """Reads the items of a top-level JSON array one at a time.
+
+    Only the item currently being read is held in memory, so memory use
+    depends upon the size of the largest item rather than of the file.
+
+    If ``start`` is given, ``fp`` has been positioned that many bytes into
+    the file, just past one of the array's items, and reading continues
+    with the item following it.
+    """
+
+    _fp: IO
+    _read_size: int
+    _buffer: str
+    _position: int
+    _counted: int
+    _offset: int
+    _eof: bool
+    _resumed: bool
+
+    def __init__(
+        self, fp: IO, read_size: int = 1024 * 1024, start: Optional[int] = None
+    ):
+        self._fp = fp
+        self._read_size = read_size
+        self._decoder = json.JSONDecoder()
+        self._text_decoder = codecs.getincrementaldecoder("utf-8")()
+        self._buffer = ""
+        self._position = 0
+        # Bytes of the file up to ``_counted`` in the buffer; what has been
+        # consumed beyond it is only encoded when the offset is asked for,
+        # so that each character is counted once.
+        self._counted = 0
+        self._offset = start or 0
+        self._eof = False
+        self._resumed = start is not None
+
+        super().__init__()
+
+    def _fill(self, size: int) -> bool:
+        if self._eof:
+            return False
+
+        data = self._fp.read(size)
+        if not data:
+            self._eof = True
+            return False
+        if isinstance(data, bytes):
+            data = self._text_decoder.decode(data)
+
+        self._count_consumed()
+        position = self._position
+        self._buffer = self._buffer[position:] + data
+        self._position = 0
+        self._counted = 0
+        return True
+
+    def _count_consumed(self) -> None:
+        start, end = self._counted, self._position
+        consumed = self._buffer[start:end]
+        self._offset += len(consumed.encode("utf-8"))
+        self._counted = self._position
+
+    def _next_significant_character(self) -> Optional[str]:
+        while True:
+            while self._position < len(self._buffer):
+                character = self._buffer[self._position]
+                if character not in WHITESPACE:
+                    return character
+                self._position += 1
+
+            if not self._fill(self._read_size):
+                return None
+
+    def _expect(self, expected: str) -> None:
+        character = self._next_significant_character()
+        if character != expected:
+            found = "end of file" if character is None else repr(character)
+            raise JsonStreamError(
+                f"Expected {expected!r} at byte {self.offset}; found {found}."
+            )
+        self._position += 1
+
+    def _read_item(self) -> Any:
+        while True:
+            # Reading at least as much again as is already buffered keeps
+            # the cost of re-parsing a partially read item linear.
+            read_size = max(self._read_size, len(self._buffer) - self._position)
+
+            try:
+                item, end = self._decoder.raw_decode(self._buffer, self._position)
+            except json.JSONDecodeError as e:
+                if self._fill(read_size):
+                    continue
+                raise JsonStreamError(f"Could not read item: {e}") from e
+
+            # A number at the very end of the buffer may continue in the
+            # data that has not been read yet.
+            if end == len(self._buffer) and self._fill(read_size):
+                continue
+
+            self._position = end
+            return item
+
+    @property
+    def offset(self) -> int:
+        """Number of bytes of the file consumed so far."""
+        self._count_consumed()
+        return self._offset
+
+    def __iter__(self) -> Iterator[Any]:
+        if self._resumed:
+            character = self._next_significant_character()
+            if character == "]":
+                self._position += 1
+                return
+            self._expect(",")
+        else:
+            self._expect("[")
+
+            if self._next_significant_character() == "]":
+                self._position += 1
+                return
+
+        while True:
+            if self._next_significant_character() is None:
+                raise JsonStreamError("Unexpected end of file inside array.")
+
+            yield self._read_item()
+
+            character = self._next_significant_character()
+            if character == ",":
+                self._position += 1
+            elif character == "]":
+                self._position += 1
+                return
+            else:
+                self._expect(",")
@@ -0,0 +1,46 @@
+import argparse
+import importlib
+import json
+import os
+from typing import Optional
+from typing import Type
+
+from rich.console import Console
+
+from ..backends import Backend
+from ..plugin import CommandPlugin
+from ..reporting import ImportCounts
+
+import_command = importlib.import_module("dejima.commands.import")
+
+
+def parse_options(command: Type[CommandPlugin], *args: str) -> argparse.Namespace:
+    parser = argparse.ArgumentParser()
+    command.add_arguments(parser)
+
+    return parser.parse_args(list(args))
+
+
+def run_import(
+    directory: str, *args: str, backend: Optional[Backend] = None
+) -> ImportCounts:
+    # What happened to the entries is read back from the import's metrics,
+    # written to ``directory``.
+    metrics_path = os.path.join(directory, "metrics.json")
+    options = parse_options(
+        import_command.ImportCommand,
+        "--output",
+        "quiet",
+        "--metrics-json",
+        metrics_path,
+        *args,
+    )
+    try:
+        import_command.ImportCommand(
+            options=options, console=Console(quiet=True), backend=backend
+        ).handle()
+    finally:
+        options.input.close()
+
+    with open(metrics_path) as inf:
+        return ImportCounts(**json.load(inf)["counts"])
@@ -1,14 +1,21 @@
+import gzip
 import json
 from unittest import TestCase
 from unittest.mock import ANY
 from unittest.mock import Mock
+from unittest.mock import call
 from unittest.mock import patch
 
 import pytest
 import requests
 
+from ..api import DEFAULT_TIMEOUT
+from ..api import AnkiActionResult
 from ..api import AnkiError
+from ..api import AnkiNote
+from ..api import AnkiNoteOptions
 from ..api import Connection
+from ..api import Transport
 
 
 class TestApi(TestCase):
@@ -43,9 +50,10 @@ class TestApi(TestCase):
             ANY,
             data=json.dumps(
                 {"action": arbitrary_action, "version": 6, "params": arbitrary_params},
-                indent=4,
-                sort_keys=True,
-            ),
+                separators=(",", ":"),
+            ).encode("utf-8"),
+            headers={"Content-Type": "application/json"},
+            timeout=DEFAULT_TIMEOUT,
         )
 
     def test_dispatch_no_parms(self):
@@ -57,11 +65,35 @@ class TestApi(TestCase):
             ANY,
             data=json.dumps(
                 {"action": arbitrary_action, "version": 6},
-                indent=4,
-                sort_keys=True,
-            ),
+                separators=(",", ":"),
+            ).encode("utf-8"),
+            headers={"Content-Type": "application/json"},
+            timeout=DEFAULT_TIMEOUT,
         )
 
+    def test_dispatch_retries_transient_errors(self):
+        self.response.json = Mock(
+            side_effect=[
+                {"result": None, "error": "collection is not available"},
+                {"result": 10, "error": None},
+            ]
+        )
+
+        with patch("time.sleep") as sleep:
+            actual_result = self.api._dispatch("some_action")
+
+        assert actual_result == 10
+        assert self.session.return_value.post.call_count == 2
+        sleep.assert_called_once()
+
+    def test_dispatch_does_not_retry_other_errors(self):
+        self.response_data["error"] = "cannot create note because it is empty"
+
+        with pytest.raises(AnkiError):
+            self.api._dispatch("some_action")
+
+        assert self.session.return_value.post.call_count == 1
+
     def test_dispatch_error(self):
         arbitrary_action = "some_action"
         arbitrary_error_msg = "some error"
@@ -70,3 +102,126 @@ class TestApi(TestCase):
 
         with pytest.raises(AnkiError):
             self.api._dispatch(arbitrary_action)
+
+    def test_multi(self):
+        self.response_data["result"] = [
+            {"result": 1234, "error": None},
+            {"result": None, "error": "cannot create note"},
+        ]
+
+        results = self.api.multi(
+            [
+                {"action": "addNote", "version": 6, "params": {}},
+                {"action": "addNote", "version": 6, "params": {}},
+            ]
+        )
+
+        assert results == [
+            AnkiActionResult("addNote", 1234, None),
+            AnkiActionResult("addNote", None, "cannot create note"),
+        ]
+
+    def test_batch_flushes_when_full(self):
+        self.response_data["result"] = [
+            {"result": 1, "error": None},
+            {"result": None, "error": "some error"},
+        ]
+        callback = Mock()
+
+        batch = self.api.batch(size=2)
+        batch.queue("first_action", callback=callback)
+
+        self.session.return_value.post.assert_not_called()
+
+        batch.queue("second_action", {"some": "param"}, callback=callback)
+
+        assert self.session.return_value.post.call_count == 1
+        assert json.loads(self.session.return_value.post.call_args[1]["data"]) == {
+            "action": "multi",
+            "version": 6,
+            "params": {
+                "actions": [
+                    {"action": "first_action", "version": 6},
+                    {
+                        "action": "second_action",
+                        "version": 6,
+                        "params": {"some": "param"},
+                    },
+                ]
+            },
+        }
+        callback.assert_has_calls(
+            [
+                call(AnkiActionResult("first_action", 1, None)),
+                call(AnkiActionResult("second_action", None, "some error")),
+            ]
+        )
+        assert len(batch) == 0
+
+    def test_batch_context_manager_flushes(self):
+        self.response_data["result"] = [{"result": 1, "error": None}]
+
+        with self.api.batch() as batch:
+            batch.queue("some_action")
+
+        assert self.session.return_value.post.call_count == 1
+
+    def test_add_notes(self):
+        self.response_data["result"] = [1, None]
+
+        result = self.api.add_notes(
+            [
+                AnkiNote("model", "deck", {"Front": "one"}, []),
+                AnkiNote("model", "deck", {"Front": ""}, []),
+            ],
+            AnkiNoteOptions(allowDuplicate=True),
+        )
+
+        assert result == [1, None]
+        payload = json.loads(self.session.return_value.post.call_args[1]["data"])
+        assert payload["action"] == "addNotes"
+        assert [n["options"] for n in payload["params"]["notes"]] == [
+            {"allowDuplicate": True},
+            {"allowDuplicate": True},
+        ]
+
+    def test_get_notes(self):
+        self.response_data["result"] = [
+            {
+                "noteId": 1,
+                "modelName": "model",
+                "deckName": "deck",
+                "tags": ["tag"],
+                "fields": {"Front": {"value": "front", "order": 0}},
+            },
+            {},
+        ]
+
+        actual_result = self.api.get_notes([1, 2])
+        expected_result = {1: AnkiNote("model", "deck", {"Front": "front"}, ["tag"])}
+
+        assert actual_result == expected_result
+
+
+class TestTransport(TestCase):
+    def test_compact_payload(self):
+        transport = Transport("http://localhost/")
+
+        payload, headers = transport.encode({"action": "hola", "version": 6})
+
+        assert payload == b'{"action":"hola","version":6}'
+        assert "Content-Encoding" not in headers
+
+    def test_large_payloads_are_compressed(self):
+        transport = Transport("http://localhost/", compress_threshold=100)
+        request = {"action": "storeMediaFile", "params": {"data": "a" * 1000}}
+
+        payload, headers = transport.encode(request)
+
+        assert headers["Content-Encoding"] == "gzip"
+        assert json.loads(gzip.decompress(payload)) == request
+
+    def test_keep_alive_can_be_disabled(self):
+        transport = Transport("http://localhost/", keep_alive=False)
+
+        assert transport._session.headers["Connection"] == "close"
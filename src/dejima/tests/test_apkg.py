@@ -0,0 +1,216 @@
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import zipfile
+from unittest import TestCase
+
+import pytest
+
+from ..api import AnkiCardTemplate
+from ..api import AnkiError
+from ..api import AnkiModel
+from ..api import AnkiNote
+from ..apkg import PackageWriter
+from ..apkg import get_guid
+from ..apkg import shows_field
+from ..benchmark.generators import write_boox_export
+from .helpers import run_import
+
+
+class TestPackageWriter(TestCase):
+    def setUp(self):
+        self._tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self._tmp_dir, "deck.apkg")
+        self.writer = PackageWriter(self.path)
+        self.writer.ensure_model(
+            AnkiModel(
+                modelName="Model",
+                inOrderFields=["Front", "Back", "Reverse"],
+                css="",
+                isCloze=False,
+                cardTemplates=[
+                    AnkiCardTemplate(Name="Card", Front="{{Front}}", Back="{{Back}}"),
+                    AnkiCardTemplate(
+                        Name="Reverse",
+                        Front="{{#Reverse}}{{Back}}{{/Reverse}}",
+                        Back="{{Front}}",
+                    ),
+                ],
+            )
+        )
+
+        super().setUp()
+
+    def tearDown(self):
+        self.writer.discard()
+        shutil.rmtree(self._tmp_dir)
+
+        super().tearDown()
+
+    def get_note(self, front: str, back: str, reverse: str = "") -> AnkiNote:
+        return AnkiNote(
+            deckName="Parent::Deck",
+            modelName="Model",
+            fields={"Front": front, "Back": back, "Reverse": reverse},
+            tags=["dejima-import"],
+        )
+
+    def read_package(self):
+        with zipfile.ZipFile(self.path) as package:
+            media = json.loads(package.read("media"))
+            files = {name: package.read(member) for member, name in media.items()}
+            package.extract("collection.anki2", self._tmp_dir)
+
+        collection = sqlite3.connect(os.path.join(self._tmp_dir, "collection.anki2"))
+        try:
+            notes = collection.execute("SELECT id, tags, flds FROM notes").fetchall()
+            cards = collection.execute(
+                "SELECT nid, ord FROM cards ORDER BY nid, ord"
+            ).fetchall()
+            decks = json.loads(
+                collection.execute("SELECT decks FROM col").fetchone()[0]
+            )
+        finally:
+            collection.close()
+
+        return notes, cards, sorted(deck["name"] for deck in decks.values()), files
+
+    def test_package(self):
+        first = self.writer.add_note(self.get_note("hola", "hello"))
+        second = self.writer.add_note(self.get_note("adios", "bye", "y"))
+        self.writer.update_note(first, self.get_note("hola", "hi", "y"))
+        self.writer.store_media("image.jpg", b"old")
+        self.writer.store_media("image.jpg", b"new")
+        self.writer.close()
+
+        notes, cards, decks, files = self.read_package()
+
+        assert notes == [
+            (first, " dejima-import ", "hola\x1fhi\x1fy"),
+            (second, " dejima-import ", "adios\x1fbye\x1fy"),
+        ]
+        assert cards == [(first, 0), (first, 1), (second, 0), (second, 1)]
+        assert decks == ["Default", "Parent", "Parent::Deck"]
+        assert files == {"image.jpg": b"new"}
+
+    def test_find_and_get_notes(self):
+        note_id = self.writer.add_note(self.get_note("hola", "hello"))
+        other_id = self.writer.add_note(self.get_note("adios", "bye"))
+        self.writer.update_note(other_id, self.get_note("adios", "hola"))
+
+        assert self.writer.find_notes("parent::deck", {"front": "HOLA"}) == [note_id]
+        assert self.writer.find_notes("Parent::Deck", {"Back": "bye"}) == []
+        assert self.writer.find_notes("Parent::Deck", {"Back": "hola"}) == [other_id]
+        assert self.writer.find_notes("Parent::Deck") == [note_id, other_id]
+        assert self.writer.find_notes("Other") == []
+        assert self.writer.get_notes([note_id, 1]) == {
+            note_id: AnkiNote(
+                "Model",
+                "Parent::Deck",
+                {"Front": "hola", "Back": "hello", "Reverse": ""},
+                ["dejima-import"],
+            )
+        }
+
+    def test_rejected_notes(self):
+        self.writer.add_note(self.get_note("hola", "hello"))
+
+        with pytest.raises(AnkiError):
+            self.writer.add_note(self.get_note("hola", "hi"))
+        with pytest.raises(AnkiError):
+            self.writer.add_note(self.get_note("", "empty"), allow_duplicate=True)
+        with pytest.raises(AnkiError):
+            self.writer.update_note(1, self.get_note("hola", "hi"))
+
+        # Unless duplicates are allowed, as they are when importing.
+        self.writer.add_note(self.get_note("hola", "hi"), allow_duplicate=True)
+
+    def test_guids(self):
+        keyed = self.writer.add_note(self.get_note("hola", "hello"), key="k1")
+        first = self.writer.add_note(self.get_note("adios", "bye"))
+        self.writer.add_note(self.get_note("adios", "bye"), allow_duplicate=True)
+        self.writer.close()
+
+        with zipfile.ZipFile(self.path) as package:
+            package.extract("collection.anki2", self._tmp_dir)
+        collection = sqlite3.connect(os.path.join(self._tmp_dir, "collection.anki2"))
+        try:
+            guids = dict(collection.execute("SELECT id, guid FROM notes"))
+        finally:
+            collection.close()
+
+        assert guids[keyed] == get_guid(["Model", "k1"])
+        assert guids[first] == get_guid(["Model", "adios", "bye", ""])
+        assert len(set(guids.values())) == 3
+
+    def test_discarded_package_is_not_written(self):
+        with pytest.raises(ValueError):
+            with self.writer:
+                raise ValueError()
+
+        assert not os.path.exists(self.path)
+
+    def test_shows_field(self):
+        assert shows_field("{{Front}}", {"Front": "x"})
+        assert not shows_field("{{Front}}", {"Front": " "})
+        assert not shows_field("{{#Reverse}}{{Back}}{{/Reverse}}", {"Back": "x"})
+        assert shows_field(
+            "{{^Reverse}}{{text:Back}}{{/Reverse}}", {"Back": "x", "Reverse": ""}
+        )
+
+
+class TestPackageImport(TestCase):
+    def setUp(self):
+        self._tmp_dir = tempfile.mkdtemp()
+        self.input_path = os.path.join(self._tmp_dir, "export.txt")
+        with open(self.input_path, "w") as outf:
+            write_boox_export(outf, 20, duplicate_ratio=0.5)
+        self.database = os.path.join(self._tmp_dir, "dejima.db")
+
+        super().setUp()
+
+    def tearDown(self):
+        shutil.rmtree(self._tmp_dir)
+
+        super().tearDown()
+
+    def build_package(self, name: str):
+        path = os.path.join(self._tmp_dir, name)
+        run_import(
+            self._tmp_dir,
+            "--database",
+            self.database,
+            "--apkg",
+            path,
+            "Deck",
+            "boox",
+            "--input",
+            self.input_path,
+        )
+
+        with zipfile.ZipFile(path) as package:
+            package.extract("collection.anki2", os.path.join(self._tmp_dir, "out"))
+        collection = sqlite3.connect(
+            os.path.join(self._tmp_dir, "out", "collection.anki2")
+        )
+        try:
+            return collection.execute(
+                "SELECT guid, flds FROM notes ORDER BY guid"
+            ).fetchall()
+        finally:
+            collection.close()
+
+    def test_import(self):
+        notes = self.build_package("deck.apkg")
+
+        assert 0 < len(notes) < 20
+        # The import history of the AnkiConnect collection is left alone.
+        assert not os.path.exists(self.database)
+
+    def test_rebuilt_package_has_the_same_guids(self):
+        notes = self.build_package("first.apkg")
+
+        assert self.build_package("second.apkg") == notes
+        assert len({guid for guid, _ in notes}) == len(notes)
@@ -0,0 +1,225 @@
+import asyncio
+import json
+import sys
+from unittest import TestCase
+from unittest.mock import patch
+
+import pytest
+
+from .. import metrics
+from ..api import AnkiActionResult
+from ..api import AnkiError
+from ..api import AnkiNote
+from ..async_api import AsyncConnection
+from ..exceptions import DejimaUserError
+
+aiohttp = pytest.importorskip("aiohttp")
+web = pytest.importorskip("aiohttp.web")
+
+
+class TestAsyncApi(TestCase):
+    def setUp(self):
+        self.requests = []
+        self.results = {}
+        self.errors = {}
+        self.unavailable = 0
+        self.statuses = []
+        self.encodings = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+
+        super().setUp()
+
+    async def handle_request(self, request):
+        body = await request.text()
+        payload = json.loads(body)
+        self.requests.append(body)
+        self.encodings.append(request.headers.get("Content-Encoding"))
+
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        await asyncio.sleep(0.01)
+        self.in_flight -= 1
+
+        if self.statuses:
+            return web.Response(status=self.statuses.pop(0))
+
+        if self.unavailable:
+            self.unavailable -= 1
+            return web.json_response(
+                {"result": None, "error": "collection is not available"}
+            )
+
+        return web.json_response(
+            {
+                "result": self.results.get(payload["action"]),
+                "error": self.errors.get(payload["action"]),
+            }
+        )
+
+    def run_with_api(self, fn, concurrency=8, **kwargs):
+        async def run():
+            app = web.Application()
+            app.router.add_post("/", self.handle_request)
+            runner = web.AppRunner(app)
+            await runner.setup()
+            site = web.TCPSite(runner, "127.0.0.1", 0)
+            await site.start()
+            port = runner.addresses[0][1]
+
+            try:
+                async with AsyncConnection(
+                    port=port, concurrency=concurrency, **kwargs
+                ) as api:
+                    return await fn(api)
+            finally:
+                await runner.cleanup()
+
+        return self.loop.run_until_complete(run())
+
+    def test_dispatch(self):
+        self.results["some_action"] = "ok"
+
+        actual_result = self.run_with_api(
+            lambda api: api._dispatch("some_action", {"something": "special"})
+        )
+
+        assert actual_result == "ok"
+        assert json.loads(self.requests[0]) == {
+            "action": "some_action",
+            "version": 6,
+            "params": {"something": "special"},
+        }
+
+    def test_dispatch_error(self):
+        self.errors["some_action"] = "some error"
+
+        with pytest.raises(AnkiError):
+            self.run_with_api(lambda api: api._dispatch("some_action"))
+
+    def test_dispatch_retries_transient_errors(self):
+        self.unavailable = 1
+        self.results["some_action"] = "ok"
+
+        async def dispatch(api):
+            api._backoff = 0
+            return await api._dispatch("some_action")
+
+        actual_result = self.run_with_api(dispatch)
+
+        assert actual_result == "ok"
+        assert len(self.requests) == 2
+
+    def test_dispatch_retries_unavailable_responses(self):
+        self.statuses = [503, 502]
+        self.results["some_action"] = "ok"
+
+        actual_result = self.run_with_api(
+            lambda api: api._dispatch("some_action"), backoff=0
+        )
+
+        assert actual_result == "ok"
+        assert len(self.requests) == 3
+
+    def test_only_round_trips_are_timed(self):
+        self.statuses = [503]
+        self.results["some_action"] = "ok"
+        metrics.reset()
+
+        async def dispatch_many(api):
+            return await asyncio.gather(
+                *(api._dispatch("some_action") for _ in range(4))
+            )
+
+        self.run_with_api(dispatch_many, concurrency=1, backoff=0.2)
+
+        timer = metrics.get_timer("anki.some_action")
+        assert timer.count == 5
+        assert timer.max < 0.2
+        assert metrics.get_counter("anki.requests").value == 5
+        assert metrics.get_counter("anki.bytes_sent").value == sum(
+            len(request) for request in self.requests
+        )
+
+    def test_dispatch_gives_up_after_retries(self):
+        self.statuses = [503, 503]
+
+        with pytest.raises(aiohttp.ClientResponseError):
+            self.run_with_api(
+                lambda api: api._dispatch("some_action"), retries=1, backoff=0
+            )
+
+        assert len(self.requests) == 2
+
+    def test_dispatch_retries_failed_connections(self):
+        async def dispatch():
+            async with AsyncConnection(port=1, retries=2, backoff=0) as api:
+                await api._dispatch("some_action")
+
+        with patch("asyncio.sleep") as sleep:
+            with pytest.raises(aiohttp.ClientConnectorError):
+                self.loop.run_until_complete(dispatch())
+
+        assert sleep.call_count == 2
+
+    def test_large_requests_are_compressed(self):
+        self.results["some_action"] = "ok"
+
+        async def dispatch(api):
+            await api._dispatch("some_action", {"text": "x"})
+            await api._dispatch("some_action", {"text": "x" * 200})
+
+        self.run_with_api(dispatch, compress_threshold=100)
+
+        assert self.encodings == [None, "gzip"]
+        assert json.loads(self.requests[1])["params"] == {"text": "x" * 200}
+
+    def test_concurrency_is_limited(self):
+        async def find_many(api):
+            return await asyncio.gather(*(api.find_notes("x") for _ in range(10)))
+
+        self.run_with_api(find_many, concurrency=3)
+
+        assert len(self.requests) == 10
+        assert self.max_in_flight == 3
+
+    def test_multi(self):
+        self.results["multi"] = [
+            {"result": 1, "error": None},
+            {"result": None, "error": "cannot create note"},
+        ]
+
+        actual_result = self.run_with_api(
+            lambda api: api.multi([{"action": "addNote"}, {"action": "addNote"}])
+        )
+
+        assert actual_result == [
+            AnkiActionResult("addNote", 1, None),
+            AnkiActionResult("addNote", None, "cannot create note"),
+        ]
+
+    def test_get_notes(self):
+        self.results["notesInfo"] = [
+            {
+                "noteId": 10,
+                "modelName": "model",
+                "deckName": "deck",
+                "tags": ["tag"],
+                "fields": {"Front": {"value": "hola", "order": 0}},
+            },
+            {},
+        ]
+
+        actual_result = self.run_with_api(lambda api: api.get_notes([10, 11]))
+
+        assert actual_result == {
+            10: AnkiNote("model", "deck", {"Front": "hola"}, ["tag"]),
+        }
+
+    def test_requires_aiohttp(self):
+        with patch.dict(sys.modules, {"aiohttp": None}):
+            with pytest.raises(DejimaUserError):
+                AsyncConnection()
@@ -0,0 +1,306 @@
+import asyncio
+import os
+import shutil
+import tempfile
+import threading
+from typing import List
+from typing import Optional
+from unittest import TestCase
+
+import pytest
+
+from ..api import AnkiActionResult
+from ..api import AnkiCardTemplate
+from ..api import AnkiError
+from ..api import AnkiMediaUpload
+from ..api import AnkiModel
+from ..api import AnkiNote
+from ..api import AnkiNoteOptions
+from ..api import Connection as AnkiConnection
+from ..async_api import AsyncConnection
+from ..backends import AnkiConnectBackend
+from ..backends import AsyncAnkiConnectBackend
+from ..backends import AsyncBackend
+from ..backends import AsyncBatchedAnkiConnectBackend
+from ..backends import BatchedAnkiConnectBackend
+from ..backends import NullBackend
+from ..backends import SyncBackendAdapter
+from ..benchmark.generators import write_boox_export
+from ..benchmark.server import FakeAnkiConnect
+from ..exceptions import DejimaUserError
+from .helpers import run_import
+
+MODEL = AnkiModel(
+    modelName="Model",
+    inOrderFields=["Front", "Back"],
+    css="",
+    isCloze=False,
+    cardTemplates=[AnkiCardTemplate(Name="Card", Front="{{Front}}", Back="{{Back}}")],
+)
+
+
+def get_note(front: str, back: str) -> AnkiNote:
+    return AnkiNote(
+        deckName="Deck",
+        modelName="Model",
+        fields={"Front": front, "Back": back},
+        tags=["dejima-import"],
+    )
+
+
+class TestNullBackend(TestCase):
+    def test_notes(self):
+        backend = NullBackend()
+        assert backend.ensure_model(MODEL) == (
+            ["Front", "Back"],
+            {"Card": {"Front": "{{Front}}", "Back": "{{Back}}"}},
+        )
+
+        first, second = (
+            result.result
+            for result in backend.add_notes(
+                [get_note("hola", "hello"), get_note("adios", "bye")]
+            )
+        )
+        results = backend.update_notes(
+            [(first, get_note("hola", "hi")), (99, get_note("x", "y"))]
+        )
+
+        assert backend.find_notes("deck", {"front": "HOLA"}) == [first]
+        assert backend.find_notes("Deck", {"Front": "hola", "Back": "bye"}) == [
+            first,
+            second,
+        ]
+        assert backend.find_notes("Other") == []
+        assert [result.error is None for result in results] == [True, False]
+        notes = backend.get_notes([first, second, 99])
+        assert notes[first].fields == {"Front": "hola", "Back": "hi"}
+        assert set(notes) == {first, second}
+
+        # What is returned is a copy.
+        notes[second].fields["Back"] = "changed"
+        assert backend.get_notes([second])[second].fields["Back"] == "bye"
+
+
+class TestSyncBackendAdapter(TestCase):
+    def test_media_are_stored_alongside(self):
+        threads = set()
+
+        class RecordingBackend(NullBackend):
+            def store_media_file(self, media: AnkiMediaUpload) -> str:
+                threads.add(threading.get_ident())
+                return super().store_media_file(media)
+
+        async def store_media(adapter: SyncBackendAdapter) -> List[str]:
+            async with adapter:
+                return await asyncio.gather(
+                    *(
+                        adapter.store_media_file(AnkiMediaUpload(f"{idx}.png"))
+                        for idx in range(10)
+                    )
+                )
+
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+        actual_result = loop.run_until_complete(
+            store_media(SyncBackendAdapter(RecordingBackend(), media_workers=2))
+        )
+
+        assert actual_result == [f"{idx}.png" for idx in range(10)]
+        assert 0 < len(threads) <= 2
+        assert threading.get_ident() not in threads
+
+
+class TestAnkiConnectBackends(TestCase):
+    def setUp(self):
+        self.server = FakeAnkiConnect().__enter__()
+        self.api = AnkiConnection(port=self.server.port)
+        self.loop = asyncio.new_event_loop()
+
+        super().setUp()
+
+    def tearDown(self):
+        self.api.close()
+        self.loop.close()
+        self.server.__exit__(None, None, None)
+
+        super().tearDown()
+
+    def test_failures_are_attributed_to_their_notes(self):
+        notes = [get_note("hola", "hello"), get_note("", "empty"), get_note("y", "and")]
+        for backend in (
+            AnkiConnectBackend(self.api),
+            BatchedAnkiConnectBackend(self.api, batch_size=2),
+        ):
+            backend.ensure_model(MODEL)
+            results = backend.add_notes(notes)
+
+            assert [result.error is None for result in results] == [True, False, True]
+            assert results[1].error == "cannot create note because it is empty"
+
+        # Only the rejected note is sent again on its own.
+        assert self.server.actions["addNote"] == 4
+        assert self.server.actions["addNotes"] == 2
+
+    def test_notes_added_before_a_rejected_request_are_not_added_again(self):
+        class PartlyRejectingConnection(AnkiConnection):
+            # Adds the first note before rejecting the whole request.
+            def add_notes(self, notes, options=None):
+                self.add_note(notes[0], options)
+                raise AnkiError("cannot create note because it is empty")
+
+        api = PartlyRejectingConnection(port=self.server.port)
+        self.addCleanup(api.close)
+        backend = BatchedAnkiConnectBackend(api, batch_size=3)
+        backend.ensure_model(MODEL)
+        # An identical note added by another import is not mistaken for it.
+        older = get_note("hola", "hello")
+        older.tags = ["older-import"]
+        existing = backend.add_notes([older])[0].result
+
+        notes = [get_note("hola", "hello"), get_note("", "empty"), get_note("y", "and")]
+        results = backend.add_notes(notes, AnkiNoteOptions(allowDuplicate=True))
+
+        assert [result.error is None for result in results] == [True, False, True]
+        assert results[0].result not in (None, existing)
+        assert sorted(
+            note["fields"]["Front"] for note in self.server.notes.values()
+        ) == [
+            "hola",
+            "hola",
+            "y",
+        ]
+
+    def test_async_failures_are_attributed_to_their_notes(self):
+        notes = [get_note("hola", "hello"), get_note("", "empty"), get_note("y", "and")]
+
+        async def add_notes(backend: AsyncBackend) -> List[AnkiActionResult]:
+            async with backend:
+                await backend.ensure_model(MODEL)
+                return await backend.add_notes(notes)
+
+        for backend in (
+            AsyncAnkiConnectBackend(AsyncConnection(port=self.server.port)),
+            AsyncBatchedAnkiConnectBackend(
+                AsyncConnection(port=self.server.port), batch_size=2
+            ),
+        ):
+            results = self.loop.run_until_complete(add_notes(backend))
+
+            assert [result.error is None for result in results] == [True, False, True]
+            assert results[1].error == "cannot create note because it is empty"
+
+        assert self.server.actions["addNote"] == 4
+        assert self.server.actions["addNotes"] == 2
+
+    def test_async_notes_added_before_a_rejected_request_are_not_added_again(self):
+        class PartlyRejectingConnection(AsyncConnection):
+            async def add_notes(self, notes, options=None):
+                await self.add_note(notes[0], options)
+                raise AnkiError("cannot create note because it is empty")
+
+        older = get_note("hola", "hello")
+        older.tags = ["older-import"]
+        notes = [get_note("hola", "hello"), get_note("", "empty"), get_note("y", "and")]
+
+        async def add_notes() -> List[AnkiActionResult]:
+            api = PartlyRejectingConnection(port=self.server.port)
+            async with AsyncBatchedAnkiConnectBackend(api, batch_size=3) as backend:
+                await backend.ensure_model(MODEL)
+                await api.add_note(older)
+                return await backend.add_notes(
+                    notes, AnkiNoteOptions(allowDuplicate=True)
+                )
+
+        results = self.loop.run_until_complete(add_notes())
+
+        assert [result.error is None for result in results] == [True, False, True]
+        assert sorted(
+            note["fields"]["Front"] for note in self.server.notes.values()
+        ) == ["hola", "hola", "y"]
+
+    def test_find_notes(self):
+        backend = AnkiConnectBackend(self.api)
+        backend.ensure_model(MODEL)
+        first, second = (
+            result.result
+            for result in backend.add_notes([get_note("a:b", "1"), get_note("c", "2")])
+        )
+
+        assert backend.find_notes("Deck", {"Front": "A:B", "Back": "2"}) == [
+            first,
+            second,
+        ]
+        assert backend.find_notes("Deck") == [first, second]
+        assert backend.find_notes("Other") == []
+
+    def test_batched_updates(self):
+        backend = BatchedAnkiConnectBackend(self.api, batch_size=2)
+        backend.ensure_model(MODEL)
+        first, second = (
+            result.result
+            for result in backend.add_notes([get_note("a", "1"), get_note("b", "2")])
+        )
+
+        results = backend.update_notes(
+            [(first, get_note("a", "3")), (99, get_note("c", "4"))]
+        )
+
+        assert [result.error is None for result in results] == [True, False]
+        assert self.server.notes[first]["fields"]["Back"] == "3"
+        assert self.server.notes[second]["fields"]["Back"] == "2"
+
+    def test_invalid_batch_size(self):
+        with pytest.raises(ValueError):
+            BatchedAnkiConnectBackend(self.api, batch_size=0)
+
+
+class TestNullImport(TestCase):
+    def setUp(self):
+        self._tmp_dir = tempfile.mkdtemp()
+        self.input_path = os.path.join(self._tmp_dir, "export.txt")
+        with open(self.input_path, "w") as outf:
+            write_boox_export(outf, 20, duplicate_ratio=0.5)
+        self.database = os.path.join(self._tmp_dir, "dejima.db")
+
+        super().setUp()
+
+    def tearDown(self):
+        shutil.rmtree(self._tmp_dir)
+
+        super().tearDown()
+
+    def run_import(self, *args: str, backend: Optional[NullBackend] = None):
+        run_import(
+            self._tmp_dir,
+            "--database",
+            self.database,
+            *args,
+            "Deck",
+            "boox",
+            "--input",
+            self.input_path,
+            backend=backend,
+        )
+
+    def test_import(self):
+        backend = NullBackend()
+        self.run_import("--backend", "null", backend=backend)
+
+        assert 0 < len(backend.find_notes("Deck")) < 20
+        assert not os.path.exists(self.database)
+
+    def test_async_import(self):
+        backend = NullBackend()
+        self.run_import("--backend", "null", "--async", backend=backend)
+
+        assert 0 < len(backend.find_notes("Deck")) < 20
+
+    def test_invalid_options(self):
+        for args in (
+            ["--backend", "apkg"],
+            ["--backend", "null", "--resume"],
+            ["--backend", "null", "--apkg", os.path.join(self._tmp_dir, "a.apkg")],
+        ):
+            with pytest.raises(DejimaUserError):
+                self.run_import(*args)
@@ -0,0 +1,159 @@
+import argparse
+import io
+import json
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+from unittest.mock import Mock
+
+import pytest
+from rich.console import Console
+
+from ..benchmark.generators import write_lln_export
+from ..benchmark.server import FakeAnkiConnect
+from ..commands.batch_import import JOB_COMPLETED
+from ..commands.batch_import import JOB_FAILED
+from ..commands.batch_import import BatchImportCommand
+from ..commands.batch_import import KeyClaims
+from ..commands.batch_import import load_manifest
+from ..exceptions import DejimaError
+from ..exceptions import DejimaUserError
+from ..sources.lln import LLNJsonSource
+from .helpers import parse_options
+
+
+class TestBatchImport(TestCase):
+    def setUp(self):
+        self._tmp_dir = tempfile.mkdtemp()
+
+        super().setUp()
+
+    def tearDown(self):
+        shutil.rmtree(self._tmp_dir)
+
+        super().tearDown()
+
+    def write_export(self, name: str, count: int, seed: int = 0) -> str:
+        path = os.path.join(self._tmp_dir, name)
+        with open(path, "w") as outf:
+            write_lln_export(outf, count, seed=seed)
+
+        return path
+
+    def get_command(self, port: int, *args: str) -> BatchImportCommand:
+        options = parse_options(
+            BatchImportCommand,
+            "--database",
+            os.path.join(self._tmp_dir, "dejima.db"),
+            "--anki-port",
+            str(port),
+            "--output",
+            "quiet",
+            *args,
+        )
+
+        return BatchImportCommand(options=options, console=Console(quiet=True))
+
+    def test_load_manifest(self):
+        first = self.write_export("a.json", 1)
+        second = self.write_export("b.json", 1)
+        manifest = io.StringIO(
+            json.dumps(
+                [
+                    {"source": "lln-json", "deck": "Deck", "input": "*.json"},
+                    {
+                        "source": "lln-json",
+                        "deck": "Other",
+                        "input": "b.json",
+                        "args": ["--no-stream"],
+                    },
+                ]
+            )
+        )
+        manifest.name = os.path.join(self._tmp_dir, "manifest.json")
+
+        jobs = load_manifest(manifest)
+
+        assert [(job.deck_name, job.input_path, job.args) for job in jobs] == [
+            ("Deck", first, []),
+            ("Deck", second, []),
+            ("Other", second, ["--no-stream"]),
+        ]
+
+    def test_load_manifest_requires_deck(self):
+        with pytest.raises(DejimaUserError):
+            load_manifest(io.StringIO('[{"source": "lln-json", "input": "*"}]'))
+
+    def test_key_claims(self):
+        claims = KeyClaims()
+
+        assert claims.claim("a")
+        assert not claims.claim("a")
+        assert claims.claim("b")
+
+    def test_import(self):
+        path = self.write_export("a.json", 20)
+        other_path = self.write_export("b.json", 10, seed=1)
+        keys = set()
+        for input_path in (path, other_path):
+            with open(input_path) as inf:
+                source = LLNJsonSource(
+                    "lln-json", argparse.Namespace(input=inf, stream=True), Mock()
+                )
+                keys.update(key for key, _ in source.get_entries())
+
+        with FakeAnkiConnect() as server:
+            command = self.get_command(
+                server.port,
+                "--glob",
+                "lln-json",
+                "First",
+                path,
+                "--glob",
+                "lln-json",
+                "Second",
+                path,
+                "--glob",
+                "lln-json",
+                "Second",
+                os.path.join(self._tmp_dir, "*.json"),
+            )
+            jobs = command.get_jobs()
+            command.get_jobs = lambda: jobs
+            command.handle()
+
+            notes = len(server.notes)
+
+        # Each entry is imported into only one deck, as it would have been
+        # if the inputs were imported one after another.
+        assert len(jobs) == 3
+        assert all(job.status == JOB_COMPLETED for job in jobs)
+        assert notes == len(keys)
+
+    def test_failed_job(self):
+        self.write_export("a.json", 5)
+        manifest = os.path.join(self._tmp_dir, "manifest.json")
+        with open(manifest, "w") as outf:
+            json.dump(
+                [
+                    {"source": "lln-json", "deck": "First", "input": "a.json"},
+                    {
+                        "source": "lln-json",
+                        "deck": "Second",
+                        "input": "a.json",
+                        "args": ["--unknown"],
+                    },
+                ],
+                outf,
+            )
+
+        with FakeAnkiConnect() as server:
+            command = self.get_command(server.port, "--manifest", manifest)
+            jobs = command.get_jobs()
+            command.get_jobs = lambda: jobs
+            with pytest.raises(DejimaError):
+                command.handle()
+
+        assert [job.status for job in jobs] == [JOB_COMPLETED, JOB_FAILED]
+        assert jobs[0].counts.added == 5
@@ -0,0 +1,109 @@
+import argparse
+import io
+from unittest import TestCase
+from unittest.mock import Mock
+
+from ..api import AnkiCardTemplate
+from ..api import AnkiModel
+from ..api import AnkiNote
+from ..api import Connection
+from ..benchmark.generators import write_boox_export
+from ..benchmark.generators import write_lln_export
+from ..benchmark.server import FakeAnkiConnect
+from ..sources.boox import BooxSource
+from ..sources.lln import LLNJsonSource
+
+
+class TestFakeAnkiConnect(TestCase):
+    def setUp(self):
+        self.server = FakeAnkiConnect().__enter__()
+        self.api = Connection(port=self.server.port)
+        self.api.create_model(
+            AnkiModel(
+                modelName="Model",
+                inOrderFields=["Front", "Back"],
+                css="",
+                isCloze=False,
+                cardTemplates=[
+                    AnkiCardTemplate(Name="Card", Front="{{Front}}", Back="{{Back}}")
+                ],
+            )
+        )
+
+        super().setUp()
+
+    def tearDown(self):
+        self.api.close()
+        self.server.__exit__(None, None, None)
+
+        super().tearDown()
+
+    def get_note(self, front: str, back: str, deck: str = "Deck") -> AnkiNote:
+        return AnkiNote(
+            deckName=deck,
+            modelName="Model",
+            fields={"Front": front, "Back": back},
+            tags=[],
+        )
+
+    def test_add_and_find_notes(self):
+        note_ids = self.api.add_notes(
+            [
+                self.get_note("hola", "hello"),
+                self.get_note("adios", "goodbye"),
+                self.get_note("hola", "hi", deck="Other"),
+            ]
+        )
+
+        assert len(set(note_ids)) == 3
+        assert self.api.find_notes('deck:"Deck" (front:"HOLA" OR back:"x")') == [
+            note_ids[0]
+        ]
+        assert self.api.find_notes('deck:"Deck"') == note_ids[:2]
+
+    def test_update_and_get_notes(self):
+        note_id = self.api.add_note(self.get_note("hola", "hello"))
+
+        self.api.update_note(note_id, self.get_note("hola", "hi"))
+
+        assert self.api.get_notes([note_id])[note_id].fields == {
+            "Front": "hola",
+            "Back": "hi",
+        }
+
+    def test_counts_round_trips(self):
+        self.server.requests.clear()
+        self.server.actions.clear()
+
+        self.api.add_notes([self.get_note("hola", "hello")])
+        self.api.find_notes('deck:"Deck"')
+
+        assert self.server.round_trips == 2
+        assert self.server.actions["addNotes"] == 1
+
+
+class TestGenerators(TestCase):
+    def test_lln_export(self):
+        export = io.StringIO()
+        write_lln_export(export, 4, media_size=16)
+        export.seek(0)
+
+        source = LLNJsonSource(
+            "lln-json", argparse.Namespace(input=export, stream=True), Mock()
+        )
+        entries = list(source.get_entries())
+
+        assert len(entries) == 4
+        assert len({key for key, _ in entries}) == 4
+        assert all(len(note.media) == 3 for _, note in entries)
+
+    def test_boox_export_duplicates(self):
+        export = io.StringIO()
+        write_boox_export(export, 20, duplicate_ratio=0.5)
+        export.seek(0)
+
+        source = BooxSource("boox", argparse.Namespace(input=export), Mock())
+        entries = list(source.get_entries())
+
+        assert len(entries) == 20
+        assert len({note.fields["Front"] for _, note in entries}) < 20
@@ -0,0 +1,54 @@
+import argparse
+import dataclasses
+import datetime
+import json
+from hashlib import sha256
+from unittest import TestCase
+from unittest.mock import Mock
+
+from boox_annotation_parser.parser import Annotation
+
+from ..plugin import KEY_PREFIX
+from ..sources.boox import BooxSource
+
+
+class TestBooxSource(TestCase):
+    def setUp(self):
+        self.source = BooxSource("boox", argparse.Namespace(), Mock())
+        self.annotation = Annotation(
+            section_name="Chapter 1",
+            time=datetime.datetime(2021, 8, 1, 12, 0),
+            original_text="hola",
+            annotations="hello",
+            page_number=1,
+        )
+
+        super().setUp()
+
+    def test_key(self):
+        foreign_key, note = self.source.get_entry(self.annotation)
+
+        assert foreign_key.startswith(KEY_PREFIX)
+        assert foreign_key.legacy is None
+        assert note.fields == {"Front": "hola", "Back": "hello"}
+
+    def test_key_depends_on_annotation(self):
+        other = dataclasses.replace(self.annotation, annotations="hi")
+
+        first_key, _ = self.source.get_entry(self.annotation)
+        second_key, _ = self.source.get_entry(other)
+
+        assert first_key != second_key
+
+    def test_legacy_key(self):
+        self.source.enable_legacy_keys()
+
+        foreign_key, _ = self.source.get_entry(self.annotation)
+
+        # Keys stored by earlier releases hashed the whole annotation.
+        expected_result = sha256(
+            json.dumps(
+                dataclasses.asdict(self.annotation), sort_keys=True, default=str
+            ).encode("utf-8")
+        ).hexdigest()
+        assert foreign_key.legacy == expected_result
@@ -1,18 +1,29 @@
+import datetime
+import os.path
 import shutil
+import sqlite3
 import tempfile
 import uuid
 from unittest import TestCase
 from unittest.mock import patch
 
+from ..db import MIGRATIONS
+from ..db import RUN_COMPLETED
+from ..db import RUN_FAILED
 from ..db import Connection
+from ..db import ImportRun
+from ..db import SourceScan
 
 
 class TestDbConnection(TestCase):
     def setUp(self):
         self._tmp_dir = tempfile.mkdtemp()
 
-        with patch("appdirs.user_data_dir") as user_data_dir:
-            user_data_dir.return_value = self._tmp_dir
+        self._db_path = os.path.join(self._tmp_dir, "dejima.db")
+
+        with patch("dejima.db.USER_DATA_DIR", self._tmp_dir), patch(
+            "dejima.db.DB_PATH", self._db_path
+        ):
             self.db = Connection()
 
         super().setUp()
@@ -70,3 +81,261 @@ class TestDbConnection(TestCase):
         expected_result = False
 
         assert actual_result == expected_result
+
+    def test_mark_entries_processed(self):
+        arbitrary_source = "arbitrary source"
+        arbitrary_keys = [str(uuid.uuid4()) for _ in range(3)]
+
+        self.db.mark_entries_processed(
+            arbitrary_source,
+            [(key, idx) for idx, key in enumerate(arbitrary_keys)],
+            "arbitrary import name",
+        )
+
+        for key in arbitrary_keys:
+            assert self.db.annotation_is_known(arbitrary_source, key)
+
+    def test_mark_entry_processed_twice_upserts(self):
+        arbitrary_source = "arbitrary source"
+        arbitrary_key = str(uuid.uuid4())
+
+        self.db.mark_entry_processed(arbitrary_source, arbitrary_key, None, "first")
+        self.db.mark_entry_processed(arbitrary_source, arbitrary_key, 10, "second")
+
+        cursor = self.db.get_cursor()
+        cursor.execute("SELECT anki_id, importName FROM known_entries")
+        actual_result = cursor.fetchall()
+        expected_result = [(10, "second")]
+
+        assert actual_result == expected_result
+
+    def test_schema_version(self):
+        actual_result = self.db.get_schema_version()
+        expected_result = len(MIGRATIONS)
+
+        assert actual_result == expected_result
+
+    def test_migrate_legacy_database(self):
+        legacy_path = os.path.join(self._tmp_dir, "legacy.db")
+        legacy = sqlite3.Connection(legacy_path, isolation_level=None)
+        legacy.execute(
+            """
+            CREATE TABLE known_entries (
+                key string,
+                source string,
+                anki_id integer,
+                importName string,
+                imported timestamp
+            )
+        """
+        )
+        for anki_id in (1, 2):
+            legacy.execute(
+                "INSERT INTO known_entries VALUES (?, ?, ?, ?, ?)",
+                ("key", "source", anki_id, "import", datetime.datetime.utcnow()),
+            )
+        legacy.close()
+
+        with patch("dejima.db.DB_PATH", legacy_path):
+            db = Connection()
+
+        assert db.get_schema_version() == len(MIGRATIONS)
+        cursor = db.get_cursor()
+        cursor.execute("SELECT key, source, anki_id FROM known_entries")
+        assert cursor.fetchall() == [("key", "source", 2)]
+        with self.assertRaises(sqlite3.IntegrityError):
+            cursor.execute(
+                "INSERT INTO known_entries (key, source) VALUES (?, ?)",
+                ("key", "source"),
+            )
+
+    def test_get_known_keys(self):
+        arbitrary_source = "arbitrary source"
+        known_keys = {str(uuid.uuid4()) for _ in range(3)}
+        unknown_keys = {str(uuid.uuid4()) for _ in range(3)}
+
+        self.db.mark_entries_processed(
+            arbitrary_source, [(key, None) for key in known_keys], "import"
+        )
+        self.db.mark_entries_processed(
+            "other source", [(key, None) for key in unknown_keys], "import"
+        )
+
+        actual_result = self.db.get_known_keys(
+            arbitrary_source, known_keys | unknown_keys
+        )
+        expected_result = known_keys
+
+        assert actual_result == expected_result
+
+    def test_has_legacy_keys(self):
+        self.db.mark_entries_processed(
+            "new source", [("v2:abc", None), ("v2:def", None)], "import"
+        )
+        self.db.mark_entries_processed(
+            "old source", [("v2:abc", None), ("abc", None)], "import"
+        )
+
+        assert not self.db.has_legacy_keys("new source", "v2:")
+        assert self.db.has_legacy_keys("old source", "v2:")
+
+    def test_retire_legacy_keys(self):
+        self.db.mark_entries_processed(
+            "old source", [("v2:abc", None), ("abc", None)], "import"
+        )
+        self.db.mark_entries_processed("other source", [("def", None)], "import")
+
+        self.db.retire_legacy_keys("old source", "/a.txt", "1")
+
+        assert not self.db.has_legacy_keys("old source", "v2:", "/a.txt", "1")
+        assert self.db.has_legacy_keys("old source", "v2:", "/a.txt", "2")
+        assert self.db.has_legacy_keys("old source", "v2:", "/b.txt", "1")
+        assert self.db.has_legacy_keys("old source", "v2:")
+        assert self.db.has_legacy_keys("other source", "v2:", "/a.txt", "1")
+
+    def test_rekey_known_entries(self):
+        self.db.mark_entries_processed(
+            "arbitrary source", [("abc", 1), ("def", 2)], "import"
+        )
+
+        self.db.rekey_known_entries("arbitrary source", [("abc", "v2:abc")])
+
+        actual_result = self.db.get_known_keys(
+            "arbitrary source", ["abc", "v2:abc", "def"]
+        )
+        expected_result = {"v2:abc", "def"}
+
+        assert actual_result == expected_result
+
+    def test_get_known_keys_temp_table(self):
+        arbitrary_source = "arbitrary source"
+        known_keys = {str(uuid.uuid4()) for _ in range(3)}
+        unknown_keys = {str(uuid.uuid4()) for _ in range(3)}
+
+        self.db.mark_entries_processed(
+            arbitrary_source, [(key, None) for key in known_keys], "import"
+        )
+
+        with patch("dejima.db.KNOWN_KEYS_IN_CLAUSE_LIMIT", 2):
+            actual_result = self.db.get_known_keys(
+                arbitrary_source, known_keys | unknown_keys
+            )
+            second_result = self.db.get_known_keys(arbitrary_source, unknown_keys)
+        expected_result = known_keys
+
+        assert actual_result == expected_result
+        assert second_result == set()
+
+    def test_buffered_writer_flushes_when_full(self):
+        arbitrary_source = "arbitrary source"
+        first_key = str(uuid.uuid4())
+        second_key = str(uuid.uuid4())
+
+        writer = self.db.buffered_writer(size=2)
+        writer.mark_entry_processed(arbitrary_source, first_key, 1, "import")
+
+        assert not self.db.annotation_is_known(arbitrary_source, first_key)
+
+        writer.mark_entry_processed(arbitrary_source, second_key, 2, "import")
+
+        assert self.db.get_known_keys(arbitrary_source, [first_key, second_key]) == {
+            first_key,
+            second_key,
+        }
+        assert len(writer) == 0
+
+    def test_buffered_writer_flushes_after_interval(self):
+        arbitrary_source = "arbitrary source"
+        arbitrary_key = str(uuid.uuid4())
+
+        writer = self.db.buffered_writer(size=100, interval=0)
+        writer.mark_entry_processed(arbitrary_source, arbitrary_key, 1, "import")
+
+        assert self.db.annotation_is_known(arbitrary_source, arbitrary_key)
+
+    def test_buffered_writer_flushes_on_failure(self):
+        arbitrary_source = "arbitrary source"
+        arbitrary_key = str(uuid.uuid4())
+
+        with self.assertRaises(RuntimeError):
+            with self.db.buffered_writer(size=100) as writer:
+                writer.mark_entry_processed(
+                    arbitrary_source, arbitrary_key, 1, "import"
+                )
+                raise RuntimeError()
+
+        assert self.db.annotation_is_known(arbitrary_source, arbitrary_key)
+
+    def test_buffered_writer_commits_processed_entries(self):
+        arbitrary_source = "arbitrary source"
+        first_key = str(uuid.uuid4())
+        second_key = str(uuid.uuid4())
+
+        writer = self.db.buffered_writer(size=100)
+        writer.mark_entry_processed(arbitrary_source, first_key, None, "import")
+        writer.commit_entries_processed(arbitrary_source, [(second_key, 2)], "import")
+
+        assert self.db.get_known_keys(arbitrary_source, [first_key, second_key]) == {
+            first_key,
+            second_key,
+        }
+        assert len(writer) == 0
+
+    def test_journal_mode(self):
+        cursor = self.db.get_cursor()
+        cursor.execute("PRAGMA journal_mode")
+
+        assert cursor.fetchone()[0] == "wal"
+
+    def test_media_is_stored(self):
+        arbitrary_filename = "arbitrary.png"
+
+        self.db.mark_media_stored("host:1", arbitrary_filename, "checksum")
+
+        assert self.db.media_is_stored("host:1", arbitrary_filename, "checksum")
+        assert not self.db.media_is_stored(
+            "host:1", arbitrary_filename, "other checksum"
+        )
+        assert not self.db.media_is_stored("host:1", "other.png", "checksum")
+        assert not self.db.media_is_stored("host:2", arbitrary_filename, "checksum")
+
+    def test_buffered_writer_media(self):
+        arbitrary_filename = "arbitrary.png"
+
+        with self.db.buffered_writer(size=100) as writer:
+            writer.mark_media_stored("host:1", arbitrary_filename, "checksum")
+
+            assert not self.db.media_is_stored("host:1", arbitrary_filename, "checksum")
+
+        assert self.db.media_is_stored("host:1", arbitrary_filename, "checksum")
+
+    def test_get_resumable_import_run(self):
+        run = ImportRun("import1", "lln", "Deck", "/input.json", "1:2:3:4")
+        self.db.start_import_run(run)
+        run.records = 20
+        run.offset = 4096
+        run.status = RUN_FAILED
+        self.db.update_import_run(run)
+
+        resumable = self.db.get_resumable_import_run("lln", "Deck", "1:2:3:4")
+
+        assert resumable == run
+        assert self.db.get_resumable_import_run("lln", "Other", "1:2:3:4") is None
+        assert self.db.get_resumable_import_run("lln", "Deck", "1:2:3:5") is None
+
+    def test_completed_import_run_is_not_resumable(self):
+        run = ImportRun("import1", "lln", "Deck", "/input.json", "1:2:3:4")
+        self.db.start_import_run(run)
+        run.status = RUN_COMPLETED
+        self.db.update_import_run(run)
+
+        assert self.db.get_resumable_import_run("lln", "Deck", "1:2:3:4") is None
+
+    def test_save_source_scan_replaces(self):
+        scan = SourceScan("lln", "/input.json", 100, 1, 90, "hash", 3, 90)
+        self.db.save_source_scan(scan)
+        scan.records = 5
+        self.db.save_source_scan(scan)
+
+        assert self.db.get_source_scan("lln", "/input.json") == scan
+        assert self.db.get_source_scan("boox", "/input.json") is None
@@ -0,0 +1,69 @@
+import asyncio
+from unittest import TestCase
+from unittest.mock import Mock
+
+from ..api import AnkiNote
+from ..duplicates import DuplicateIndex
+
+
+class TestDuplicateIndex(TestCase):
+    def setUp(self):
+        self.index = DuplicateIndex(["Front", "Back"])
+        self.index.add(1, {"Front": "hola", "Back": "hello"})
+        self.index.add(2, {"Front": "adios", "Back": "goodbye"})
+
+        super().setUp()
+
+    def test_find(self):
+        actual_result = self.index.find({"Front": "hola", "Back": "goodbye"})
+        expected_result = [1, 2]
+
+        assert actual_result == expected_result
+
+    def test_find_is_case_insensitive(self):
+        actual_result = self.index.find({"front": "HOLA", "Back": "something"})
+        expected_result = [1]
+
+        assert actual_result == expected_result
+
+    def test_add_replaces_previous_values(self):
+        self.index.add(1, {"Front": "hola\n\n<hr />\n\nhi", "Back": "hello"})
+
+        assert self.index.find({"Front": "hola", "Back": ""}) == []
+        assert self.index.find({"Front": "hola\n\n<hr />\n\nhi"}) == [1]
+
+    def test_missing_fields_are_not_indexed(self):
+        self.index.add(3, {"Text": "hola"})
+
+        assert self.index.find({"Front": "", "Back": ""}) == []
+
+    def test_remove(self):
+        self.index.remove(1)
+
+        assert self.index.find({"Front": "hola", "Back": "hello"}) == []
+        assert len(self.index) == 1
+
+    def test_load(self):
+        async def find_notes(deck_name):
+            return [10, 11, 12]
+
+        async def get_notes(ids):
+            return {
+                id: AnkiNote("model", "deck", {"Front": f"front {id}"}, [])
+                for id in ids
+            }
+
+        api = Mock(find_notes=Mock(side_effect=find_notes))
+        api.get_notes.side_effect = get_notes
+
+        loop = asyncio.new_event_loop()
+        try:
+            index = loop.run_until_complete(
+                DuplicateIndex.load(api, "deck", ["Front"], batch_size=2)
+            )
+        finally:
+            loop.close()
+
+        api.find_notes.assert_called_once_with("deck")
+        assert api.get_notes.call_count == 2
+        assert index.find({"Front": "front 12"}) == [12]
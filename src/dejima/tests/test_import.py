@@ -0,0 +1,452 @@
+import argparse
+import asyncio
+import datetime
+import importlib
+import io
+import itertools
+import json
+import os
+import shutil
+import tempfile
+from typing import List
+from unittest import TestCase
+from unittest.mock import Mock
+
+import pytest
+from rich.console import Console
+
+from ..api import AnkiError
+from ..api import AnkiNote
+from ..api import Connection as AnkiConnection
+from ..backends import BatchedAnkiConnectBackend
+from ..backends import SyncBackendAdapter
+from ..benchmark.generators import write_boox_export
+from ..benchmark.generators import write_lln_export
+from ..benchmark.server import FakeAnkiConnect
+from ..db import Connection as DatabaseConnection
+from ..plugin import KEY_PREFIX
+from ..sources.lln import LLNJsonSource
+from ..util import get_file_fingerprint
+from .helpers import run_import
+
+import_command = importlib.import_module("dejima.commands.import")
+
+
+class TestEnsureModel(TestCase):
+    def setUp(self):
+        self._tmp_dir = tempfile.mkdtemp()
+        self.server = FakeAnkiConnect().__enter__()
+        self.api = AnkiConnection(port=self.server.port)
+        self.backend = SyncBackendAdapter(BatchedAnkiConnectBackend(self.api))
+        self.loop = asyncio.new_event_loop()
+        self.db = DatabaseConnection(path=os.path.join(self._tmp_dir, "dejima.db"))
+        self.source = LLNJsonSource("lln-json", Mock(), Mock())
+
+        super().setUp()
+
+    def tearDown(self):
+        self.loop.run_until_complete(self.backend.close())
+        self.loop.close()
+        self.api.close()
+        self.server.__exit__(None, None, None)
+        shutil.rmtree(self._tmp_dir)
+
+        super().tearDown()
+
+    def ensure_model(self, *args: str):
+        command = self.get_command(*args)
+        self.loop.run_until_complete(
+            command.ensure_model(self.backend, self.db, self.source)
+        )
+
+        return command
+
+    def get_command(self, *args: str):
+        parser = argparse.ArgumentParser()
+        import_command.ImportCommand.add_import_arguments(parser)
+        options = parser.parse_args(["--anki-port", str(self.server.port), *args])
+        options.source = "lln-json"
+        self.output = io.StringIO()
+
+        return import_command.ImportCommand(
+            options=options, console=Console(file=self.output, width=200)
+        )
+
+    def test_cached_model_needs_no_requests(self):
+        self.ensure_model()
+        self.server.actions.clear()
+
+        self.ensure_model()
+
+        assert self.source.get_model_name() in self.server.models
+        assert not self.server.actions
+        assert self.output.getvalue() == ""
+
+    def test_model_is_checked_after_ttl(self):
+        self.ensure_model()
+        self.server.actions.clear()
+
+        self.ensure_model("--model-cache-ttl", "0")
+
+        assert self.server.actions["modelNames"] == 1
+        assert self.server.actions["createModel"] == 0
+
+    def test_drift_is_reported(self):
+        model = import_command.get_model(self.source)
+        model.inOrderFields = model.inOrderFields[:-1] + ["Extra"]
+        model.cardTemplates[0].Front = "{{Extra}}"
+        self.api.create_model(model)
+
+        self.ensure_model()
+
+        output = self.output.getvalue()
+        assert "does not match" in output
+        assert "has the additional fields Extra" in output
+        assert "has different card templates" in output
+
+    def test_refresh_models(self):
+        command = self.ensure_model()
+        self.server.models.clear()
+
+        self.ensure_model("--refresh-models")
+
+        assert self.source.get_model_name() in self.server.models
+        cached = self.db.get_cached_model(
+            command.get_collection(), self.source.get_model_name()
+        )
+        assert cached is not None
+        assert cached.checked <= datetime.datetime.utcnow()
+
+
+class RecordingBackend(BatchedAnkiConnectBackend):
+    """Notes how many entries had been recorded whenever notes are added."""
+
+    def __init__(self, api: AnkiConnection, database: str, fail_after: int = None):
+        self.recorded: List[int] = []
+        self._database = database
+        self._fail_after = fail_after
+
+        super().__init__(api, batch_size=10)
+
+    def add_notes(self, notes, options=None, keys=None):
+        db = DatabaseConnection(path=self._database)
+        cursor = db.get_cursor()
+        cursor.execute("SELECT COUNT(*) FROM known_entries")
+        self.recorded.append(cursor.fetchone()[0])
+        cursor.close()
+
+        if self._fail_after is not None and len(self.recorded) > self._fail_after:
+            raise RuntimeError("Interrupted")
+
+        return super().add_notes(notes, options, keys)
+
+
+class TestImport(TestCase):
+    def setUp(self):
+        self._tmp_dir = tempfile.mkdtemp()
+        self.input_path = os.path.join(self._tmp_dir, "export.json")
+        with open(self.input_path, "w") as outf:
+            write_lln_export(outf, 30, media_size=16)
+        self.database = os.path.join(self._tmp_dir, "dejima.db")
+        self.server = FakeAnkiConnect().__enter__()
+
+        super().setUp()
+
+    def tearDown(self):
+        self.server.__exit__(None, None, None)
+        shutil.rmtree(self._tmp_dir)
+
+        super().tearDown()
+
+    def run_import(self, *args: str, backend=None, input_path=None):
+        return run_import(
+            self._tmp_dir,
+            "--database",
+            self.database,
+            "--anki-port",
+            str(self.server.port),
+            "--batch-size",
+            "10",
+            *args,
+            "Deck",
+            "lln-json",
+            "--input",
+            input_path or self.input_path,
+            backend=backend,
+        )
+
+    def get_legacy_keys(self, input_path: str, count: int) -> List[str]:
+        with open(input_path) as inf:
+            source = LLNJsonSource(
+                "lln-json", argparse.Namespace(input=inf, stream=True), Mock()
+            )
+            source.enable_legacy_keys()
+            entries = itertools.islice(source.get_entries(), count)
+            return [getattr(key, "legacy") for key, _ in entries]
+
+    def test_import(self):
+        counts = self.run_import()
+
+        assert (counts.total, counts.added, counts.failed) == (30, 30, 0)
+        assert len(self.server.notes) == 30
+        assert self.server.actions["addNotes"] == 3
+        assert self.server.actions["addNote"] == 0
+        assert self.server.actions["storeMediaFile"] > 0
+
+    def test_async_import(self):
+        counts = self.run_import("--async")
+
+        assert (counts.total, counts.added, counts.failed) == (30, 30, 0)
+        assert len(self.server.notes) == 30
+        assert self.server.actions["addNotes"] == 3
+        assert self.server.actions["addNote"] == 0
+
+    def test_reimport_skips_known_entries_and_media(self):
+        self.run_import()
+        self.server.actions.clear()
+
+        counts = self.run_import("--full-scan")
+
+        assert (counts.total, counts.added, counts.already_processed) == (30, 0, 30)
+        assert len(self.server.notes) == 30
+        assert self.server.actions["addNotes"] == 0
+        assert self.server.actions["storeMediaFile"] == 0
+
+    def test_media_stored_in_another_collection_are_stored_again(self):
+        self.run_import()
+        # As though the entries were new, so that they are imported into the
+        # second collection with their media.
+        db = DatabaseConnection(path=self.database)
+        with db.transaction() as cursor:
+            cursor.execute("DELETE FROM known_entries")
+
+        with FakeAnkiConnect() as server:
+            run_import(
+                self._tmp_dir,
+                "--database",
+                self.database,
+                "--anki-port",
+                str(server.port),
+                "--full-scan",
+                "Deck",
+                "lln-json",
+                "--input",
+                self.input_path,
+            )
+
+            assert server.actions["storeMediaFile"] == (
+                self.server.actions["storeMediaFile"]
+            )
+
+    def test_unchanged_input_is_reported_as_skipped(self):
+        self.run_import()
+        log_path = os.path.join(self._tmp_dir, "import.log")
+
+        counts = self.run_import("--log", log_path)
+
+        assert (counts.total, counts.skipped) == (0, 30)
+        assert "30 skipped as imported before" in counts.get_summary()
+        with open(log_path) as inf:
+            events = [json.loads(line) for line in inf]
+        assert [(event["event"], event["records"]) for event in events] == [
+            ("skipped", 30)
+        ]
+
+    def test_entries_are_recorded_after_each_batch(self):
+        api = AnkiConnection(port=self.server.port)
+        try:
+            backend = RecordingBackend(api, self.database)
+            self.run_import(backend=backend)
+        finally:
+            api.close()
+
+        # Each batch is recorded before the next is sent, so an import
+        # killed while sending one only loses what that one added.
+        assert backend.recorded == [0, 10, 20]
+
+    def test_resumed_import_adds_each_note_once(self):
+        api = AnkiConnection(port=self.server.port)
+        try:
+            with pytest.raises(RuntimeError):
+                self.run_import(backend=RecordingBackend(api, self.database, 2))
+        finally:
+            api.close()
+
+        counts = self.run_import("--resume")
+
+        assert counts.added == 10
+        assert len(self.server.notes) == 30
+
+    def test_legacy_keys_are_retired_after_a_full_read(self):
+        legacy_keys = self.get_legacy_keys(self.input_path, 5)
+        db = DatabaseConnection(path=self.database)
+        db.mark_entries_processed(
+            "lln-json",
+            [(key, None) for key in legacy_keys] + [("unexported", None)],
+            "import",
+        )
+
+        counts = self.run_import()
+
+        assert (counts.added, counts.already_processed) == (25, 5)
+        assert not db.get_known_keys("lln-json", legacy_keys)
+        assert db.has_legacy_keys("lln-json", KEY_PREFIX)
+
+        # Only the unexported record is left under a legacy key, so legacy
+        # keys are no longer looked for in this input while it is unchanged.
+        with open(self.input_path) as inf:
+            fingerprint = get_file_fingerprint(inf)
+        assert not db.has_legacy_keys(
+            "lln-json", KEY_PREFIX, self.input_path, fingerprint
+        )
+
+    def test_legacy_keys_are_retired_per_input(self):
+        other_path = os.path.join(self._tmp_dir, "other.json")
+        with open(other_path, "w") as outf:
+            write_lln_export(outf, 10, seed=1)
+        legacy_keys = self.get_legacy_keys(self.input_path, 30)
+        other_legacy_keys = self.get_legacy_keys(other_path, 10)
+        db = DatabaseConnection(path=self.database)
+        db.mark_entries_processed(
+            "lln-json",
+            [(key, None) for key in legacy_keys + other_legacy_keys],
+            "import",
+        )
+
+        counts = self.run_import()
+
+        assert (counts.added, counts.already_processed) == (0, 30)
+
+        counts = self.run_import(input_path=other_path)
+
+        assert (counts.added, counts.already_processed) == (0, 10)
+        assert not self.server.notes
+
+
+class TestMerges(TestCase):
+    def setUp(self):
+        self._tmp_dir = tempfile.mkdtemp()
+        self.input_path = os.path.join(self._tmp_dir, "export.txt")
+        with open(self.input_path, "w") as outf:
+            write_boox_export(outf, 60, duplicate_ratio=0.5)
+
+        super().setUp()
+
+    def tearDown(self):
+        shutil.rmtree(self._tmp_dir)
+
+        super().tearDown()
+
+    def run_import(self, server: FakeAnkiConnect, *args: str):
+        return run_import(
+            self._tmp_dir,
+            "--database",
+            os.path.join(self._tmp_dir, f"{server.port}.db"),
+            "--anki-port",
+            str(server.port),
+            "--batch-size",
+            "10",
+            *args,
+            "Deck",
+            "boox",
+            "--input",
+            self.input_path,
+        )
+
+    def get_notes(self, server: FakeAnkiConnect):
+        # Each import tags its notes with its own name.
+        return sorted(
+            (
+                sorted(note["fields"].items()),
+                sorted(tag for tag in note["tags"] if not tag.startswith("import")),
+            )
+            for note in server.notes.values()
+        )
+
+    def test_merged_notes_are_fetched_together(self):
+        with FakeAnkiConnect() as server:
+            counts = self.run_import(server)
+            notes = self.get_notes(server)
+            merges = server.actions["updateNoteFields"]
+            fetches = server.actions["notesInfo"]
+
+        with FakeAnkiConnect() as server:
+            self.run_import(server, "--async")
+            async_notes = self.get_notes(server)
+            async_merges = server.actions["updateNoteFields"]
+            async_fetches = server.actions["notesInfo"]
+
+        assert merges > 0
+        assert (counts.total, counts.added, counts.merged) == (60, len(notes), merges)
+        assert fetches < merges
+        assert async_merges == merges
+        assert async_fetches < async_merges
+        assert async_notes == notes
+
+
+class TestRequestBatcher(TestCase):
+    def test_concurrent_submissions_share_requests(self):
+        requests = []
+
+        async def get_notes(ids):
+            requests.append(ids)
+            return [
+                AnkiNote("Model", "Deck", {}, []) if note_id != 3 else None
+                for note_id in ids
+            ]
+
+        async def run():
+            loader = import_command.RequestBatcher(get_notes, batch_size=2)
+            return await asyncio.gather(
+                *(loader.submit(note_id) for note_id in range(5))
+            )
+
+        loop = asyncio.new_event_loop()
+        try:
+            notes = loop.run_until_complete(run())
+        finally:
+            loop.close()
+
+        assert requests == [[0, 1], [2, 3], [4]]
+        assert [note is not None for note in notes] == [True, True, True, False, True]
+
+    def test_errors_reach_every_submission(self):
+        async def fail(items):
+            raise RuntimeError("Unavailable")
+
+        async def run():
+            batcher = import_command.RequestBatcher(fail, batch_size=2)
+            return await asyncio.gather(
+                *(batcher.submit(item) for item in range(3)), return_exceptions=True
+            )
+
+        loop = asyncio.new_event_loop()
+        try:
+            results = loop.run_until_complete(run())
+        finally:
+            loop.close()
+
+        assert [type(result) for result in results] == [RuntimeError] * 3
+
+    def test_missing_results_are_errors(self):
+        async def send_one(items):
+            return items[:1]
+
+        async def run():
+            batcher = import_command.RequestBatcher(send_one, batch_size=3)
+            return await asyncio.wait_for(
+                asyncio.gather(
+                    *(batcher.submit(item) for item in range(3)),
+                    return_exceptions=True,
+                ),
+                timeout=5,
+            )
+
+        loop = asyncio.new_event_loop()
+        try:
+            results = loop.run_until_complete(run())
+        finally:
+            loop.close()
+
+        assert results[0] == 0
+        assert [type(result) for result in results[1:]] == [AnkiError] * 2
@@ -0,0 +1,39 @@
+import io
+import json
+from unittest import TestCase
+from unittest.mock import Mock
+
+from ..benchmark.generators import get_lln_item
+from ..sources.lln import LLNJsonSource
+
+
+class TestLLNJsonSource(TestCase):
+    def setUp(self):
+        self.source = LLNJsonSource("lln-json", Mock(), Mock())
+
+        super().setUp()
+
+    def test_media_filename_is_content_addressed(self):
+        first = Mock(data_url="data:image/png;base64,aGVsbG8=")
+        second = Mock(data_url="data:image/png;base64,aGVsbG8=")
+        different = Mock(data_url="data:image/png;base64,Z29vZGJ5ZQ==")
+
+        first_filename, first_data = self.source._generate_media_data(first)
+        second_filename, _ = self.source._generate_media_data(second)
+        different_filename, _ = self.source._generate_media_data(different)
+
+        assert first_filename == second_filename
+        assert first_filename != different_filename
+        assert first_filename.endswith(".png")
+        assert first_data == "aGVsbG8="
+
+    def test_positioned_records_resume_after_offset(self):
+        items = [get_lln_item(idx, 0, 0) for idx in range(3)]
+        input = io.BytesIO(json.dumps(items).encode("utf-8"))
+        source = LLNJsonSource("lln-json", Mock(input=input, stream=True), Mock())
+        positioned = list(source.get_positioned_records())
+
+        resumed = list(source.get_positioned_records(positioned[0][0]))
+
+        assert [record for _, record in positioned] == items
+        assert resumed == positioned[1:]
@@ -0,0 +1,90 @@
+from unittest import TestCase
+
+from .. import metrics
+
+
+class TestTimer(TestCase):
+    def setUp(self):
+        self.timer = metrics.Timer("test")
+
+        super().setUp()
+
+    def test_add(self):
+        self.timer.add(0.002)
+        self.timer.add(0.004)
+
+        assert self.timer.count == 2
+        assert self.timer.total == 0.006
+        assert self.timer.max == 0.004
+        assert self.timer.mean == 0.003
+
+    def test_buckets_are_cumulative(self):
+        self.timer.add(0.0001)
+        self.timer.add(0.03)
+        self.timer.add(60)
+
+        buckets = self.timer.to_dict()["buckets"]
+
+        assert buckets["0.0005"] == 1
+        assert buckets["0.025"] == 1
+        assert buckets["0.05"] == 2
+        assert buckets["10.0"] == 2
+        assert buckets["+Inf"] == 3
+
+    def test_iterate(self):
+        assert list(self.timer.iterate(range(3))) == [0, 1, 2]
+        assert self.timer.count == 3
+
+    def test_reset(self):
+        self.timer.add(1)
+
+        self.timer.reset()
+
+        assert self.timer.count == 0
+        assert self.timer.total == 0
+        assert sum(self.timer.buckets) == 0
+
+
+class TestRegistry(TestCase):
+    def setUp(self):
+        metrics.reset()
+
+        super().setUp()
+
+    def tearDown(self):
+        metrics.reset()
+
+        super().tearDown()
+
+    def test_timed(self):
+        @metrics.timed("tests.timed")
+        def double(value):
+            return value * 2
+
+        assert double(2) == 4
+        assert metrics.get_timer("tests.timed").count == 1
+
+    def test_to_dict_omits_unused(self):
+        metrics.get_counter("tests.unused")
+        metrics.get_counter("tests.used").add(3)
+
+        counters = metrics.to_dict()["counters"]
+
+        assert counters["tests.used"] == 3
+        assert "tests.unused" not in counters
+
+    def test_to_prometheus(self):
+        metrics.get_timer("anki.findNotes").add(0.02)
+        metrics.get_counter("anki.bytes_sent").add(512)
+
+        exported = metrics.to_prometheus().splitlines()
+
+        assert "# TYPE dejima_operation_duration_seconds histogram" in exported
+        assert (
+            'dejima_operation_duration_seconds_bucket{operation="anki.findNotes",'
+            'le="0.025"} 1'
+        ) in exported
+        assert (
+            'dejima_operation_duration_seconds_count{operation="anki.findNotes"} 1'
+        ) in exported
+        assert "dejima_anki_bytes_sent_total 512" in exported
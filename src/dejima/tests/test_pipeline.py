@@ -0,0 +1,109 @@
+import functools
+import threading
+import time
+from unittest import TestCase
+
+import pytest
+
+from ..pipeline import Pipeline
+
+
+class TestPipeline(TestCase):
+    def test_stages_are_applied_in_order(self):
+        pipeline = Pipeline(range(10))
+        pipeline.add_stage("double", lambda item: item * 2)
+        pipeline.add_stage("increment", lambda item: item + 1)
+
+        actual_result = list(pipeline)
+        expected_result = [item * 2 + 1 for item in range(10)]
+
+        assert actual_result == expected_result
+
+    def test_parallel_stage_preserves_order(self):
+        def slow_for_even(item):
+            if item % 2 == 0:
+                time.sleep(0.01)
+            return item
+
+        pipeline = Pipeline(range(20))
+        pipeline.add_stage("slow", slow_for_even, workers=4)
+
+        assert list(pipeline) == list(range(20))
+
+    def test_process_stage(self):
+        pipeline = Pipeline(range(10))
+        pipeline.add_stage("power", functools.partial(pow, 2), processes=True)
+
+        assert list(pipeline) == [2**item for item in range(10)]
+
+    def test_metrics(self):
+        pipeline = Pipeline(range(5), name="numbers")
+        pipeline.add_stage("square", lambda item: item**2, workers=2)
+
+        list(pipeline)
+
+        assert [(m.name, m.workers, m.items) for m in pipeline.metrics] == [
+            ("numbers", 1, 5),
+            ("square", 2, 5),
+        ]
+
+    def test_source_is_not_read_ahead_unboundedly(self):
+        produced = []
+
+        def numbers():
+            for item in range(1000):
+                produced.append(item)
+                yield item
+
+        pipeline = Pipeline(numbers(), queue_size=2)
+        pipeline.add_stage("identity", lambda item: item)
+
+        iterator = iter(pipeline)
+        next(iterator)
+        time.sleep(0.1)
+
+        # One item in each of the two queues, one held by each thread
+        # waiting for room and the one already consumed.
+        assert len(produced) <= 7
+        pipeline.close()
+
+    def test_stage_errors_are_raised(self):
+        def fail_on_three(item):
+            if item == 3:
+                raise ValueError(item)
+            return item
+
+        pipeline = Pipeline(range(10))
+        pipeline.add_stage("fail", fail_on_three, workers=2)
+
+        consumed = []
+        with pytest.raises(ValueError):
+            for item in pipeline:
+                consumed.append(item)
+
+        assert consumed == [0, 1, 2]
+
+    def test_source_errors_are_raised(self):
+        def broken():
+            yield 1
+            raise ValueError()
+
+        pipeline = Pipeline(broken())
+        pipeline.add_stage("identity", lambda item: item)
+
+        with pytest.raises(ValueError):
+            list(pipeline)
+
+    def test_closing_stops_threads(self):
+        pipeline = Pipeline(iter(int, 1), queue_size=1)
+        pipeline.add_stage("identity", lambda item: item)
+
+        for _ in pipeline:
+            break
+
+        time.sleep(0.3)
+        assert not [
+            thread
+            for thread in threading.enumerate()
+            if thread.name.startswith("pipeline-")
+        ]
@@ -1,5 +1,11 @@
+import argparse
+import pickle
+import tempfile
 from unittest import TestCase
 from unittest.mock import Mock
+from unittest.mock import patch
+
+from rich.console import Console
 
 from .. import plugin
 
@@ -13,3 +19,98 @@ class TestSourcePluginMetaclass(TestCase):
 
         assert source.Front._attribute_name == "Front"
         assert source._fields
+
+
+class TestSourcePlugin(TestCase):
+    class RecordSource(plugin.SourcePlugin):
+        Front = plugin.NoteField()
+
+        def get_records(self):
+            return ["hola", "adios"]
+
+        def get_entry(self, record):
+            return record, plugin.Note(fields={"Front": record})
+
+    def test_get_entries_builds_records(self):
+        source = self.RecordSource("arbitrary", argparse.Namespace(), Mock())
+
+        actual_result = list(source.get_entries())
+        expected_result = [
+            ("hola", plugin.Note(fields={"Front": "hola"})),
+            ("adios", plugin.Note(fields={"Front": "adios"})),
+        ]
+
+        assert actual_result == expected_result
+
+    def test_supports_records(self):
+        class EntrySource(plugin.SourcePlugin):
+            def get_entries(self):
+                return []
+
+        assert self.RecordSource.supports_records()
+        assert not EntrySource.supports_records()
+
+    def test_pickling_drops_open_files(self):
+        with tempfile.TemporaryFile("w") as input:
+            options = argparse.Namespace(input=input, stream=True)
+            source = self.RecordSource("arbitrary", options, Console())
+
+            unpickled = pickle.loads(pickle.dumps(source))
+
+        assert vars(unpickled.options) == {"stream": True}
+        assert unpickled.get_entry("hola") == source.get_entry("hola")
+
+
+class TestMedia(TestCase):
+    def test_data(self):
+        media = plugin.Media("file.txt", b"hello")
+
+        assert media.get_data() == b"hello"
+        assert media.get_encoded() == "aGVsbG8="
+
+    def test_encoded_is_not_decoded(self):
+        with patch("base64.b64decode") as b64decode:
+            media = plugin.Media("file.txt", encoded="aGVsbG8=")
+
+            assert media.get_encoded() == "aGVsbG8="
+            b64decode.assert_not_called()
+
+        assert media.get_data() == b"hello"
+
+    def test_path(self):
+        with tempfile.NamedTemporaryFile() as outf:
+            outf.write(b"hello")
+            outf.flush()
+
+            media = plugin.Media("file.txt", path=outf.name)
+
+            assert media.get_encoded() == "aGVsbG8="
+
+    def test_loader_is_lazy(self):
+        loader = Mock(return_value=b"hello")
+
+        media = plugin.Media("file.txt", loader=loader)
+
+        loader.assert_not_called()
+        assert media.get_data() == b"hello"
+
+    def test_requires_source(self):
+        with self.assertRaises(ValueError):
+            plugin.Media("file.txt")
+
+
+class TestCalculateKey(TestCase):
+    def test_prefix(self):
+        assert plugin.calculate_key("hola").startswith(plugin.KEY_PREFIX)
+
+    def test_values_are_delimited(self):
+        assert plugin.calculate_key("ab", "c") != plugin.calculate_key("a", "bc")
+        assert plugin.calculate_key(None) != plugin.calculate_key("None")
+
+    def test_foreign_key_pickling(self):
+        key = plugin.ForeignKey("v2:abc", legacy="abc")
+
+        unpickled = pickle.loads(pickle.dumps(key))
+
+        assert unpickled == "v2:abc"
+        assert unpickled.legacy == "abc"
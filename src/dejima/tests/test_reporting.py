@@ -0,0 +1,91 @@
+import io
+import json
+from unittest import TestCase
+
+import pytest
+from rich.console import Console
+
+from ..reporting import ImportReporter
+
+
+class TestImportReporter(TestCase):
+    def setUp(self):
+        self.output = io.StringIO()
+        self.console = Console(file=self.output)
+
+        super().setUp()
+
+    def get_reporter(self, mode: str, **kwargs) -> ImportReporter:
+        return ImportReporter(self.console, "import1", mode=mode, **kwargs)
+
+    def test_counts(self):
+        with self.get_reporter("quiet") as reporter:
+            for _ in range(4):
+                reporter.advance()
+            reporter.created(0, "a", 1)
+            reporter.updated(1, "b", 1)
+            reporter.invalid(2, "c", ["Front"])
+            reporter.media_failed(3, "a.jpg", "error")
+
+        assert reporter.counts.total == 4
+        assert reporter.counts.added == 1
+        assert reporter.counts.merged == 1
+        assert reporter.counts.invalid == 1
+        assert reporter.counts.media_failed == 1
+        assert reporter.counts.already_processed == 1
+
+    def test_notes_are_printed_without_styling(self):
+        with self.get_reporter("notes") as reporter:
+            reporter.created(0, "a", 12)
+            reporter.create_failed(1, "b", "[oops]")
+
+        assert self.output.getvalue().splitlines() == [
+            "Created note 12",
+            "Could not create note for Idx 1: [oops]",
+        ]
+
+    def test_progress_prints_failures_only(self):
+        with self.get_reporter("progress") as reporter:
+            reporter.advance()
+            reporter.created(0, "a", 12)
+            reporter.update_failed(1, "b", 12, "oops")
+
+        assert self.output.getvalue().splitlines() == [
+            "Could not update note 12 for Idx 1: oops",
+        ]
+
+    def test_quiet_prints_nothing(self):
+        with self.get_reporter("quiet") as reporter:
+            reporter.created(0, "a", 12)
+            reporter.create_failed(1, "b", "oops")
+
+        assert self.output.getvalue() == ""
+
+    def test_log(self):
+        log = io.StringIO()
+
+        with self.get_reporter("quiet", log=log) as reporter:
+            reporter.created(0, "a", 12)
+            reporter.invalid(1, None, ["Front"])
+
+        lines = [json.loads(line) for line in log.getvalue().splitlines()]
+        assert [{k: v for k, v in line.items() if k != "time"} for line in lines] == [
+            {
+                "import": "import1",
+                "event": "created",
+                "idx": 0,
+                "key": "a",
+                "anki_id": 12,
+            },
+            {
+                "import": "import1",
+                "event": "invalid",
+                "idx": 1,
+                "key": None,
+                "missing": ["Front"],
+            },
+        ]
+
+    def test_unknown_mode(self):
+        with pytest.raises(ValueError):
+            self.get_reporter("loud")
@@ -0,0 +1,98 @@
+import io
+import json
+from unittest import TestCase
+
+import pytest
+
+from ..streaming import JsonArrayReader
+from ..streaming import JsonStreamError
+
+
+class TestJsonArrayReader(TestCase):
+    def read(self, data: str, read_size: int = 3):
+        return list(JsonArrayReader(io.BytesIO(data.encode("utf-8")), read_size))
+
+    def test_items(self):
+        items = [
+            {"text": 'Quoted "text", with [brackets] and {braces}'},
+            ["nested", {"list": [1, 2, 3]}],
+            "escaped \\ backslash \\",
+            12.5,
+            True,
+            None,
+            {"unicode": "él 暗記"},
+        ]
+
+        for read_size in (1, 2, 3, 1024):
+            actual_result = self.read(json.dumps(items), read_size)
+
+            assert actual_result == items
+
+    def test_whitespace(self):
+        actual_result = self.read('\n  [ {"a" : 1} ,\n\t2 ,"three"  ]\n')
+        expected_result = [{"a": 1}, 2, "three"]
+
+        assert actual_result == expected_result
+
+    def test_empty(self):
+        assert self.read(" [ ] ") == []
+
+    def test_text_stream(self):
+        actual_result = list(JsonArrayReader(io.StringIO('[{"a": "é"}]')))
+        expected_result = [{"a": "é"}]
+
+        assert actual_result == expected_result
+
+    def test_offset(self):
+        data = b'[{"a": 1}, {"b": 2}]'
+        reader = JsonArrayReader(io.BytesIO(data), 4)
+        iterator = iter(reader)
+
+        next(iterator)
+
+        assert data[: reader.offset] == b'[{"a": 1}'
+
+    def test_offset_of_each_item(self):
+        data = '[{"a": "é"},\n {"b": "暗記"}, "ü" ]'.encode("utf-8")
+        expected_result = [
+            len('[{"a": "é"}'.encode("utf-8")),
+            len('[{"a": "é"},\n {"b": "暗記"}'.encode("utf-8")),
+            len('[{"a": "é"},\n {"b": "暗記"}, "ü"'.encode("utf-8")),
+        ]
+
+        for read_size in (1, 2, 5, 1024):
+            reader = JsonArrayReader(io.BytesIO(data), read_size)
+            actual_result = [reader.offset for _ in reader]
+
+            assert actual_result == expected_result
+
+    def test_not_an_array(self):
+        with pytest.raises(JsonStreamError):
+            self.read('{"a": 1}')
+
+    def test_truncated(self):
+        with pytest.raises(JsonStreamError):
+            self.read('[{"a": 1}, {"b": ')
+
+    def test_resume_from_offset(self):
+        data = '[{"a": 1}, {"b": "é"} ,\n{"c": 3}]'.encode("utf-8")
+        reader = JsonArrayReader(io.BytesIO(data), 4)
+        iterator = iter(reader)
+        next(iterator)
+        next(iterator)
+        offset = reader.offset
+
+        fp = io.BytesIO(data)
+        fp.seek(offset)
+        resumed = JsonArrayReader(fp, 4, start=offset)
+
+        assert list(resumed) == [{"c": 3}]
+        assert resumed.offset == len(data)
+
+    def test_resume_after_last_item(self):
+        data = b'[{"a": 1} ]'
+
+        fp = io.BytesIO(data)
+        fp.seek(9)
+
+        assert list(JsonArrayReader(fp, start=9)) == []
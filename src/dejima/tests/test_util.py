@@ -0,0 +1,19 @@
+import hashlib
+import io
+from unittest import TestCase
+
+from ..util import get_prefix_hash
+
+
+class TestGetPrefixHash(TestCase):
+    def test_hashes_prefix_without_moving(self):
+        fp = io.BytesIO(b"abcdef")
+        fp.seek(2)
+
+        prefix_hash = get_prefix_hash(fp, 4, read_size=3)
+
+        assert prefix_hash == hashlib.sha256(b"abcd").hexdigest()
+        assert fp.tell() == 2
+
+    def test_shorter_input(self):
+        assert get_prefix_hash(io.BytesIO(b"abc"), 4) is None
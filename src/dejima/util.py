@@ -0,0 +1,81 @@
+import asyncio
+import hashlib
+import itertools
+import os
+import stat
+from typing import IO
+from typing import Awaitable
+from typing import Iterable
+from typing import Iterator
+from typing import List
+from typing import Optional
+from typing import TypeVar
+
+T = TypeVar("T")
+
+
+def chunked(iterable: Iterable[T], size: int) -> Iterator[List[T]]:
+    iterator = iter(iterable)
+
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+
+        yield chunk
+
+
+async def gather_all(awaitables: Iterable[Awaitable[T]]) -> List[T]:
+    # Every awaitable is allowed to finish before an error is raised, so
+    # that no request is left running once its connection is closed.
+    values: List[T] = []
+    for result in await asyncio.gather(*awaitables, return_exceptions=True):
+        if isinstance(result, BaseException):
+            raise result
+        values.append(result)
+
+    return values
+
+
+def get_file_stat(fp: IO) -> Optional[os.stat_result]:
+    # None if ``fp`` is not a regular file.
+    try:
+        info = os.fstat(fp.fileno())
+    except (AttributeError, OSError, ValueError):
+        return None
+
+    return info if stat.S_ISREG(info.st_mode) else None
+
+
+def get_file_fingerprint(fp: IO) -> Optional[str]:
+    # Identifies a file as long as it is not modified.
+    info = get_file_stat(fp)
+    if info is None:
+        return None
+
+    return f"{info.st_dev}:{info.st_ino}:{info.st_size}:{info.st_mtime_ns}"
+
+
+def get_prefix_hash(fp: IO, length: int, read_size: int = 1024 * 1024) -> Optional[str]:
+    # Hashes the first ``length`` bytes of ``fp`` without changing its
+    # position; None if it cannot seek or is shorter than that.
+    stream = getattr(fp, "buffer", fp)
+    try:
+        position = stream.tell()
+        stream.seek(0)
+    except (AttributeError, OSError, ValueError):
+        return None
+
+    digest = hashlib.sha256()
+    remaining = length
+    try:
+        while remaining:
+            data = stream.read(min(remaining, read_size))
+            if not data:
+                return None
+            digest.update(data)
+            remaining -= len(data)
+    finally:
+        stream.seek(position)
+
+    return digest.hexdigest()